@@ -1,46 +1,82 @@
+import time
+
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
 
-# import ssl
 import logging
 
-# from database import DB_URI, CERT_PATH
-
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("logger")
 
 db = SQLAlchemy()
 
 
-def create_app():
+def create_app(config=None):
+    """
+    Application factory. Configures the app and registers its extensions,
+    views and CLI commands without touching the database, Firebase or
+    starting threads: that is done by startup, which is called here unless
+    STARTUP_ON_CREATE is False.
+
+    Parameters
+    ----------
+    config : dict or None
+        Settings overriding the defaults and the environment.
+
+    Returns
+    -------
+    Flask
+        The app.
+    """
     # instantiate the app
     logger.info("Instantiating Flask app.")
     app = Flask(__name__)
     app.config.from_object(__name__)
+    app.config.update(config or {})
 
     logger.info("Instantiating db with Flask app.")
-    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///docs.db"
-    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-    # app.config["SQLALCHEMY_DATABASE_URI"] = DB_URI
+    import database
 
-    # ssl_context = ssl.create_default_context()
-    # ssl_context.verify_mode = ssl.CERT_REQUIRED
-    # ssl_context.load_verify_locations(CERT_PATH)
-    # app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    #     "connect_args": {"ssl_context": ssl_context}
-    # }
+    # Backend (sqlite or postgres), URI and pool options, from the config or env
+    database.configure_app(app)
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
     db.init_app(app)  # init of db is deferred
 
-    # If no database exists, set to True to create database tables
-    CREATE_TABLES = False
-    if CREATE_TABLES:
-        with app.app_context():
-            from models import Document  # noqa: F401; All models need to be imported for db.create_all() to create relevat tables
+    import tokens
+
+    tokens.init_app(app)
+
+    from models import init_change_log, init_entity_cache
+
+    init_entity_cache(app)
+    init_change_log(app)
+
+    # Database migration commands, migrations are applied by startup
+    import migrations
+
+    migrations.init_app(app)
+
+    # Health checks of the documents' links, as a CLI command and scheduled
+    import linkcheck
+
+    linkcheck.init_app(app)
+
+    # orjson encoding and negotiated MessagePack responses
+    import serialization
 
-            logger.info("CREATE_TABLES flag set to True - creating new database.")
-            db.create_all()
+    serialization.init_app(app)
+
+    # Shared cache of the list endpoints' responses, opened on first use
+    import response_cache
+
+    response_cache.init_app(app)
+
+    # Negotiated gzip/brotli compression of large and streamed responses
+    import compression
+
+    compression.init_app(app)
 
     # enable CORS (needed for Vue)
     logger.info("Enabling CORS.")
@@ -50,8 +86,16 @@ def create_app():
     # register views
     from views import (
         Ping,
+        Stats,
+        Metrics,
+        Queries,
         AllDocuments,
+        SearchDocuments,
+        DocumentChanges,
+        ExportDocuments,
+        BatchDocuments,
         UploadFile,
+        SingleJob,
         SingleDocument,
         AllUsers,
         AllAdmins,
@@ -62,10 +106,26 @@ def create_app():
 
     logger.info("Registering views.")
     app.add_url_rule("/api/pong", view_func=Ping.as_view("ping"))
+    app.add_url_rule("/api/stats", view_func=Stats.as_view("stats"))
+    app.add_url_rule("/api/metrics", view_func=Metrics.as_view("metrics"))
+    app.add_url_rule("/api/queries", view_func=Queries.as_view("queries"))
     app.add_url_rule("/api/documents", view_func=AllDocuments.as_view("document_list"))
+    app.add_url_rule(
+        "/api/documents/search", view_func=SearchDocuments.as_view("document_search")
+    )
+    app.add_url_rule(
+        "/api/documents/changes", view_func=DocumentChanges.as_view("document_changes")
+    )
+    app.add_url_rule(
+        "/api/documents/export", view_func=ExportDocuments.as_view("document_export")
+    )
+    app.add_url_rule(
+        "/api/documents/batch", view_func=BatchDocuments.as_view("document_batch")
+    )
     app.add_url_rule(
         "/api/documents/upload_file", view_func=UploadFile.as_view("upload_file")
     )
+    app.add_url_rule("/api/jobs/<job_id>", view_func=SingleJob.as_view("single_job"))
     app.add_url_rule(
         "/api/documents/<doc_identifier>",
         view_func=SingleDocument.as_view("single_document"),
@@ -77,17 +137,83 @@ def create_app():
     app.add_url_rule(
         "/api/domains/<pk>", view_func=SingleDomain.as_view("single_domain")
     )
+    if app.config.setdefault("STARTUP_ON_CREATE", True):
+        startup(app)
     return app
 
 
-app = create_app()
-
-with app.app_context():
-    from models import User, db
+def startup(app):
+    """
+    Startup hook: initialize the database engine, metrics and query log,
+    apply the migrations, start the upload job workers, initialize Firebase
+    and start the link checker. Runs once per app. Each step is timed, the
+    timings are kept in app.extensions["startup"] and a warning is logged if
+    startup takes longer than STARTUP_BUDGET_MS.
+
+    Parameters
+    ----------
+    app : Flask
+        App created by create_app.
+    """
+    if "startup" in app.extensions:
+        return
+
+    import database
+    import jobs
+    import linkcheck
+    import metrics
+    import migrations
+    import query_log
+    import tokens
+    from models import entity_cache
+    from response_cache import response_cache
+
+    def init_engine():
+        with app.app_context():
+            database.init_engine(app, db.engine)
+            # Request, query and auth metrics, served at /api/metrics
+            metrics.init_app(app, db.engine)
+            # Statement timings by fingerprint and slow query log, at /api/queries
+            query_log.init_app(app, db.engine)
+        metrics.registry.add_collector(
+            "token_cache", metrics.cache_collector("token", tokens.token_cache)
+        )
+        metrics.registry.add_collector(
+            "entity_cache", metrics.cache_collector("entity", entity_cache)
+        )
+        metrics.registry.add_collector(
+            "response_cache", metrics.cache_collector("response", response_cache)
+        )
+
+    steps = [
+        ("engine", init_engine),
+        # Create the database tables, or upgrade an existing database in place
+        ("migrations", lambda: migrations.migrate_app(app)),
+        # Start the upload job workers, resuming unfinished jobs
+        ("jobs", lambda: jobs.init_app(app)),
+        ("firebase", lambda: tokens.init_firebase(app)),
+        # Check the documents' links every LINK_CHECK_INTERVAL seconds
+        ("linkcheck", lambda: linkcheck.start_scheduler(app)),
+    ]
+
+    timings = {}
+    start = time.perf_counter()
+    for name, step in steps:
+        step_start = time.perf_counter()
+        step()
+        timings[name] = round(1000 * (time.perf_counter() - step_start), 1)
+    total = round(1000 * (time.perf_counter() - start), 1)
+    app.extensions["startup"] = dict(timings, total=total)
+
+    budget = app.config.setdefault("STARTUP_BUDGET_MS", 2000)
+    if total > budget:
+        logger.warning(
+            f"Startup: Took {total} ms, over the {budget} ms budget: {timings}."
+        )
+    else:
+        logger.info(f"Startup: Took {total} ms: {timings}.")
 
-    nb_users = User.query.count()
-    logger.info(f"HERE::::: {nb_users} users")
 
 if __name__ == "__main__":
     logger.info("Starting app.")
-    app.run()
+    create_app().run()
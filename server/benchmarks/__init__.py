@@ -0,0 +1,14 @@
+"""
+Reproducible benchmarks of the API endpoints.
+
+Run from the server directory, e.g.:
+
+    $ python -m benchmarks --sizes 1000 100000 --output results.json
+    $ python -m benchmarks --sizes 1000 --compare results.json
+
+The startup time of the app is measured in fresh interpreters, and the run
+fails if it exceeds --startup-budget-ms.
+
+Catalogs are generated synthetically and Firebase token verification is
+replaced by a local signer, so no network access or credentials are needed.
+"""
@@ -0,0 +1,119 @@
+import argparse
+import datetime
+import json
+import logging
+import platform
+import sys
+import tempfile
+
+from importlib.metadata import version
+
+from benchmarks.auth import install, LocalSigner
+from benchmarks.runner import BenchmarkRun, compare
+from benchmarks.startup import measure_startup
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks", description="Benchmark the API endpoints."
+    )
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[1000],
+        help="catalog sizes to benchmark, e.g. 1000 100000 1000000",
+    )
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument(
+        "--list-iterations",
+        type=int,
+        default=5,
+        help="requests for the endpoints returning the full catalog",
+    )
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--workdir", default=None, help="defaults to a temp directory")
+    parser.add_argument("--output", default=None, help="write the JSON report here")
+    parser.add_argument("--compare", default=None, help="baseline JSON report")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="relative slowdown flagged as a regression (default 0.2)",
+    )
+    parser.add_argument(
+        "--startup-runs",
+        type=int,
+        default=5,
+        help="app starts in fresh interpreters, 0 to skip the startup benchmark",
+    )
+    parser.add_argument(
+        "--startup-budget-ms",
+        type=float,
+        default=2000,
+        help="fail if the median warm start exceeds this (default 2000)",
+    )
+    args = parser.parse_args(argv)
+
+    logging.getLogger("logger").setLevel(logging.WARNING)
+    install(LocalSigner())
+
+    report = {
+        "meta": {
+            "time": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "flask": version("flask"),
+            "sqlalchemy": version("sqlalchemy"),
+            "iterations": args.iterations,
+            "list_iterations": args.list_iterations,
+            "concurrency": args.concurrency,
+        },
+        "results": {},
+    }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            run = BenchmarkRun(
+                size,
+                args.workdir or tmp,
+                LocalSigner(),
+                iterations=args.iterations,
+                list_iterations=args.list_iterations,
+                concurrency=args.concurrency,
+            )
+            report["results"][str(size)] = run.run()
+        if args.startup_runs > 0:
+            report["results"]["startup"] = measure_startup(
+                args.workdir or tmp, runs=args.startup_runs
+            )
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    failed = False
+    startup = report["results"].get("startup")
+    if startup and startup["warm_start"]["p50_ms"] > args.startup_budget_ms:
+        print(
+            f"OVER BUDGET: warm start {startup['warm_start']['p50_ms']} ms > "
+            f"{args.startup_budget_ms} ms",
+            file=sys.stderr,
+        )
+        failed = True
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, report, threshold=args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}", file=sys.stderr)
+        if regressions:
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,88 @@
+import base64
+import hashlib
+import hmac
+import json
+import time
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def _unb64(data):
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+class LocalSigner(object):
+    """
+    Issues and verifies HS256 JWTs with a local secret, standing in for
+    Firebase ID tokens.
+    """
+
+    def __init__(self, secret=b"benchmark-secret", lifetime=3600):
+        self.secret = secret
+        self.lifetime = lifetime
+
+    def issue(self, email):
+        """
+        Issue a token for the given email.
+
+        Parameters
+        ----------
+        email : str
+            Email claim of the token.
+
+        Returns
+        -------
+        str
+            Signed token.
+        """
+        now = int(time.time())
+        header = {"alg": "HS256", "typ": "JWT"}
+        claims = {"email": email, "sub": email, "iat": now, "exp": now + self.lifetime}
+        signing_input = (
+            _b64(json.dumps(header).encode()) + "." + _b64(json.dumps(claims).encode())
+        )
+        signature = hmac.new(self.secret, signing_input.encode(), hashlib.sha256)
+        return signing_input + "." + _b64(signature.digest())
+
+    def verify_id_token(self, token, *args, **kwargs):
+        """
+        Drop-in replacement for firebase_admin.auth.verify_id_token.
+
+        Raises
+        ------
+        ValueError
+            Raised if the token is malformed, wrongly signed or expired.
+        """
+        try:
+            signing_input, signature = token.rsplit(".", 1)
+            claims = json.loads(_unb64(signing_input.split(".")[1]))
+        except Exception:
+            raise ValueError("Malformed token")
+        expected = hmac.new(self.secret, signing_input.encode(), hashlib.sha256)
+        if not hmac.compare_digest(_unb64(signature), expected.digest()):
+            raise ValueError("Invalid signature")
+        if claims["exp"] <= time.time():
+            raise ValueError("Token expired")
+        claims["uid"] = claims["sub"]
+        return claims
+
+
+def install(signer):
+    """
+    Replace Firebase token verification with the local signer.
+
+    Parameters
+    ----------
+    signer : LocalSigner
+        Signer whose tokens are accepted.
+    """
+    import firebase_admin
+    from firebase_admin import auth
+
+    try:
+        firebase_admin.get_app()
+    except ValueError:
+        firebase_admin.initialize_app(options={"projectId": "benchmark"})
+    auth.verify_id_token = signer.verify_id_token
@@ -0,0 +1,68 @@
+import random
+
+from uploads import UPLOAD_COLUMNS
+
+WORDS = (
+    "coronagraph telescope mirror design thermal analysis optical bench camera "
+    "detector wavefront control deformable segment primary secondary alignment "
+    "calibration instrument requirements interface drawing tree budget review "
+    "structure vibration model test plan report guide spectrograph exoplanet"
+).split()
+
+
+def _words(rng, n):
+    return " ".join(rng.choice(WORDS) for _ in range(n))
+
+
+def generate_lines(n, seed=0, prefix="Synthetic"):
+    """
+    Generate the lines of a synthetic metadata file, in the docs.txt pipe
+    format accepted by the UploadFile endpoint.
+
+    Parameters
+    ----------
+    n : int
+        Number of documents.
+    seed : int
+        Seed of the random generator, so catalogs are reproducible.
+    prefix : str
+        Prefix of the titles, to keep titles unique across catalogs.
+
+    Yields
+    ------
+    str
+        Header comment, then one line per document.
+    """
+    rng = random.Random(seed)
+    yield "# " + ", ".join(c.replace("_", " ").title() for c in UPLOAD_COLUMNS)
+    for i in range(n):
+        yield " | ".join(
+            [
+                f"{prefix} {i:07d} {_words(rng, 4).title()}",
+                f"{rng.choice(WORDS).title()} {rng.choice(WORDS).title()}",
+                f"DOC-{i % 1000:03d}" if rng.random() < 0.5 else "",
+                f"https://github.com/uasal/docs/raw/compiled/doc_{i}.pdf",
+                f"https://github.com/uasal/docs/tree/main/doc_{i}",
+                _words(rng, rng.randint(5, 60)),
+            ]
+        )
+
+
+def write_catalog(path, n, seed=0, prefix="Synthetic"):
+    """
+    Write a synthetic metadata file.
+
+    Parameters
+    ----------
+    path : str
+        Path of the file to write.
+    n : int
+        Number of documents.
+    seed : int
+        Seed of the random generator.
+    prefix : str
+        Prefix of the titles.
+    """
+    with open(path, "w") as f:
+        for line in generate_lines(n, seed=seed, prefix=prefix):
+            f.write(line + "\n")
@@ -0,0 +1,445 @@
+from concurrent.futures import ThreadPoolExecutor
+import io
+import itertools
+import os
+import random
+import time
+
+from benchmarks.catalog import generate_lines
+from uploads import parse_metadata_lines
+
+import logging
+
+logger = logging.getLogger("logger")
+
+ADMIN_EMAIL = "admin@benchmark.org"
+MEMBER_EMAIL = "member@benchmark.org"
+
+# Rows inserted per transaction when seeding a catalog
+SEED_CHUNK_SIZE = 5000
+
+
+def percentile(sorted_values, q):
+    """
+    Return the q-th percentile (0 <= q <= 100) of sorted values, using
+    linear interpolation between the closest ranks.
+    """
+    if not sorted_values:
+        return 0.0
+    position = (len(sorted_values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (
+        position - lower
+    )
+
+
+def summarize(latencies, elapsed, errors=0):
+    """
+    Summarize request latencies (in seconds).
+
+    Returns
+    -------
+    dict
+        Request and error counts, latency mean and percentiles in ms, and
+        throughput in requests per second.
+    """
+    values = sorted(latencies)
+    return {
+        "requests": len(values),
+        "errors": errors,
+        "mean_ms": round(1000 * sum(values) / len(values), 3) if values else 0.0,
+        "p50_ms": round(1000 * percentile(values, 50), 3),
+        "p90_ms": round(1000 * percentile(values, 90), 3),
+        "p99_ms": round(1000 * percentile(values, 99), 3),
+        "max_ms": round(1000 * values[-1], 3) if values else 0.0,
+        "throughput_rps": round(len(values) / elapsed, 2) if elapsed else 0.0,
+    }
+
+
+class BenchmarkRun(object):
+    """Benchmarks of every API endpoint against one synthetic catalog."""
+
+    def __init__(
+        self, size, workdir, signer, iterations=50, list_iterations=5, concurrency=8
+    ):
+        """
+        Parameters
+        ----------
+        size : int
+            Number of documents in the catalog.
+        workdir : str
+            Directory the benchmark database is created in.
+        signer : benchmarks.auth.LocalSigner
+            Signer issuing the tokens of the benchmark users.
+        iterations : int
+            Number of requests per endpoint.
+        list_iterations : int
+            Number of requests for the endpoints returning the full catalog.
+        concurrency : int
+            Number of concurrent clients of the load scenarios.
+        """
+        self.size = size
+        self.workdir = workdir
+        self.signer = signer
+        self.iterations = iterations
+        self.list_iterations = list_iterations
+        self.concurrency = concurrency
+        self.rng = random.Random(size)
+        self.counter = itertools.count()
+
+    def setup(self):
+        """Create the app on a fresh database and seed the catalog and users."""
+        from app import create_app, db
+        from models import Document, User
+
+        path = os.path.join(self.workdir, f"benchmark_{self.size}.db")
+        cache_path = os.path.join(self.workdir, f"benchmark_{self.size}_responses.db")
+        for p in [path, cache_path, cache_path + "-wal", cache_path + "-shm"]:
+            if os.path.exists(p):
+                os.remove(p)
+        self.app = create_app(
+            {
+                "SQLALCHEMY_DATABASE_URI": f"sqlite:///{path}",
+                "RESPONSE_CACHE_PATH": cache_path,
+                "TOKEN_KEY_PREFETCH": False,
+            }
+        )
+        self.client = self.app.test_client()
+        self.admin = {"Authorization": self.signer.issue(ADMIN_EMAIL)}
+        self.member = {"Authorization": self.signer.issue(MEMBER_EMAIL)}
+
+        start = time.perf_counter()
+        with self.app.app_context():
+            User.create(email=ADMIN_EMAIL, superuser=True)
+            User.create(email=MEMBER_EMAIL, superuser=False)
+
+            rows = parse_metadata_lines(generate_lines(self.size, seed=self.size))
+            for start_row in range(0, len(rows), SEED_CHUNK_SIZE):
+                chunk = rows[start_row : start_row + SEED_CHUNK_SIZE]
+                for _, fields in chunk:
+                    fields["creator_email"] = MEMBER_EMAIL
+                Document.bulk_create(chunk, chunk_size=SEED_CHUNK_SIZE)
+                db.session.commit()
+
+            self.doc_identifiers = db.session.scalars(
+                db.select(Document.doc_identifier)
+            ).all()
+        logger.info(
+            f"Benchmarks: Seeded {self.size} documents in "
+            f"{time.perf_counter() - start:.1f}s."
+        )
+
+    def _unique(self, prefix):
+        return f"{prefix} {self.size} {next(self.counter)}"
+
+    def time_requests(self, make_request, iterations, client=None):
+        """
+        Time sequential requests.
+
+        Parameters
+        ----------
+        make_request : callable
+            Function taking a test client and sending one request.
+        iterations : int
+            Number of requests.
+        client : flask.testing.FlaskClient or None
+            Test client, defaults to the run's client.
+
+        Returns
+        -------
+        dict
+            Summary of the latencies, see summarize.
+        """
+        client = client or self.client
+        latencies = []
+        errors = 0
+        start = time.perf_counter()
+        for _ in range(iterations):
+            request_start = time.perf_counter()
+            response = make_request(client)
+            # Read the body, so streamed responses are timed in full
+            response.get_data()
+            latencies.append(time.perf_counter() - request_start)
+            if response.status_code >= 400 or (
+                response.is_json and response.json.get("status") == "fail"
+            ):
+                errors += 1
+        return summarize(latencies, time.perf_counter() - start, errors)
+
+    def time_concurrent(self, make_request, iterations):
+        """
+        Time requests sent by self.concurrency concurrent clients, each
+        sending the given number of requests.
+
+        Returns
+        -------
+        dict
+            Summary of the latencies of all requests, see summarize. The
+            throughput is that of all clients together.
+        """
+
+        def worker(_):
+            client = self.app.test_client()
+            latencies = []
+            errors = 0
+            for _ in range(iterations):
+                request_start = time.perf_counter()
+                response = make_request(client)
+                response.get_data()
+                latencies.append(time.perf_counter() - request_start)
+                errors += response.status_code >= 400
+            return latencies, errors
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(self.concurrency) as executor:
+            results = list(executor.map(worker, range(self.concurrency)))
+        elapsed = time.perf_counter() - start
+        latencies = [latency for result in results for latency in result[0]]
+        return summarize(latencies, elapsed, sum(result[1] for result in results))
+
+    def time_encoding(self, iterations):
+        """
+        Time the encoding of the full catalog listing payload with Flask's
+        stdlib json provider, the app's provider (orjson, with HTTP and ISO
+        datetimes) and MessagePack.
+
+        Returns
+        -------
+        dict
+            Summary of the encode times by encoder, see summarize, with the
+            size of the payload in 'bytes'.
+        """
+        from flask.json.provider import DefaultJSONProvider
+        from models import Document
+        import serialization
+
+        with self.app.app_context():
+            payload = {
+                "status": "success",
+                "documents": Document.select_dicts(Document.select_columns()),
+                "superuser": False,
+            }
+            stdlib = DefaultJSONProvider(self.app)
+            provider = serialization.JSONProvider(self.app)
+            self.app.config["JSON_DATETIME_FORMAT"] = "iso"
+            iso_provider = serialization.JSONProvider(self.app)
+            self.app.config["JSON_DATETIME_FORMAT"] = "http"
+
+            encoders = {
+                "json[stdlib]": lambda: stdlib.dumps(payload).encode(),
+                "json[app]": lambda: provider.encode(payload),
+                "json[app,iso]": lambda: iso_provider.encode(payload),
+            }
+            if serialization.msgpack is not None:
+                encoders["msgpack"] = lambda: provider.encode_msgpack(payload)
+
+            results = {}
+            for name, encode in encoders.items():
+                latencies = []
+                start = time.perf_counter()
+                for _ in range(iterations):
+                    encode_start = time.perf_counter()
+                    data = encode()
+                    latencies.append(time.perf_counter() - encode_start)
+                results[f"encode[{name}]"] = dict(
+                    summarize(latencies, time.perf_counter() - start),
+                    bytes=len(data),
+                )
+        return results
+
+    def _random_doc_identifier(self):
+        return self.rng.choice(self.doc_identifiers)
+
+    def _new_document(self):
+        return {
+            "title": self._unique("Benchmark document"),
+            "author": "Benchmark",
+            "compiled_url": "https://example.org/compiled.pdf",
+            "source_url": "https://example.org/source",
+            "abstract": "Benchmark abstract",
+            "creator_email": MEMBER_EMAIL,
+        }
+
+    def _upload_file(self, nb_lines=100):
+        prefix = self._unique("Benchmark upload")
+        content = "\n".join(generate_lines(nb_lines, seed=nb_lines, prefix=prefix))
+        return {"file": (io.BytesIO(content.encode()), "upload.txt", "text/plain")}
+
+    def run(self):
+        """
+        Run every scenario.
+
+        Returns
+        -------
+        dict
+            Summary of each scenario, keyed by scenario name.
+        """
+        self.setup()
+        created = []
+
+        def post_document(client):
+            return client.post(
+                "/api/documents", json=self._new_document(), headers=self.admin
+            )
+
+        def delete_document(client):
+            doc_identifier = created.pop() if created else self._random_doc_identifier()
+            return client.delete(f"/api/documents/{doc_identifier}", headers=self.admin)
+
+        def put_document(client):
+            doc_identifier = self._random_doc_identifier()
+            return client.put(
+                f"/api/documents/{doc_identifier}",
+                json={
+                    "compiled_url": "https://example.org/moved.pdf",
+                    "source_url": "https://example.org/moved",
+                },
+                headers=self.admin,
+            )
+
+        scenarios = {
+            "AllDocuments.get": (
+                lambda c: c.get("/api/documents", headers=self.member),
+                self.list_iterations,
+            ),
+            # A new query parameter each time, so the response cache misses
+            "AllDocuments.get[miss]": (
+                lambda c: c.get(
+                    f"/api/documents?miss={next(self.counter)}", headers=self.member
+                ),
+                self.list_iterations,
+            ),
+            "AllDocuments.get[stream]": (
+                lambda c: c.get("/api/documents?stream=true", headers=self.member),
+                self.list_iterations,
+            ),
+            "AllDocuments.get[msgpack]": (
+                lambda c: c.get(
+                    "/api/documents",
+                    headers=dict(self.member, Accept="application/msgpack"),
+                ),
+                self.list_iterations,
+            ),
+            "AllDocuments.get[page]": (
+                lambda c: c.get("/api/documents?limit=50", headers=self.member),
+                self.iterations,
+            ),
+            "AllDocuments.post": (post_document, self.iterations),
+            "SingleDocument.get": (
+                lambda c: c.get(
+                    f"/api/documents/{self._random_doc_identifier()}", headers=self.member
+                ),
+                self.iterations,
+            ),
+            "SingleDocument.put": (put_document, self.iterations),
+            "SingleDocument.delete": (delete_document, self.iterations),
+            "UploadFile.post": (
+                lambda c: c.post(
+                    "/api/documents/upload_file",
+                    data=self._upload_file(),
+                    headers=self.admin,
+                ),
+                max(1, self.iterations // 5),
+            ),
+            "AllUsers.get": (
+                lambda c: c.get("/api/users", headers=self.admin),
+                self.iterations,
+            ),
+            "AllUsers.post": (
+                lambda c: c.post(
+                    "/api/users",
+                    json={
+                        "email": f"user{next(self.counter)}@benchmark.org",
+                        "superuser": False,
+                    },
+                    headers=self.admin,
+                ),
+                self.iterations,
+            ),
+            "AllAdmins.get": (
+                lambda c: c.get("/api/admins", headers=self.member),
+                self.iterations,
+            ),
+            "AllDomains.get": (
+                lambda c: c.get("/api/domains", headers=self.admin),
+                self.iterations,
+            ),
+            "AllDomains.post": (
+                lambda c: c.post(
+                    "/api/domains",
+                    json={"email_domain": f"domain{next(self.counter)}.org"},
+                    headers=self.admin,
+                ),
+                self.iterations,
+            ),
+        }
+
+        results = {}
+        for name, (make_request, iterations) in scenarios.items():
+            if name == "SingleDocument.delete":
+                with self.app.app_context():
+                    from models import Document
+
+                    created.extend(
+                        d["doc_identifier"]
+                        for d in Document.select_dicts(
+                            Document.select_columns().where(
+                                Document.title.startswith("Benchmark document")
+                            )
+                        )
+                    )
+            logger.info(f"Benchmarks: Running {name} on {self.size} documents.")
+            results[name] = self.time_requests(make_request, iterations)
+
+        results.update(self.time_encoding(self.list_iterations))
+        results["concurrent[AllDocuments.get[page]]"] = self.time_concurrent(
+            lambda c: c.get("/api/documents?limit=50", headers=self.member),
+            self.iterations,
+        )
+        results["concurrent[SingleDocument.get+put]"] = self.time_concurrent(
+            lambda c: put_document(c)
+            if self.rng.random() < 0.2
+            else c.get(
+                f"/api/documents/{self._random_doc_identifier()}", headers=self.member
+            ),
+            self.iterations,
+        )
+        return results
+
+
+def compare(baseline, current, threshold=0.2, metrics=("p50_ms", "p99_ms")):
+    """
+    Compare two benchmark reports.
+
+    Parameters
+    ----------
+    baseline : dict
+        Report of the reference run.
+    current : dict
+        Report of the new run.
+    threshold : float
+        Relative slowdown above which a metric is flagged as a regression.
+    metrics : tuple
+        Latency metrics compared.
+
+    Returns
+    -------
+    list
+        Descriptions of the regressions, empty if there are none.
+    """
+    regressions = []
+    for size, scenarios in current["results"].items():
+        for name, summary in scenarios.items():
+            reference = baseline.get("results", {}).get(size, {}).get(name)
+            if not reference:
+                continue
+            for metric in metrics:
+                before, after = reference[metric], summary[metric]
+                if before > 0 and after > before * (1 + threshold):
+                    label = f"{size} documents" if size.isdigit() else size
+                    regressions.append(
+                        f"{label}, {name}: {metric} {before} -> {after} "
+                        f"(+{100 * (after / before - 1):.0f}%)"
+                    )
+    return regressions
@@ -0,0 +1,106 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+from benchmarks.runner import summarize
+
+import logging
+
+logger = logging.getLogger("logger")
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Run in a fresh interpreter, so module imports are not already cached
+_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+firebase_on_import = "firebase_admin" in sys.modules
+application = app.create_app(json.loads(sys.argv[1]))
+created = time.perf_counter()
+print(json.dumps({
+    "import": imported - start,
+    "create_app": created - imported,
+    "steps": application.extensions["startup"],
+    "firebase_on_import": firebase_on_import,
+}))
+"""
+
+
+def _start_once(config):
+    output = subprocess.run(
+        [sys.executable, "-c", _SCRIPT, json.dumps(config)],
+        cwd=SERVER_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def measure_startup(workdir, runs=5):
+    """
+    Measure the startup time of the app in fresh interpreters: the import of
+    the app module, which must not touch the database or Firebase, and
+    create_app including the startup hook, on a new database (cold start,
+    all migrations applied) and on an up to date one (warm start).
+
+    Parameters
+    ----------
+    workdir : str
+        Directory of the benchmark database.
+    runs : int
+        Number of warm starts.
+
+    Returns
+    -------
+    dict
+        Summaries of the 'import', 'cold_start' and 'warm_start' times, see
+        summarize, with the mean duration of each startup step in ms.
+
+    Raises
+    ------
+    RuntimeError
+        Raised if importing the app module imports firebase_admin.
+    """
+    path = os.path.join(workdir, "benchmark_startup.db")
+    if os.path.exists(path):
+        os.remove(path)
+    config = {
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{path}",
+        "TOKEN_KEY_PREFETCH": False,
+    }
+
+    start = time.perf_counter()
+    cold = _start_once(config)
+    cold_elapsed = time.perf_counter() - start
+
+    samples = []
+    start = time.perf_counter()
+    for _ in range(runs):
+        samples.append(_start_once(config))
+    warm_elapsed = time.perf_counter() - start
+
+    if any(s["firebase_on_import"] for s in [cold] + samples):
+        raise RuntimeError("Importing the app module imported firebase_admin")
+
+    results = {
+        "import": summarize([s["import"] for s in samples], warm_elapsed),
+        "cold_start": summarize([cold["import"] + cold["create_app"]], cold_elapsed),
+        "warm_start": summarize(
+            [s["import"] + s["create_app"] for s in samples], warm_elapsed
+        ),
+    }
+    results["cold_start"]["steps_ms"] = cold["steps"]
+    results["warm_start"]["steps_ms"] = {
+        name: round(sum(s["steps"][name] for s in samples) / len(samples), 1)
+        for name in samples[0]["steps"]
+    }
+    logger.info(
+        f"Benchmarks: Warm start in {results['warm_start']['p50_ms']} ms "
+        f"(import {results['import']['p50_ms']} ms)."
+    )
+    return results
@@ -0,0 +1,137 @@
+from collections import OrderedDict
+import threading
+import time
+
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("logger")
+
+
+class LRUCache(object):
+    """
+    Thread-safe, size-bounded LRU cache whose entries can expire.
+
+    Each entry is stored with an absolute expiry time (seconds since the epoch).
+    Expired entries are dropped lazily when they are looked up, and the least
+    recently used entry is evicted when the cache grows past ``maxsize``.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None, clock=time.time):
+        """
+        Parameters
+        ----------
+        maxsize : int
+            Maximum number of entries kept in the cache.
+        ttl : float or None
+            Default time to live (in seconds) of entries added without an
+            explicit expiry. None means entries never expire.
+        clock : callable
+            Function returning the current time in seconds since the epoch.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        """
+        Return the value stored for key and mark it as recently used.
+
+        Parameters
+        ----------
+        key : hashable
+            Key of the entry to look up.
+        default : any
+            Value returned if the key is missing or its entry has expired.
+
+        Returns
+        -------
+        any
+            Cached value or default.
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= self._clock():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, expires_at=None):
+        """
+        Store value for key, evicting the least recently used entries if needed.
+
+        Parameters
+        ----------
+        key : hashable
+            Key of the entry.
+        value : any
+            Value to store.
+        expires_at : float or None
+            Absolute expiry time in seconds since the epoch. If None, the
+            cache's default ttl is used.
+        """
+        if expires_at is None and self.ttl is not None:
+            expires_at = self._clock() + self.ttl
+
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key):
+        """
+        Remove the entry for key, if any.
+
+        Parameters
+        ----------
+        key : hashable
+            Key of the entry to remove.
+        """
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """Remove all entries from the cache."""
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """
+        Return the cache counters.
+
+        Returns
+        -------
+        dict
+            Dictionary with the hit, miss, eviction and expiration counters,
+            as well as the current and maximum sizes of the cache.
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+            }
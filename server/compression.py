@@ -0,0 +1,221 @@
+import zlib
+
+from flask import request
+
+from cache import LRUCache
+
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("logger")
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+# Content encodings, in order of preference
+ENCODINGS = ["br", "gzip"] if brotli is not None else ["gzip"]
+
+COMPRESSIBLE_MIMETYPES = {
+    "application/json",
+    "application/msgpack",
+    "application/x-ndjson",
+    "text/csv",
+    "text/html",
+    "text/plain",
+}
+
+# Compressed bodies keyed by (ETag, encoding). ETags change with the table
+# generations, so entries of outdated catalogs are never hit again and age out.
+compressed_cache = LRUCache(maxsize=32)
+
+_settings = {}
+
+
+class _Compressor(object):
+    """Incremental compressor with the same interface for gzip and brotli."""
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=_settings["brotli_quality"])
+        else:
+            # wbits=31 writes a gzip header and trailer
+            self._compressor = zlib.compressobj(_settings["level"], zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        """Compress a chunk and flush it, so it can be sent immediately."""
+        if self.encoding == "br":
+            return self._compressor.process(data) + self._compressor.flush()
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        """Return the end of the compressed stream."""
+        if self.encoding == "br":
+            return self._compressor.finish()
+        return self._compressor.flush()
+
+
+def compress(data, encoding):
+    """
+    Compress a whole body.
+
+    Parameters
+    ----------
+    data : bytes
+        Body to compress.
+    encoding : str
+        One of ENCODINGS.
+
+    Returns
+    -------
+    bytes
+        Compressed body.
+    """
+    compressor = _Compressor(encoding)
+    return compressor.compress(data) + compressor.finish()
+
+
+def etag_variants(etag):
+    """
+    Return the ETags of all the representations of a response: identity,
+    and one per content encoding.
+
+    Parameters
+    ----------
+    etag : str
+        ETag of the uncompressed response.
+
+    Returns
+    -------
+    list
+        List of ETags.
+    """
+    return [etag] + [f"{etag}-{encoding}" for encoding in ENCODINGS]
+
+
+def _compress_stream(chunks, encoding, cache_key):
+    """
+    Compress the chunks of a streamed response as they are produced. If the
+    whole compressed body stays under COMPRESSION_CACHE_MAX_BYTES, it is
+    cached, so the next requests for the same ETag are served from the cache.
+    """
+    compressor = _Compressor(encoding)
+    max_bytes = _settings["cache_max_bytes"]
+    parts = [] if cache_key else None
+    size = 0
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            data = compressor.compress(chunk)
+            if not data:
+                continue
+            size += len(data)
+            if parts is not None and size <= max_bytes:
+                parts.append(data)
+            else:
+                parts = None
+            yield data
+        data = compressor.finish()
+        if parts is not None and size + len(data) <= max_bytes:
+            parts.append(data)
+            compressed_cache.set(cache_key, b"".join(parts))
+        yield data
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+
+def compress_response(response):
+    """
+    after_request hook compressing responses with the best content encoding
+    accepted by the client.
+
+    Bodies of known length are compressed if they are at least
+    COMPRESSION_MIN_SIZE bytes long. Streamed bodies are compressed chunk by
+    chunk. Responses with an ETag are cached compressed and their ETag gets
+    the encoding as suffix, so each representation has its own ETag.
+
+    Parameters
+    ----------
+    response : flask.Response
+        Response to compress.
+
+    Returns
+    -------
+    flask.Response
+        The response, compressed if applicable.
+    """
+    if response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return response
+    response.vary.add("Accept-Encoding")
+
+    etag, _ = response.get_etag()
+    if response.status_code == 304:
+        # Echo the ETag of the representation the client holds
+        if etag and request.if_none_match:
+            for variant in etag_variants(etag):
+                if request.if_none_match.contains(variant):
+                    response.set_etag(variant)
+                    break
+        return response
+
+    if (
+        response.status_code != 200
+        or response.direct_passthrough
+        or "Content-Encoding" in response.headers
+        or request.method == "HEAD"
+    ):
+        return response
+
+    encoding = request.accept_encodings.best_match(ENCODINGS)
+    if encoding is None:
+        return response
+
+    cache_key = (etag, encoding) if etag else None
+    cached = compressed_cache.get(cache_key) if cache_key else None
+
+    if cached is not None:
+        response.response = [cached]
+        response.content_length = len(cached)
+    elif response.is_streamed:
+        response.response = _compress_stream(response.response, encoding, cache_key)
+        response.headers.pop("Content-Length", None)
+    else:
+        data = response.get_data()
+        if len(data) < _settings["min_size"]:
+            return response
+        compressed = compress(data, encoding)
+        if cache_key and len(compressed) <= _settings["cache_max_bytes"]:
+            compressed_cache.set(cache_key, compressed)
+        response.set_data(compressed)
+
+    response.headers["Content-Encoding"] = encoding
+    if etag:
+        response.set_etag(f"{etag}-{encoding}")
+    return response
+
+
+def init_app(app):
+    """
+    Compress the app's responses, with the COMPRESSION_* settings of the
+    app config.
+
+    Parameters
+    ----------
+    app : Flask
+        Flask app whose config holds the COMPRESSION_* settings.
+    """
+    if not app.config.setdefault("COMPRESSION_ENABLED", True):
+        return
+    _settings["min_size"] = app.config.setdefault("COMPRESSION_MIN_SIZE", 1024)
+    _settings["level"] = app.config.setdefault("COMPRESSION_LEVEL", 6)
+    _settings["brotli_quality"] = app.config.setdefault("COMPRESSION_BROTLI_QUALITY", 5)
+    _settings["cache_max_bytes"] = app.config.setdefault(
+        "COMPRESSION_CACHE_MAX_BYTES", 16 * 1024 * 1024
+    )
+    compressed_cache.maxsize = app.config.setdefault("COMPRESSION_CACHE_SIZE", 32)
+    app.after_request(compress_response)
+    logger.info(f"Compression: Enabled encodings {ENCODINGS}.")
@@ -1,16 +1,37 @@
+import functools
 import json
 import os
+import ssl
+import threading
+import time
 from typing import Any
 
-import sqlalchemy
-from sqlalchemy.orm import close_all_sessions
-from sqlalchemy.pool import NullPool
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
 
 import logging
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger('logger')
 
+# Database backends that can be selected with DATABASE_BACKEND
+BACKENDS = ["sqlite", "postgres"]
+
+
+def to_bool(value: Any) -> bool:
+    """Read a boolean setting given as a bool or as a string.
+
+    Args:
+        value: True, False or a string like "true", "false", "1" or "0"
+
+    Returns:
+        The boolean value of the setting
+    """
+    if isinstance(value, str):
+        return value.strip().lower() in ("true", "1", "yes", "on")
+    return bool(value)
+
+
 # [START cloudrun_user_auth_secrets]
 def get_cred_config() -> dict[str, str]:
     """Retrieve Cloud SQL credentials stored in Secret Manager
@@ -44,19 +65,278 @@ def get_cred_config() -> dict[str, str]:
             "DB_PASSWORD": os.environ["DB_PASSWORD"],
             "DB_NAME": os.environ["DB_NAME"],
             "DB_HOST": os.environ.get("DB_HOST", None),
-            "CERT_PATH": os.environ.get("CERT_PATH", f"{os.getcwd()}/rds-ca-2019-root.pem"),
+            "CERT_PATH": os.environ.get("CERT_PATH"),
             "CLOUD_SQL_CONNECTION_NAME": os.environ["CLOUD_SQL_CONNECTION_NAME"],
         }
 
 
-creds = get_cred_config()
-db_user = creds["DB_USER"]
-db_pass = creds["DB_PASSWORD"]
-db_name = creds["DB_NAME"]
-# db_socket_dir = creds.get("DB_SOCKET_DIR", "/cloudsql")
-cloud_sql_connection_name = creds["CLOUD_SQL_CONNECTION_NAME"]
+def get_postgres_uri(creds: dict[str, str]) -> str:
+    """Build the pg8000 database URI from the Cloud SQL credentials.
+
+    Args:
+        creds: Credentials returned by get_cred_config
+
+    Returns:
+        The SQLAlchemy database URI
+    """
+    db_user = creds["DB_USER"]
+    db_pass = creds["DB_PASSWORD"]
+    db_name = creds["DB_NAME"]
+    # db_socket_dir = creds.get("DB_SOCKET_DIR", "/cloudsql")
+    cloud_sql_connection_name = creds["CLOUD_SQL_CONNECTION_NAME"]
+
+    # return f"postgresql+pg8000://{db_user}:{db_pass}@/{db_name}?unix_sock={db_socket_dir}/{cloud_sql_connection_name}/.s.PGSQL.5432"
+    return f"postgresql+pg8000://{db_user}:{db_pass}@{cloud_sql_connection_name}:5432/{db_name}"
+
+
+@functools.lru_cache(maxsize=None)
+def get_ssl_context(cert_path: str) -> ssl.SSLContext:
+    """Build the TLS context used to connect to Postgres. It is cached, so the
+    CA certificate is only loaded once per process.
+
+    Args:
+        cert_path: Path of the CA certificate of the database server
+
+    Returns:
+        The TLS context
+    """
+    ssl_context = ssl.create_default_context()
+    ssl_context.verify_mode = ssl.CERT_REQUIRED
+    ssl_context.load_verify_locations(cert_path)
+    return ssl_context
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long requests wait to check out a connection."""
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self._wait_lock = threading.Lock()
+        self.checkouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _do_get(self) -> Any:
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            waited = time.perf_counter() - start
+            with self._wait_lock:
+                self.checkouts += 1
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+
+
+class WriterQueue:
+    """Re-entrant lock that lets one writer at a time through, in arrival order.
+
+    SQLite allows a single writer per database. Queueing writers in-process,
+    instead of letting them fail on the database lock and retry, keeps write
+    latency predictable and avoids "database is locked" errors under bursts.
+    """
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self._condition = threading.Condition()
+        self._next_ticket = 0
+        self._serving = 0
+        self._owner: Any = None
+        self._depth = 0
+        self.writes = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def __enter__(self) -> "WriterQueue":
+        if not self.enabled:
+            return self
+        me = threading.get_ident()
+        with self._condition:
+            if self._owner == me:
+                self._depth += 1
+                return self
+            start = time.perf_counter()
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            while self._serving != ticket:
+                self._condition.wait()
+            self._owner = me
+            self._depth = 1
+            waited = time.perf_counter() - start
+            self.writes += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        if not self.enabled:
+            return
+        with self._condition:
+            if self._owner != threading.get_ident():
+                return
+            self._depth -= 1
+            if self._depth == 0:
+                self._owner = None
+                self._serving += 1
+                self._condition.notify_all()
+
+    def stats(self) -> dict[str, Any]:
+        """Return the writer queue counters.
+
+        Returns:
+            A dictionary with the number of writes, their total and maximum
+            wait times and the number of queued writers
+        """
+        with self._condition:
+            return {
+                "enabled": self.enabled,
+                "writes": self.writes,
+                "queued": self._next_ticket - self._serving,
+                "wait_seconds_total": round(self.wait_total, 6),
+                "wait_seconds_max": round(self.wait_max, 6),
+            }
+
 
-# DB_URI = f"postgresql+pg8000://{db_user}:{db_pass}@/{db_name}?unix_sock={db_socket_dir}/{cloud_sql_connection_name}/.s.PGSQL.5432"
-DB_URI = f"postgresql+pg8000://{db_user}:{db_pass}@{cloud_sql_connection_name}:5432/{db_name}"
+# Single writer queue of the process, enabled for SQLite by init_engine
+writer_queue = WriterQueue()
 
-CERT_PATH = creds["CERT_PATH"]
\ No newline at end of file
+
+def serialized_write(f: Any) -> Any:
+    """Decorator that runs a write path (up to its commit) through the writer queue."""
+
+    @functools.wraps(f)
+    def decorated_function(*args: Any, **kwargs: Any) -> Any:
+        with writer_queue:
+            return f(*args, **kwargs)
+
+    return decorated_function
+
+
+def configure_app(app: Any) -> None:
+    """Set the database URI and explicit engine options of the Flask app.
+
+    The backend is selected with DATABASE_BACKEND ('sqlite' or 'postgres'),
+    read from the app config or the environment. Values already in the app
+    config take precedence over the environment.
+
+    Args:
+        app: The Flask app to configure
+    """
+    config = app.config
+
+    def setting(name: str, default: Any, cast: Any = str) -> Any:
+        # Values set in the config are cast too, e.g. True for a bool setting
+        config[name] = cast(config.get(name, os.environ.get(name, default)))
+        return config[name]
+
+    backend = setting("DATABASE_BACKEND", "sqlite")
+    if backend not in BACKENDS:
+        raise ValueError(f"DATABASE_BACKEND must be one of {BACKENDS}, not {backend}.")
+
+    engine_options = {
+        "poolclass": TimedQueuePool,
+        "pool_size": setting("DB_POOL_SIZE", 5, int),
+        "max_overflow": setting("DB_MAX_OVERFLOW", 10, int),
+        "pool_timeout": setting("DB_POOL_TIMEOUT", 30, int),
+        "pool_recycle": setting("DB_POOL_RECYCLE", 1800, int),
+        "pool_pre_ping": setting("DB_POOL_PRE_PING", True, to_bool),
+    }
+    setting("DB_STATEMENT_TIMEOUT_MS", 30000, int)
+    setting("SQLITE_PERFORMANCE_PROFILE", True, to_bool)
+    setting("SQLITE_BUSY_TIMEOUT_MS", 5000, int)
+    setting("SQLITE_MMAP_SIZE", 256 * 1024 * 1024, int)
+    setting("SQLITE_CACHE_SIZE_KB", 64 * 1024, int)
+
+    if backend == "postgres":
+        if "SQLALCHEMY_DATABASE_URI" not in config:
+            uri = os.environ.get("DATABASE_URI")
+            if uri is None:
+                # Cloud SQL credentials are only needed without an explicit URI
+                creds = get_cred_config()
+                uri = get_postgres_uri(creds)
+                if creds.get("CERT_PATH"):
+                    config.setdefault("DB_CERT_PATH", creds["CERT_PATH"])
+            config["SQLALCHEMY_DATABASE_URI"] = uri
+        # TLS is only set up when a CA certificate is configured explicitly
+        cert_path = config.get("DB_CERT_PATH") or os.environ.get("CERT_PATH")
+        if cert_path:
+            engine_options["connect_args"] = {"ssl_context": get_ssl_context(cert_path)}
+    else:
+        config.setdefault(
+            "SQLALCHEMY_DATABASE_URI", os.environ.get("DATABASE_URI", "sqlite:///docs.db")
+        )
+
+    config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", engine_options)
+    logger.info(f"Database: Using the {backend} backend.")
+
+
+def init_engine(app: Any, engine: Any) -> None:
+    """Register the per-connection setup of the app's engine.
+
+    Args:
+        app: The Flask app the engine belongs to
+        engine: The SQLAlchemy engine
+    """
+    statement_timeout = app.config["DB_STATEMENT_TIMEOUT_MS"]
+    sqlite_profile = to_bool(app.config["SQLITE_PERFORMANCE_PROFILE"])
+
+    if engine.dialect.name == "sqlite" and sqlite_profile:
+        pragmas = [
+            "PRAGMA journal_mode = WAL",
+            "PRAGMA synchronous = NORMAL",
+            f"PRAGMA busy_timeout = {int(app.config['SQLITE_BUSY_TIMEOUT_MS'])}",
+            f"PRAGMA mmap_size = {int(app.config['SQLITE_MMAP_SIZE'])}",
+            # Negative values are in KiB rather than pages
+            f"PRAGMA cache_size = -{int(app.config['SQLITE_CACHE_SIZE_KB'])}",
+        ]
+
+        @event.listens_for(engine, "connect")
+        def set_sqlite_pragmas(dbapi_connection: Any, connection_record: Any) -> None:
+            cursor = dbapi_connection.cursor()
+            for pragma in pragmas:
+                cursor.execute(pragma)
+            cursor.close()
+
+        writer_queue.enabled = True
+
+    if engine.dialect.name == "postgresql" and statement_timeout:
+
+        @event.listens_for(engine, "connect")
+        def set_statement_timeout(dbapi_connection: Any, connection_record: Any) -> None:
+            cursor = dbapi_connection.cursor()
+            cursor.execute(f"SET statement_timeout = {int(statement_timeout)}")
+            cursor.close()
+            # Commit, so that the pool's reset-on-return rollback keeps the setting
+            dbapi_connection.commit()
+
+
+def pool_stats(engine: Any) -> dict[str, Any]:
+    """Return the connection pool counters of an engine.
+
+    Args:
+        engine: The SQLAlchemy engine
+
+    Returns:
+        A dictionary with the pool size, the connections in use and, for
+        TimedQueuePool, the checkout wait times
+    """
+    pool = engine.pool
+    stats = {"pool": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update(
+            {
+                "size": pool.size(),
+                "checked_in": pool.checkedin(),
+                "checked_out": pool.checkedout(),
+                "overflow": pool.overflow(),
+            }
+        )
+    if isinstance(pool, TimedQueuePool):
+        stats.update(
+            {
+                "checkouts": pool.checkouts,
+                "wait_seconds_total": round(pool.wait_total, 6),
+                "wait_seconds_max": round(pool.wait_max, 6),
+            }
+        )
+    return stats
@@ -0,0 +1,263 @@
+import csv
+import datetime
+import io
+import re
+import zipfile
+from xml.sax.saxutils import escape
+
+from flask import current_app, Response, stream_with_context
+
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("logger")
+
+# Encoded bytes buffered before a chunk is sent to the client
+CHUNK_SIZE = 64 * 1024
+
+# Export formats: (mimetype, file extension)
+FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "xlsx": (
+        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        "xlsx",
+    ),
+}
+
+
+def _text(value):
+    if value is None:
+        return ""
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return str(value)
+
+
+class _Buffer(object):
+    """Write-only file object whose content is drained chunk by chunk."""
+
+    def __init__(self):
+        self._parts = []
+        self.size = 0
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        self._parts.append(data)
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._parts)
+        self._parts = []
+        self.size = 0
+        return data
+
+
+def iter_csv(fields, rows, chunk_size=CHUNK_SIZE):
+    """
+    Encode rows as CSV, with a header of field names, so the output can be
+    imported back by the UploadFile endpoint.
+
+    Parameters
+    ----------
+    fields : list
+        Names of the exported columns, in order.
+    rows : iterable
+        Serialized documents. Consumed lazily.
+    chunk_size : int
+        Approximate size in bytes of the yielded chunks.
+
+    Yields
+    ------
+    bytes
+        Encoded chunk of the CSV file.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    for row in rows:
+        writer.writerow([_text(row.get(f)) for f in fields])
+        if buffer.tell() >= chunk_size:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode()
+
+
+def iter_ndjson(fields, rows, chunk_size=CHUNK_SIZE):
+    """
+    Encode rows as newline-delimited json, one document per line.
+
+    Parameters
+    ----------
+    fields : list
+        Names of the exported columns, in order.
+    rows : iterable
+        Serialized documents. Consumed lazily.
+    chunk_size : int
+        Approximate size in bytes of the yielded chunks.
+
+    Yields
+    ------
+    bytes
+        Encoded chunk of the NDJSON file.
+    """
+    dumps = current_app.json.dumps
+    buffer = []
+    size = 0
+    for row in rows:
+        line = dumps({f: row.get(f) for f in fields}) + "\n"
+        buffer.append(line)
+        size += len(line)
+        if size >= chunk_size:
+            yield "".join(buffer).encode()
+            buffer = []
+            size = 0
+    yield "".join(buffer).encode()
+
+
+# Characters that are not allowed in XML 1.0 documents
+_INVALID_XML = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]")
+
+_XLSX_PARTS = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" '
+        'ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/'
+        'vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/'
+        'vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        "</Types>"
+    ),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/'
+        'relationships"><Relationship Id="rId1" Type="http://schemas.'
+        "openxmlformats.org/officeDocument/2006/relationships/officeDocument"
+        '" Target="xl/workbook.xml"/></Relationships>'
+    ),
+    "xl/workbook.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/'
+        'main" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/'
+        'relationships"><sheets><sheet name="Documents" sheetId="1" r:id="rId1"/>'
+        "</sheets></workbook>"
+    ),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/'
+        'relationships"><Relationship Id="rId1" Type="http://schemas.'
+        "openxmlformats.org/officeDocument/2006/relationships/worksheet"
+        '" Target="worksheets/sheet1.xml"/></Relationships>'
+    ),
+}
+
+
+def _column_letter(index):
+    letters = ""
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(ord("A") + remainder) + letters
+    return letters
+
+
+def _xlsx_row(row_number, values, columns):
+    cells = []
+    for column, value in zip(columns, values):
+        ref = f"{column}{row_number}"
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            cells.append(f'<c r="{ref}"><v>{value}</v></c>')
+        else:
+            text = escape(_INVALID_XML.sub("", _text(value)))
+            cells.append(
+                f'<c r="{ref}" t="inlineStr"><is><t xml:space="preserve">{text}'
+                "</t></is></c>"
+            )
+    return f'<row r="{row_number}">{"".join(cells)}</row>'
+
+
+def iter_xlsx(fields, rows, chunk_size=CHUNK_SIZE):
+    """
+    Encode rows as an XLSX workbook with a single sheet, with a header row of
+    field names. Cells are inline strings, so the sheet is written row by
+    row, and the zip archive is streamed with data descriptors, so memory use
+    does not grow with the number of rows.
+
+    Parameters
+    ----------
+    fields : list
+        Names of the exported columns, in order.
+    rows : iterable
+        Serialized documents. Consumed lazily.
+    chunk_size : int
+        Approximate size in bytes of the yielded chunks.
+
+    Yields
+    ------
+    bytes
+        Encoded chunk of the XLSX file.
+    """
+    buffer = _Buffer()
+    columns = [_column_letter(i) for i in range(len(fields))]
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, content in _XLSX_PARTS.items():
+            archive.writestr(name, content)
+        with archive.open("xl/worksheets/sheet1.xml", "w", force_zip64=True) as sheet:
+            sheet.write(
+                b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/'
+                b'spreadsheetml/2006/main"><sheetData>'
+            )
+            sheet.write(_xlsx_row(1, fields, columns).encode())
+            for row_number, row in enumerate(rows, start=2):
+                values = [row.get(f) for f in fields]
+                sheet.write(_xlsx_row(row_number, values, columns).encode())
+                if buffer.size >= chunk_size:
+                    yield buffer.drain()
+            sheet.write(b"</sheetData></worksheet>")
+    yield buffer.drain()
+
+
+_ENCODERS = {"csv": iter_csv, "ndjson": iter_ndjson, "xlsx": iter_xlsx}
+
+
+def export_response(export_format, fields, rows, filename="documents"):
+    """
+    Build a streamed download of rows in one of FORMATS.
+
+    Parameters
+    ----------
+    export_format : str
+        One of FORMATS.
+    fields : list
+        Names of the exported columns, in order.
+    rows : iterable
+        Serialized documents. Consumed lazily.
+    filename : str
+        Name of the downloaded file, without extension.
+
+    Returns
+    -------
+    flask.Response
+        Streamed response.
+    """
+    mimetype, extension = FORMATS[export_format]
+    response = Response(
+        stream_with_context(_ENCODERS[export_format](fields, rows)),
+        mimetype=mimetype,
+    )
+    response.headers["Content-Disposition"] = (
+        f'attachment; filename="{filename}.{extension}"'
+    )
+    # Ask nginx not to buffer the whole response before forwarding it
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
@@ -0,0 +1,198 @@
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+import json
+import os
+import socket
+import threading
+import time
+
+from app import db
+from database import writer_queue
+from models import Document, UploadJob
+from uploads import parse_upload
+
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("logger")
+
+# Identifier of this worker process, recorded on the jobs it runs
+WORKER = f"{socket.gethostname()}:{os.getpid()}"
+
+_executor = None
+_sweeper = None
+_lock = threading.Lock()
+
+
+def init_app(app):
+    """
+    Start the bounded pool of upload job workers, resume the jobs left
+    unfinished by a previous run and start the sweeper that picks up jobs
+    abandoned by other worker processes.
+
+    Parameters
+    ----------
+    app : Flask
+        Flask app whose config holds the UPLOAD_JOB_* settings.
+    """
+    global _executor, _sweeper
+
+    workers = app.config.setdefault("UPLOAD_JOB_WORKERS", 2)
+    stale_seconds = app.config.setdefault("UPLOAD_JOB_STALE_SECONDS", 300)
+    app.config.setdefault("UPLOAD_CHUNK_SIZE", 500)
+
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix="upload-job"
+            )
+        if _sweeper is None:
+            _sweeper = threading.Thread(
+                target=_sweep,
+                args=(app, stale_seconds),
+                name="upload-job-sweeper",
+                daemon=True,
+            )
+            _sweeper.start()
+
+
+def submit(app, job_id):
+    """
+    Queue a job for processing by the worker pool.
+
+    Parameters
+    ----------
+    app : Flask
+        Flask app the job is run in the context of.
+    job_id : str
+        job_id of the job to run.
+    """
+    _executor.submit(run_job, app, job_id)
+
+
+def _stale_before(app):
+    stale_seconds = app.config["UPLOAD_JOB_STALE_SECONDS"]
+    return datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(
+        seconds=stale_seconds
+    )
+
+
+def resume_jobs(app):
+    """
+    Queue the jobs that are waiting to be processed or whose worker stopped
+    sending heartbeats.
+
+    Parameters
+    ----------
+    app : Flask
+        Flask app the jobs are run in the context of.
+    """
+    with app.app_context():
+        job_ids = db.session.scalars(
+            db.select(UploadJob.job_id).where(
+                db.or_(
+                    UploadJob.status == "queued",
+                    db.and_(
+                        UploadJob.status == "running",
+                        UploadJob.heartbeat < _stale_before(app),
+                    ),
+                )
+            )
+        ).all()
+    for job_id in job_ids:
+        logger.info(f"Jobs: Resuming upload job {job_id}.")
+        submit(app, job_id)
+
+
+def _sweep(app, interval):
+    while True:
+        try:
+            resume_jobs(app)
+        except Exception as e:
+            logger.error(f"Jobs: Resuming upload jobs. Error: {e}")
+        time.sleep(interval)
+
+
+def _seen_titles(rows, creator_email):
+    """
+    Rebuild the titles inserted from the already processed rows of a resumed
+    job: those of the rows whose document exists and was created by the
+    job's creator.
+
+    Parameters
+    ----------
+    rows : list
+        List of (line number, fields dict) tuples processed before the job
+        was interrupted.
+    creator_email : str
+        Email of the user who queued the job.
+
+    Returns
+    -------
+    set
+        Titles to pass as seen_titles to Document.create_chunk.
+    """
+    titles = list({fields.get("title") for _, fields in rows if fields.get("title")})
+    seen_titles = set()
+    # Bounded IN lists
+    for start in range(0, len(titles), 500):
+        seen_titles.update(
+            db.session.scalars(
+                db.select(Document.title).where(
+                    Document.title.in_(titles[start : start + 500]),
+                    Document.creator_email == creator_email,
+                )
+            )
+        )
+    return seen_titles
+
+
+def run_job(app, job_id):
+    """
+    Process an upload job chunk by chunk, starting from its last committed
+    chunk. Each chunk's documents are committed together with the job's
+    progress, so a job interrupted by a restart resumes where it stopped,
+    with the titles of its processed rows counted as seen, see _seen_titles.
+
+    Parameters
+    ----------
+    app : Flask
+        Flask app the job is run in the context of.
+    job_id : str
+        job_id of the job to run.
+    """
+    with app.app_context():
+        if not UploadJob.claim(job_id, WORKER, _stale_before(app)):
+            logger.info(f"Jobs: Upload job {job_id} already claimed.")
+            return
+
+        job = UploadJob.get_by_job_id(job_id)
+        try:
+            rows = parse_upload(job.filename, job.content)
+            for _, fields in rows:
+                fields["creator_email"] = job.creator_email
+
+            chunk_size = app.config["UPLOAD_CHUNK_SIZE"]
+            seen_titles = _seen_titles(rows[: job.next_row], job.creator_email)
+            for start in range(job.next_row, len(rows), chunk_size):
+                chunk = rows[start : start + chunk_size]
+                with writer_queue:
+                    outcomes = Document.create_chunk(chunk, seen_titles)
+                    job.record_chunk(outcomes, start + len(chunk))
+                    db.session.commit()
+                logger.info(
+                    f"Jobs: Upload job {job_id} processed {job.next_row}/{len(rows)} rows."
+                )
+
+            job.status = "done"
+        except Exception as e:
+            logger.error(f"Jobs: Running upload job {job_id}. Error: {e}")
+            db.session.rollback()
+            job = UploadJob.get_by_job_id(job_id)
+            job.status = "failed"
+            job.errors = json.dumps([{"status": "failed", "message": str(e)}])
+
+        with writer_queue:
+            job.time_finished = datetime.datetime.now(datetime.timezone.utc)
+            db.session.add(job)
+            db.session.commit()
@@ -0,0 +1,433 @@
+import asyncio
+import ssl
+import threading
+import time
+from urllib.parse import quote, urljoin, urlsplit
+
+import click
+from flask.cli import with_appcontext
+
+from app import db
+from database import writer_queue
+from jobs import WORKER
+from models import Document, LinkStatus, TaskLease
+
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("logger")
+
+USER_AGENT = "documents-index-linkcheck/1.0"
+
+REDIRECT_STATUSES = {301, 302, 303, 307, 308}
+
+# Statuses worth retrying after a backoff
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Results stored per transaction
+RECORD_CHUNK_SIZE = 500
+
+# Limits of the status line and headers read from a response
+MAX_LINE_BYTES = 8192
+MAX_HEADERS = 100
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+class LinkCheckError(Exception):
+    """Raised when a server does not answer with a valid HTTP response."""
+
+
+class LinkChecker(object):
+    """
+    Asynchronous checker of many URLs, with a bounded number of requests in
+    flight, overall and per host.
+
+    Each URL is requested with HEAD, and with GET if the server rejects HEAD
+    or fails it. Redirects are followed. Connection errors, timeouts and
+    RETRY_STATUSES are retried with exponential backoff. Only the status
+    line and headers of the responses are read, up to MAX_LINE_BYTES per line
+    and MAX_HEADERS headers, so the body and its Transfer-Encoding do not
+    matter. Requests are sent directly, not through HTTP(S)_PROXY.
+    """
+
+    def __init__(
+        self,
+        concurrency=20,
+        per_host=2,
+        timeout=10,
+        retries=2,
+        backoff=0.5,
+        max_redirects=5,
+    ):
+        """
+        Parameters
+        ----------
+        concurrency : int
+            Maximum number of requests in flight.
+        per_host : int
+            Maximum number of requests in flight to the same host.
+        timeout : float
+            Timeout in seconds of each request, until its headers are read.
+        retries : int
+            Number of retries of a failing check.
+        backoff : float
+            Delay in seconds before the first retry, doubled for each retry.
+        max_redirects : int
+            Maximum number of redirects followed.
+        """
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_redirects = max_redirects
+        self._ssl_context = ssl.create_default_context()
+
+    async def _request(self, method, url):
+        """Send one request, return its status code and headers."""
+        parts = urlsplit(url)
+        https = parts.scheme == "https"
+        host = parts.hostname
+        port = parts.port or (443 if https else 80)
+        path = quote(parts.path or "/", safe="/%:@!$&'()*+,;=~")
+        if parts.query:
+            path += "?" + quote(parts.query, safe="/%:@!$&'()*+,;=?~")
+        host_header = host.encode("idna").decode()
+        if ":" in host_header:
+            host_header = f"[{host_header}]"
+        if parts.port:
+            host_header += f":{parts.port}"
+
+        reader, writer = await asyncio.open_connection(
+            host, port, ssl=self._ssl_context if https else None, limit=MAX_LINE_BYTES
+        )
+        try:
+            writer.write(
+                (
+                    f"{method} {path} HTTP/1.1\r\n"
+                    f"Host: {host_header}\r\n"
+                    f"User-Agent: {USER_AGENT}\r\n"
+                    "Accept: */*\r\n"
+                    "Connection: close\r\n\r\n"
+                ).encode("latin-1")
+            )
+            await writer.drain()
+
+            status_line = (await self._readline(reader)).decode("latin-1").split()
+            if len(status_line) < 2 or not status_line[0].startswith("HTTP/"):
+                raise LinkCheckError("Invalid HTTP response")
+            try:
+                status = int(status_line[1])
+            except ValueError:
+                raise LinkCheckError("Invalid HTTP status")
+
+            headers = {}
+            for _ in range(MAX_HEADERS + 1):
+                line = await self._readline(reader)
+                if line in (b"\r\n", b"\n", b""):
+                    return status, headers
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            raise LinkCheckError("Too many response headers")
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except Exception:
+                pass
+
+    @staticmethod
+    async def _readline(reader):
+        try:
+            return await reader.readline()
+        except ValueError:
+            # The line is longer than the reader's limit
+            raise LinkCheckError("Response header line too long")
+
+    async def _limited_request(self, method, url):
+        host = urlsplit(url).hostname
+        host_limit = self._host_limits.get(host)
+        if host_limit is None:
+            host_limit = self._host_limits[host] = asyncio.Semaphore(self.per_host)
+        # Wait for the host before taking a global slot, so that requests
+        # queued on a busy host do not hold slots other hosts could use
+        async with host_limit:
+            async with self._limit:
+                return await asyncio.wait_for(
+                    self._request(method, url), self.timeout
+                )
+
+    async def _follow(self, method, url):
+        """Request url, following redirects. Return (status, final url)."""
+        for _ in range(self.max_redirects + 1):
+            parts = urlsplit(url)
+            if parts.scheme not in ("http", "https") or not parts.hostname:
+                raise LinkCheckError(f"Invalid URL {url}")
+            status, headers = await self._limited_request(method, url)
+            location = headers.get("location")
+            if status not in REDIRECT_STATUSES or not location:
+                return status, url
+            url = urljoin(url, location)
+        raise LinkCheckError("Too many redirects")
+
+    async def _check_once(self, url):
+        try:
+            status, final_url = await self._follow("HEAD", url)
+        except (TimeoutError, asyncio.TimeoutError):
+            raise
+        except (OSError, ValueError, LinkCheckError):
+            # Some servers drop HEAD requests, try GET before giving up
+            status = None
+        if status is None or status >= 400:
+            status, final_url = await self._follow("GET", url)
+        return status, final_url
+
+    async def check(self, url):
+        """
+        Check one URL.
+
+        Parameters
+        ----------
+        url : str
+            URL to check.
+
+        Returns
+        -------
+        dict
+            Dictionary with the 'url', 'ok', 'status_code', 'final_url'
+            (the redirect target, None if not redirected), 'latency_ms' of
+            the last attempt and 'error'.
+        """
+        result = {"url": url, "ok": False, "status_code": None, "final_url": None}
+        for attempt in range(self.retries + 1):
+            if attempt:
+                await asyncio.sleep(self.backoff * 2 ** (attempt - 1))
+            start = time.perf_counter()
+            try:
+                status, final_url = await self._check_once(url)
+                error = None
+            except (TimeoutError, asyncio.TimeoutError):
+                status, final_url, error = None, None, "Timeout"
+            except (OSError, ValueError, LinkCheckError) as e:
+                status, final_url, error = None, None, str(e) or type(e).__name__
+            latency = time.perf_counter() - start
+            if status is not None and status not in RETRY_STATUSES:
+                break
+
+        result["status_code"] = status
+        result["final_url"] = final_url if final_url != url else None
+        result["ok"] = status is not None and status < 400
+        result["latency_ms"] = round(1000 * latency, 1)
+        result["error"] = error[:500] if error else None
+        return result
+
+    async def check_all(self, urls):
+        """
+        Check URLs concurrently.
+
+        Parameters
+        ----------
+        urls : iterable
+            URLs to check. Duplicates are checked once.
+
+        Returns
+        -------
+        dict
+            Results by URL, see check.
+        """
+        self._limit = asyncio.Semaphore(self.concurrency)
+        self._host_limits = {}
+        urls = list(dict.fromkeys(urls))
+        results = await asyncio.gather(*(self.check(url) for url in urls))
+        return dict(zip(urls, results))
+
+    def run(self, urls):
+        """
+        Check URLs concurrently, from synchronous code.
+
+        Parameters
+        ----------
+        urls : iterable
+            URLs to check.
+
+        Returns
+        -------
+        dict
+            Results by URL, see check.
+        """
+        return asyncio.run(self.check_all(urls))
+
+
+def checker_from_config(config):
+    """
+    Create a LinkChecker with the LINK_CHECK_* settings of an app config.
+
+    Parameters
+    ----------
+    config : flask.Config
+        Config of the app.
+
+    Returns
+    -------
+    LinkChecker
+        The checker.
+    """
+    return LinkChecker(
+        concurrency=config["LINK_CHECK_CONCURRENCY"],
+        per_host=config["LINK_CHECK_PER_HOST"],
+        timeout=config["LINK_CHECK_TIMEOUT"],
+        retries=config["LINK_CHECK_RETRIES"],
+        backoff=config["LINK_CHECK_BACKOFF"],
+    )
+
+
+def check_documents(app, checker=None, limit=None):
+    """
+    Check the compiled_url and source_url of the documents and store the
+    results. URLs shared by several documents are checked once.
+
+    Parameters
+    ----------
+    app : Flask
+        Flask app whose documents are checked.
+    checker : LinkChecker or None
+        Checker, created from the app config by default.
+    limit : int or None
+        Maximum number of documents checked, the least recently checked
+        first. None checks all of them.
+
+    Returns
+    -------
+    dict
+        Number of checked 'documents', 'urls' and 'broken' links.
+    """
+    checker = checker or checker_from_config(app.config)
+    with app.app_context():
+        columns = [getattr(Document, field) for field in LinkStatus.FIELDS]
+        query = (
+            db.select(Document.doc_identifier, *columns)
+            .outerjoin(
+                LinkStatus,
+                (LinkStatus.doc_identifier == Document.doc_identifier)
+                & (LinkStatus.field == LinkStatus.FIELDS[0]),
+            )
+            .order_by(LinkStatus.time_checked.asc().nulls_first(), Document.pk.asc())
+        )
+        if limit is not None:
+            query = query.limit(limit)
+        rows = db.session.execute(query).all()
+
+    links = [
+        (doc_identifier, field, url.strip())
+        for doc_identifier, *urls in rows
+        for field, url in zip(LinkStatus.FIELDS, urls)
+        if url and url.strip()
+    ]
+    start = time.perf_counter()
+    checked = checker.run(url for _, _, url in links)
+    results = [
+        dict(checked[url], doc_identifier=doc_identifier, field=field, url=url[:500])
+        for doc_identifier, field, url in links
+    ]
+    for result in results:
+        if result["final_url"]:
+            result["final_url"] = result["final_url"][:500]
+
+    with app.app_context():
+        for chunk_start in range(0, max(len(results), 1), RECORD_CHUNK_SIZE):
+            with writer_queue:
+                LinkStatus.record(
+                    results[chunk_start : chunk_start + RECORD_CHUNK_SIZE]
+                )
+                db.session.commit()
+
+    summary = {
+        "documents": len(rows),
+        "urls": len(checked),
+        "broken": sum(not r["ok"] for r in checked.values()),
+    }
+    logger.info(
+        f"LinkCheck: Checked {summary['urls']} URLs of {summary['documents']} "
+        f"documents in {time.perf_counter() - start:.1f}s, "
+        f"{summary['broken']} broken."
+    )
+    return summary
+
+
+def _schedule(app, interval):
+    while True:
+        time.sleep(interval)
+        try:
+            # Every worker process runs a scheduler, the one that leases the
+            # task checks the links, the others skip this round. The lease
+            # ends a bit early so the same worker can renew it next round
+            with app.app_context():
+                claimed = TaskLease.claim("link_check", WORKER, 0.9 * interval)
+            if claimed:
+                check_documents(app)
+        except Exception as e:
+            logger.error(f"LinkCheck: Checking links. Error: {e}")
+
+
+def start_scheduler(app):
+    """
+    Start (once per process) a daemon thread checking the links every
+    LINK_CHECK_INTERVAL seconds. The worker processes share the task through
+    TaskLease, so the links are checked by one of them per interval. Called
+    by the app's startup hook; does nothing if LINK_CHECK_INTERVAL is 0.
+
+    Parameters
+    ----------
+    app : Flask
+        Flask app whose documents are checked.
+    """
+    global _scheduler
+
+    interval = app.config["LINK_CHECK_INTERVAL"]
+    if not interval:
+        return
+    with _scheduler_lock:
+        if _scheduler is not None:
+            return
+        _scheduler = threading.Thread(
+            target=_schedule,
+            args=(app, interval),
+            name="link-checker",
+            daemon=True,
+        )
+        _scheduler.start()
+
+
+@click.command("check-links")
+@click.option("--limit", type=int, default=None, help="Least recently checked first.")
+@with_appcontext
+def check_links_command(limit):
+    """Check the compiled and source URLs of the documents."""
+    from flask import current_app
+
+    summary = check_documents(current_app._get_current_object(), limit=limit)
+    click.echo(
+        f"Checked {summary['urls']} URLs of {summary['documents']} documents, "
+        f"{summary['broken']} broken."
+    )
+
+
+def init_app(app):
+    """
+    Register the check-links command on the Flask CLI, with the
+    LINK_CHECK_* settings of the app config.
+
+    Parameters
+    ----------
+    app : Flask
+        Flask app whose config holds the LINK_CHECK_* settings.
+    """
+    app.config.setdefault("LINK_CHECK_INTERVAL", 24 * 3600)
+    app.config.setdefault("LINK_CHECK_CONCURRENCY", 20)
+    app.config.setdefault("LINK_CHECK_PER_HOST", 2)
+    app.config.setdefault("LINK_CHECK_TIMEOUT", 10)
+    app.config.setdefault("LINK_CHECK_RETRIES", 2)
+    app.config.setdefault("LINK_CHECK_BACKOFF", 0.5)
+    app.cli.add_command(check_links_command)
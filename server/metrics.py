@@ -0,0 +1,551 @@
+from bisect import bisect_left
+import atexit
+import fcntl
+import functools
+import glob
+import json
+import os
+import threading
+import time
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+
+import serialization
+
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("logger")
+
+# Upper bounds of the histogram buckets, by metric
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 500)
+
+# Snapshots not written for this many flush intervals, by processes that
+# are gone, are folded into the exited snapshot
+STALE_INTERVALS = 4
+
+# Set by init_app, and by _exit once the snapshot of this process is retired
+_settings = {"flush_interval": 15, "retired": False}
+_flush_lock = threading.Lock()
+
+# name: (type, help, histogram buckets)
+METRICS = {
+    "http_requests_total": ("counter", "Requests, by view, method and status.", None),
+    "http_request_duration_seconds": (
+        "histogram",
+        "Request latency, by view and method.",
+        LATENCY_BUCKETS,
+    ),
+    "db_statements_per_request": (
+        "histogram",
+        "SQL statements executed per request, by view and method.",
+        STATEMENT_BUCKETS,
+    ),
+    "db_time_seconds": (
+        "histogram",
+        "Time spent executing SQL statements per request, by view and method.",
+        LATENCY_BUCKETS,
+    ),
+    "serialize_time_seconds": (
+        "histogram",
+        "Time spent encoding json per request, by view and method.",
+        LATENCY_BUCKETS,
+    ),
+    "auth_outcomes_total": ("counter", "Outcomes of token_required.", None),
+    "cache_requests_total": (
+        "counter",
+        "Lookups of the in-process caches, by cache and result.",
+        None,
+    ),
+    "db_pool_checkouts_total": ("counter", "Connection pool checkouts.", None),
+    "db_pool_wait_seconds_total": (
+        "counter",
+        "Time spent waiting for a pooled connection.",
+        None,
+    ),
+}
+
+# Content type of the Prometheus text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Registry(object):
+    """
+    Thread-safe store of the counters and histograms of this process.
+
+    Series are keyed by (metric name, labels), labels being a tuple of
+    (name, value) pairs. Recording a value only takes a lock and a dict
+    lookup, so it is cheap enough to stay enabled in production.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._collectors = {}
+
+    def inc(self, name, labels=(), value=1):
+        """
+        Increment a counter.
+
+        Parameters
+        ----------
+        name : str
+            Name of a counter in METRICS.
+        labels : tuple
+            Tuple of (label name, value) pairs.
+        value : float
+            Amount to add.
+        """
+        key = (name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        """
+        Record a value in a histogram.
+
+        Parameters
+        ----------
+        name : str
+            Name of a histogram in METRICS.
+        labels : tuple
+            Tuple of (label name, value) pairs.
+        value : float
+            Observed value.
+        """
+        buckets = METRICS[name][2]
+        index = bisect_left(buckets, value)
+        key = (name, labels)
+        with self._lock:
+            series = self._histograms.get(key)
+            if series is None:
+                # One count per bucket, plus the +Inf bucket, then the sum
+                series = self._histograms[key] = [0] * (len(buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def add_collector(self, name, collector):
+        """
+        Register a function called at each snapshot, returning a list of
+        (counter name, labels, value) tuples read from other parts of the
+        app, e.g. the cache statistics. Replaces the collector previously
+        registered under the same name.
+        """
+        self._collectors[name] = collector
+
+    def snapshot(self):
+        """
+        Return the current values of all series, in a json-serializable form.
+
+        Returns
+        -------
+        dict
+            Dict with 'counters', a list of [name, labels, value], and
+            'histograms', a list of [name, labels, bucket counts, sum].
+        """
+        with self._lock:
+            counters = [[n, list(l), v] for (n, l), v in self._counters.items()]
+            histograms = [
+                [n, list(l), s[:-1], s[-1]] for (n, l), s in self._histograms.items()
+            ]
+        for collector in list(self._collectors.values()):
+            try:
+                counters.extend([n, list(l), v] for n, l, v in collector())
+            except Exception as e:
+                logger.error(f"Metrics: Collecting metrics. Error: {e}")
+        return {"counters": counters, "histograms": histograms}
+
+
+registry = Registry()
+
+
+def merge(snapshots):
+    """
+    Sum the snapshots of several processes.
+
+    Parameters
+    ----------
+    snapshots : iterable
+        Snapshots returned by Registry.snapshot.
+
+    Returns
+    -------
+    dict
+        Merged snapshot.
+    """
+    counters = {}
+    histograms = {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot["counters"]:
+            key = (name, tuple(tuple(l) for l in labels))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, counts, total in snapshot["histograms"]:
+            key = (name, tuple(tuple(l) for l in labels))
+            merged = histograms.setdefault(key, [[0] * len(counts), 0.0])
+            merged[0] = [a + b for a, b in zip(merged[0], counts)]
+            merged[1] += total
+    return {
+        "counters": [[n, l, v] for (n, l), v in counters.items()],
+        "histograms": [[n, l, c, t] for (n, l), (c, t) in histograms.items()],
+    }
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (
+        (k, str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+        for k, v in pairs
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(round(value, 9))
+    return str(value)
+
+
+def render(snapshot):
+    """
+    Format a snapshot in the Prometheus text exposition format.
+
+    Parameters
+    ----------
+    snapshot : dict
+        Snapshot returned by Registry.snapshot or merge.
+
+    Returns
+    -------
+    str
+        Metrics in the Prometheus text format.
+    """
+    series = {}
+    for name, labels, value in snapshot["counters"]:
+        series.setdefault(name, []).append((labels, value))
+    for name, labels, counts, total in snapshot["histograms"]:
+        series.setdefault(name, []).append((labels, (counts, total)))
+
+    lines = []
+    for name in sorted(series):
+        kind, help_text, buckets = METRICS.get(name, ("untyped", "", None))
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in sorted(series[name], key=lambda s: repr(s[0])):
+            if kind != "histogram":
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+                continue
+            counts, total = value
+            cumulative = 0
+            for bound, count in zip(list(buckets) + ["+Inf"], counts):
+                cumulative += count
+                le = _format_labels(labels, [("le", bound)])
+                lines.append(f"{name}_bucket{le} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+def cache_collector(name, cache):
+    """
+    Return a collector reporting the hits and misses of an LRUCache.
+
+    Parameters
+    ----------
+    name : str
+        Value of the 'cache' label.
+    cache : cache.LRUCache
+        Cache to report.
+    """
+
+    def collector():
+        stats = cache.stats()
+        return [
+            ("cache_requests_total", (("cache", name), ("result", r)), stats[k])
+            for r, k in [("hit", "hits"), ("miss", "misses")]
+        ]
+
+    return collector
+
+
+def pool_collector(engine):
+    """
+    Return a collector reporting the checkouts and wait time of an engine's
+    connection pool, see database.TimedQueuePool.
+    """
+
+    def collector():
+        pool = engine.pool
+        if not hasattr(pool, "checkouts"):
+            return []
+        return [
+            ("db_pool_checkouts_total", (), pool.checkouts),
+            ("db_pool_wait_seconds_total", (), pool.wait_total),
+        ]
+
+    return collector
+
+
+def _snapshot_path(directory):
+    return os.path.join(directory, f"metrics_{os.getpid()}.json")
+
+
+def flush(directory):
+    """
+    Write this process's snapshot to the shared metrics directory. The file
+    is replaced atomically, so readers never see a partial snapshot.
+
+    Parameters
+    ----------
+    directory : str
+        Directory shared by the worker processes.
+    """
+    with _flush_lock:
+        if not _settings["retired"]:
+            _write_snapshot(_snapshot_path(directory), registry.snapshot())
+
+
+def _read_snapshot(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.error(f"Metrics: Reading snapshot {path}. Error: {e}")
+        return None
+
+
+def _write_snapshot(path, snapshot):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(snapshot, f)
+    os.replace(tmp_path, path)
+
+
+def retire(directory, path):
+    """
+    Fold the snapshot of a process that is gone into the exited snapshot of
+    the directory, and delete it. Its counters and histograms keep counting
+    in the sums reported by collect, its gauges are dropped.
+
+    Parameters
+    ----------
+    directory : str
+        Directory shared by the worker processes.
+    path : str
+        Path of the snapshot to retire.
+    """
+    with open(os.path.join(directory, "metrics.lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        snapshot = _read_snapshot(path)
+        if snapshot is None:
+            return
+        snapshot["counters"] = [
+            [name, labels, value]
+            for name, labels, value in snapshot["counters"]
+            if METRICS.get(name, ("untyped",))[0] != "gauge"
+        ]
+        exited_path = os.path.join(directory, "exited_metrics.json")
+        exited = _read_snapshot(exited_path)
+        _write_snapshot(exited_path, merge([s for s in [exited, snapshot] if s]))
+        os.remove(path)
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # e.g. owned by another user
+        return True
+    return True
+
+
+def _exit(directory):
+    # The flusher thread must not write the snapshot again once retired
+    with _flush_lock:
+        try:
+            _write_snapshot(_snapshot_path(directory), registry.snapshot())
+            retire(directory, _snapshot_path(directory))
+        except Exception as e:
+            logger.error(f"Metrics: Retiring snapshot. Error: {e}")
+        _settings["retired"] = True
+
+
+def collect(directory=None):
+    """
+    Return the metrics of all worker processes, in the Prometheus text format.
+
+    Parameters
+    ----------
+    directory : str or None
+        Directory shared by the worker processes, or None if the metrics of
+        this process only are reported.
+
+    Returns
+    -------
+    str
+        Metrics in the Prometheus text format.
+    """
+    if not directory:
+        return render(registry.snapshot())
+
+    flush(directory)
+    stale_before = time.time() - STALE_INTERVALS * _settings["flush_interval"]
+    for path in glob.glob(os.path.join(directory, "metrics_*.json")):
+        # Processes killed without running their atexit handlers
+        try:
+            pid = int(os.path.basename(path)[len("metrics_") : -len(".json")])
+            if os.path.getmtime(path) < stale_before and not _is_alive(pid):
+                retire(directory, path)
+        except (OSError, ValueError) as e:
+            logger.error(f"Metrics: Retiring snapshot {path}. Error: {e}")
+
+    paths = glob.glob(os.path.join(directory, "metrics_*.json"))
+    paths.append(os.path.join(directory, "exited_metrics.json"))
+    snapshots = [_read_snapshot(path) for path in paths]
+    return render(merge(s for s in snapshots if s))
+
+
+def _flusher(directory, interval):
+    while True:
+        time.sleep(interval)
+        try:
+            flush(directory)
+        except Exception as e:
+            logger.error(f"Metrics: Writing snapshot. Error: {e}")
+
+
+def record_auth(outcome):
+    """
+    Count an outcome of token_required: 'success', 'missing_token',
+    'invalid_token' or 'unknown_user'.
+    """
+    registry.inc("auth_outcomes_total", (("outcome", outcome),))
+
+
+def view_name():
+    """
+    Return the name of the view class handling the current request, or its
+    endpoint for plain view functions.
+    """
+    view_function = request.url_rule and request.url_rule.endpoint
+    view_function = view_function and current_app.view_functions.get(view_function)
+    view_class = getattr(view_function, "view_class", None)
+    if view_class is not None:
+        return view_class.__name__
+    return request.endpoint or "none"
+
+
+def _timed_encoder(f):
+    @functools.wraps(f)
+    def decorated_function(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return f(*args, **kwargs)
+        finally:
+            if has_request_context() and "metrics_start" in g:
+                g.metrics_serialize_time += time.perf_counter() - start
+
+    return decorated_function
+
+
+class TimedJSONProvider(serialization.JSONProvider):
+    """
+    JSON provider recording the time spent encoding each request's json or
+    MessagePack.
+    """
+
+    dumps = _timed_encoder(serialization.JSONProvider.dumps)
+    encode = _timed_encoder(serialization.JSONProvider.encode)
+    encode_msgpack = _timed_encoder(serialization.JSONProvider.encode_msgpack)
+
+
+def _before_request():
+    g.metrics_start = time.perf_counter()
+    g.metrics_statements = 0
+    g.metrics_db_time = 0.0
+    g.metrics_serialize_time = 0.0
+
+
+def _after_request(response):
+    g.metrics_status = response.status_code
+    return response
+
+
+def _teardown_request(exc):
+    # Runs once the response has been sent, after the last chunk of a
+    # streamed response
+    if "metrics_start" not in g:
+        return
+    labels = (("view", view_name()), ("method", request.method))
+    status = g.get("metrics_status", 500)
+    registry.inc("http_requests_total", labels + (("status", str(status)),))
+    registry.observe(
+        "http_request_duration_seconds", labels, time.perf_counter() - g.metrics_start
+    )
+    registry.observe("db_statements_per_request", labels, g.metrics_statements)
+    registry.observe("db_time_seconds", labels, g.metrics_db_time)
+    registry.observe("serialize_time_seconds", labels, g.metrics_serialize_time)
+    del g.metrics_start
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info["metrics_query_start"] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info.pop("metrics_query_start", None)
+    if start is not None and has_request_context() and "metrics_start" in g:
+        g.metrics_statements += 1
+        g.metrics_db_time += time.perf_counter() - start
+
+
+def init_app(app, engine):
+    """
+    Record the metrics of the app's requests and of its engine's queries.
+
+    With METRICS_DIR set, each worker process also writes its snapshot to
+    that directory every METRICS_FLUSH_INTERVAL seconds, and the
+    /api/metrics endpoint reports the sum over all the snapshots. At exit,
+    the snapshot is folded into the one of the exited processes, see retire.
+
+    Parameters
+    ----------
+    app : Flask
+        Flask app whose config holds the METRICS_* settings.
+    engine : sqlalchemy.engine.Engine
+        Engine of the app.
+    """
+    directory = app.config.setdefault("METRICS_DIR", os.environ.get("METRICS_DIR"))
+    interval = app.config.setdefault("METRICS_FLUSH_INTERVAL", 15)
+    _settings["flush_interval"] = interval
+    app.config.setdefault("METRICS_ALLOW_LOCAL", False)
+
+    app.json = TimedJSONProvider(app)
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+
+    registry.add_collector("db_pool", pool_collector(engine))
+
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        threading.Thread(
+            target=_flusher,
+            args=(directory, interval),
+            name="metrics-flusher",
+            daemon=True,
+        ).start()
+        atexit.register(_exit, directory)
+        logger.info(f"Metrics: Writing snapshots to {directory}.")
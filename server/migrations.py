@@ -0,0 +1,304 @@
+from sqlalchemy import Column, func, inspect, Integer, MetaData, Table, select, text
+
+import click
+from flask.cli import with_appcontext
+
+from app import db
+
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("logger")
+
+# Kept out of db.metadata so that it is only ever managed by this module
+schema_version = Table(
+    "schema_version", MetaData(), Column("version", Integer, nullable=False)
+)
+
+# Registered migrations, as (version, description, function) tuples
+MIGRATIONS = []
+
+
+def migration(version, description):
+    """
+    Decorator that registers a function as the migration to a schema version.
+    The function is called with an open connection, inside the transaction
+    that also records the new schema version. Migrations must be idempotent
+    so that they can be applied to databases created by db.create_all().
+
+    Parameters
+    ----------
+    version : int
+        Schema version the migration upgrades to.
+    description : str
+        Short description, logged when the migration is applied.
+    """
+
+    def decorator(f):
+        MIGRATIONS.append((version, description, f))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return f
+
+    return decorator
+
+
+def get_version(connection):
+    """
+    Return the schema version of the database.
+
+    Parameters
+    ----------
+    connection : sqlalchemy.engine.Connection
+        Open connection to the database.
+
+    Returns
+    -------
+    int
+        Schema version, 0 if no migration has been applied yet.
+    """
+    schema_version.create(connection, checkfirst=True)
+    version = connection.execute(select(schema_version.c.version)).scalar()
+    return version or 0
+
+
+def _set_version(connection, version):
+    connection.execute(schema_version.delete())
+    connection.execute(schema_version.insert().values(version=version))
+
+
+def upgrade(engine=None):
+    """
+    Apply all pending migrations, each one in its own transaction.
+    Must be called within an app context if no engine is given.
+
+    Parameters
+    ----------
+    engine : sqlalchemy.engine.Engine or None
+        Engine of the database to upgrade, defaults to the app's engine.
+
+    Returns
+    -------
+    int
+        Schema version of the database after the upgrade.
+    """
+    engine = engine or db.engine
+    with engine.begin() as connection:
+        version = get_version(connection)
+
+    for target, description, f in MIGRATIONS:
+        if target <= version:
+            continue
+        logger.info(f"Migrations: Upgrading schema to version {target}: {description}")
+        with engine.begin() as connection:
+            f(connection)
+            _set_version(connection, target)
+        version = target
+    return version
+
+
+def verify_indexes(engine=None):
+    """
+    Check that every index declared on the models exists in the database.
+    Must be called within an app context if no engine is given.
+
+    Parameters
+    ----------
+    engine : sqlalchemy.engine.Engine or None
+        Engine of the database to check, defaults to the app's engine.
+
+    Returns
+    -------
+    list
+        Names of the missing indexes, empty if none is missing.
+    """
+    engine = engine or db.engine
+    inspector = inspect(engine)
+    missing = []
+    for table in db.metadata.sorted_tables:
+        if not table.indexes or not inspector.has_table(table.name):
+            continue
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        missing.extend(
+            index.name for index in table.indexes if index.name not in existing
+        )
+    if missing:
+        logger.error(f"Migrations: Missing database indexes: {missing}")
+    return missing
+
+
+def init_app(app):
+    """
+    Register the migration commands on the Flask CLI. Does not access the
+    database, see migrate_app.
+
+    Parameters
+    ----------
+    app : Flask
+        Flask app whose database is migrated.
+    """
+    app.config.setdefault("AUTO_MIGRATE", True)
+    app.cli.add_command(upgrade_command)
+    app.cli.add_command(version_command)
+
+
+def migrate_app(app):
+    """
+    Unless AUTO_MIGRATE is False, upgrade the database. Then check that the
+    expected indexes exist. Called by the app's startup hook.
+
+    Parameters
+    ----------
+    app : Flask
+        Flask app whose database is migrated.
+
+    Raises
+    ------
+    RuntimeError
+        Raised if indexes declared on the models are missing from the database.
+    """
+    with app.app_context():
+        if app.config["AUTO_MIGRATE"]:
+            logger.info("Applying database migrations.")
+            upgrade()
+        missing = verify_indexes()
+    if missing:
+        raise RuntimeError(
+            f"Database indexes {missing} are missing, run 'flask db-upgrade'."
+        )
+
+
+@click.command("db-upgrade")
+@with_appcontext
+def upgrade_command():
+    """Apply pending database migrations."""
+    version = upgrade()
+    click.echo(f"Database schema at version {version}.")
+
+
+@click.command("db-version")
+@with_appcontext
+def version_command():
+    """Show the database schema version."""
+    with db.engine.begin() as connection:
+        version = get_version(connection)
+    latest = MIGRATIONS[-1][0] if MIGRATIONS else 0
+    click.echo(f"Database schema at version {version} (latest: {latest}).")
+
+
+@migration(1, "create documents, user and domain tables")
+def create_initial_tables(connection):
+    from models import Document, User, Domain
+
+    db.metadata.create_all(
+        connection,
+        tables=[Document.__table__, User.__table__, Domain.__table__],
+    )
+
+
+@migration(2, "create full-text search index over document metadata")
+def create_search_index(connection):
+    import search
+
+    search.create_index(connection)
+
+
+@migration(3, "create table_generation table")
+def create_table_generation(connection):
+    from models import TableGeneration
+
+    TableGeneration.__table__.create(connection, checkfirst=True)
+    existing = set(connection.execute(select(TableGeneration.table_name)).scalars())
+    for table_name in TableGeneration.TABLES:
+        if table_name not in existing:
+            connection.execute(
+                TableGeneration.__table__.insert().values(
+                    table_name=table_name, generation=1
+                )
+            )
+
+
+@migration(4, "create doc_identifier counters, seeded from existing documents")
+def create_doc_identifier_counter(connection):
+    from models import DocIdentifierCounter
+
+    DocIdentifierCounter.__table__.create(connection, checkfirst=True)
+    DocIdentifierCounter.seed(connection)
+
+
+@migration(5, "create upload_job table")
+def create_upload_job(connection):
+    from models import UploadJob
+
+    UploadJob.__table__.create(connection, checkfirst=True)
+
+
+@migration(6, "add indexes on document doc_identifier, title, creator_email, time_created")
+def create_document_indexes(connection):
+    from models import Document
+
+    duplicates = connection.execute(
+        select(Document.doc_identifier)
+        .group_by(Document.doc_identifier)
+        .having(func.count() > 1)
+    ).scalars().all()
+    if duplicates:
+        raise ValueError(
+            "Migrations: Cannot add unique index on document.doc_identifier, "
+            f"duplicated values: {duplicates}"
+        )
+
+    # Only the indexes of this version, later ones may be on newer columns
+    columns = {"doc_identifier", "title", "creator_email", "time_created"}
+    for index in Document.__table__.indexes:
+        if {c.name for c in index.columns} <= columns:
+            index.create(connection, checkfirst=True)
+
+
+@migration(7, "add document change_seq, create tombstone and compaction floor tables")
+def create_change_log(connection):
+    from models import CompactionFloor, Document, DocumentTombstone
+
+    columns = {c["name"] for c in inspect(connection).get_columns("document")}
+    if "change_seq" not in columns:
+        connection.execute(
+            text(
+                "ALTER TABLE document "
+                "ADD COLUMN change_seq INTEGER NOT NULL DEFAULT 0"
+            )
+        )
+    for index in Document.__table__.indexes:
+        if {c.name for c in index.columns} == {"change_seq"}:
+            index.create(connection, checkfirst=True)
+
+    DocumentTombstone.__table__.create(connection, checkfirst=True)
+    CompactionFloor.__table__.create(connection, checkfirst=True)
+
+
+@migration(8, "create link_status table")
+def create_link_status(connection):
+    from models import LinkStatus, TableGeneration
+
+    LinkStatus.__table__.create(connection, checkfirst=True)
+    # Seeded so that responses built from it have a Last-Modified header
+    exists = connection.execute(
+        select(TableGeneration.table_name).where(
+            TableGeneration.table_name == LinkStatus.__tablename__
+        )
+    ).first()
+    if exists is None:
+        connection.execute(
+            TableGeneration.__table__.insert().values(
+                table_name=LinkStatus.__tablename__, generation=1
+            )
+        )
+
+
+@migration(9, "create task_lease table")
+def create_task_lease(connection):
+    from models import TaskLease
+
+    TaskLease.__table__.create(connection, checkfirst=True)
+    existing = set(connection.execute(select(TaskLease.task_name)).scalars())
+    for task_name in TaskLease.TASKS:
+        if task_name not in existing:
+            connection.execute(TaskLease.__table__.insert().values(task_name=task_name))
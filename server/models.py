@@ -1,20 +1,99 @@
+import datetime
+import json
 import re
+import time
+import uuid
 
+from sqlalchemy import text, tuple_, type_coerce
 from sqlalchemy.sql import func
 from sqlalchemy.inspection import inspect
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.exc import NoResultFound, MultipleResultsFound
 from sqlalchemy.orm import validates
 from app import db
+from cache import LRUCache
+from database import serialized_write
+from pagination import decode_cursor, encode_cursor, InvalidCursor
+import search
 
 import logging
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("logger")
 
+# Emails resolved by get_entity, including negative (False) entries. Mutations
+# of the User and Domain tables invalidate it in the process making them, the
+# other worker processes notice them through the tables' generations, see
+# _check_entity_generations.
+entity_cache = LRUCache(maxsize=1024, ttl=60)
+
+# Generations of the user and domain tables when they were last checked
+_entity_generations = {"value": None, "checked_at": 0.0, "interval": 1}
+
+# How long tombstones of deleted documents are kept for the changes endpoint
+tombstone_retention = datetime.timedelta(days=30)
+
+
+def init_entity_cache(app):
+    """
+    Configure the entity cache from the Flask app config.
+
+    An entry can be stale, e.g. a revoked superuser still be one, in the
+    worker processes other than the one that changed the user or domain for
+    at most ENTITY_CACHE_CHECK_INTERVAL seconds, and in any case no longer
+    than ENTITY_CACHE_TTL seconds.
+
+    Parameters
+    ----------
+    app : Flask
+        Flask app whose config holds the ENTITY_CACHE_* settings.
+    """
+    entity_cache.maxsize = app.config.setdefault("ENTITY_CACHE_SIZE", 1024)
+    entity_cache.ttl = app.config.setdefault("ENTITY_CACHE_TTL", 60)
+    _entity_generations["interval"] = app.config.setdefault(
+        "ENTITY_CACHE_CHECK_INTERVAL", 1
+    )
+
+
+def init_change_log(app):
+    """
+    Configure the retention of deleted documents' tombstones from the Flask
+    app config.
+
+    Parameters
+    ----------
+    app : Flask
+        Flask app whose config holds the TOMBSTONE_RETENTION_DAYS setting.
+    """
+    global tombstone_retention
+
+    days = app.config.setdefault("TOMBSTONE_RETENTION_DAYS", 30)
+    tombstone_retention = datetime.timedelta(days=days)
+
 
 class Serializer(object):
     """A mix-in to serialize SQLAlchemy models."""
 
+    # Named sets of columns accepted by resolve_fields, None meaning all columns
+    FIELD_PRESETS = {"full": None}
+
+    @classmethod
+    def _get_column_names(cls):
+        """
+        Private class method to return the names of the model's columns. The
+        mapper is only inspected once per model class.
+
+        Returns
+        -------
+        list
+            List of the model's column names
+        """
+        names = cls.__dict__.get("_column_names")
+        if names is None:
+            names = [attr.key for attr in inspect(cls).column_attrs]
+            cls._column_names = names
+        return names
+
     def serialize(self):
         """
         Serializes a single model object.
@@ -24,7 +103,7 @@ class Serializer(object):
         dict
             A dictionary with object's column names as keys and values as values
         """
-        return {c: getattr(self, c) for c in inspect(self).attrs.keys()}
+        return {c: getattr(self, c) for c in self._get_column_names()}
 
     @staticmethod
     def serialize_list(obj_list):
@@ -43,6 +122,117 @@ class Serializer(object):
         """
         return [m.serialize() for m in obj_list]
 
+    @classmethod
+    def resolve_fields(cls, fields):
+        """
+        Class method to validate a fields query parameter.
+
+        Parameters
+        ----------
+        fields : str or None
+            Comma-separated list of column names and FIELD_PRESETS names.
+
+        Returns
+        -------
+        list or None
+            The requested column names, in the model's column order, or None
+            if all the columns are requested.
+
+        Raises
+        ------
+        ValueError
+            Raised if a field is neither a column nor a preset.
+        """
+        if not fields:
+            return None
+        names = cls._get_column_names()
+        requested = set()
+        for field in fields.split(","):
+            field = field.strip()
+            if not field:
+                continue
+            if field in cls.FIELD_PRESETS:
+                preset = cls.FIELD_PRESETS[field]
+                requested.update(names if preset is None else preset)
+            elif field in names:
+                requested.add(field)
+            else:
+                raise ValueError(
+                    f"Unknown field {field}, fields must be among "
+                    f"{list(cls.FIELD_PRESETS) + names}"
+                )
+        if not requested:
+            raise ValueError("fields must not be empty")
+        if len(requested) == len(names):
+            return None
+        return [name for name in names if name in requested]
+
+    @classmethod
+    def select_columns(cls, fields=None):
+        """
+        Returns a Core select of the model's columns. Rows of this select are
+        plain tuples, no model objects are created or added to the session.
+
+        Parameters
+        ----------
+        fields : list or None
+            Names of the selected columns, as returned by resolve_fields.
+            None selects all the columns.
+
+        Returns
+        -------
+        sqlalchemy.sql.Select
+            Select of the model's columns, to be refined with where,
+            order_by, etc.
+        """
+        names = fields or cls._get_column_names()
+        return db.select(*[getattr(cls, c) for c in names])
+
+    @classmethod
+    def iter_dicts(cls, query, yield_per=None, fields=None):
+        """
+        Runs a select built with select_columns and yields its rows serialized,
+        with the same keys as serialize.
+
+        Parameters
+        ----------
+        query : sqlalchemy.sql.Select
+            Select built with select_columns.
+        yield_per : int or None
+            If given, rows are fetched from the db in batches of this size.
+        fields : list or None
+            Fields the select was built with.
+
+        Yields
+        ------
+        dict
+            Serialized row.
+        """
+        names = fields or cls._get_column_names()
+        if yield_per:
+            query = query.execution_options(yield_per=yield_per)
+        for row in db.session.execute(query):
+            yield dict(zip(names, row))
+
+    @classmethod
+    def select_dicts(cls, query, fields=None):
+        """
+        Runs a select built with select_columns and returns its rows serialized.
+
+        Parameters
+        ----------
+        query : sqlalchemy.sql.Select
+            Select built with select_columns.
+        fields : list or None
+            Fields the select was built with.
+
+        Returns
+        -------
+        list
+            List of serialized rows
+        """
+        return list(cls.iter_dicts(query, fields=fields))
+
 
 class Document(db.Model, Serializer):
     """
@@ -51,16 +241,48 @@ class Document(db.Model, Serializer):
     """
 
     pk = db.Column("pk", db.Integer, primary_key=True)
-    time_created = db.Column(db.DateTime(timezone=True), server_default=func.now())
+    time_created = db.Column(
+        db.DateTime(timezone=True), server_default=func.now(), index=True
+    )
     time_updated = db.Column(db.DateTime(timezone=True), onupdate=func.now())
-    title = db.Column("title", db.String(500), nullable=False)
+    title = db.Column("title", db.String(500), nullable=False, index=True)
     author = db.Column("author", db.String(500), nullable=False)
-    doc_identifier = db.Column("doc_identifier", db.String(20), nullable=False)
+    doc_identifier = db.Column(
+        "doc_identifier", db.String(20), nullable=False, unique=True, index=True
+    )
     doc_code = db.Column("doc_code", db.String(30), default="")
     compiled_url = db.Column("compiled_url", db.String(500), default="")
     source_url = db.Column("source_url", db.String(500), default="")
     abstract = db.Column("abstract", db.Text, default="")
-    creator_email = db.Column("creator_email", db.String(100), nullable=False)
+    creator_email = db.Column(
+        "creator_email", db.String(100), nullable=False, index=True
+    )
+    # Generation of the document table at the last create or update of the row
+    change_seq = db.Column(
+        "change_seq",
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+        index=True,
+    )
+
+    # 'summary' has what the documents table needs, without the long abstract
+    FIELD_PRESETS = {
+        "summary": [
+            "pk",
+            "time_created",
+            "time_updated",
+            "title",
+            "author",
+            "doc_identifier",
+            "doc_code",
+            "compiled_url",
+            "source_url",
+            "creator_email",
+        ],
+        "full": None,
+    }
 
     def __repr__(self):
         """
@@ -82,10 +304,16 @@ class Document(db.Model, Serializer):
         list
             List of the model's editable columns
         """
-        columns = inspect(self).attrs.keys()
-        return list(
-            set(columns) - set(["time_created", "time_udpate", "doc_identifier"])
-        )
+        columns = type(self).__dict__.get("_editable_columns")
+        if columns is None:
+            columns = list(
+                set(self._get_column_names())
+                - set(
+                    ["time_created", "time_udpate", "doc_identifier", "change_seq"]
+                )
+            )
+            type(self)._editable_columns = columns
+        return columns
 
     def _get_all_columns(self):
         """
@@ -96,10 +324,12 @@ class Document(db.Model, Serializer):
         list
             List of all the model's columns
         """
-        return inspect(self).attrs.keys()
+        return self._get_column_names()
 
     @staticmethod
     def _check_http(val):
+        if val is None:
+            return None
         val = val.strip()
         if val.startswith("http"):
             return val
@@ -108,6 +338,22 @@ class Document(db.Model, Serializer):
         else:
             return ""
 
+    def _set_columns(self, **kwargs):
+        """
+        Private method to set the editable columns given in the kwargs. Columns
+        missing from the kwargs or set to None are left unchanged. Does not
+        flush.
+        """
+        for column in self._get_editable_columns():
+            new_val = kwargs.get(column, None)
+
+            if column in ["compiled_url", "source_url"]:
+                new_val = self._check_http(new_val)
+
+            if new_val is not None:
+                setattr(self, column, new_val)
+
+    @serialized_write
     def update(self, **kwargs):
         """
         Method to update an existing object's column values with those in the
@@ -119,17 +365,12 @@ class Document(db.Model, Serializer):
             Returns True is update was successful and False if an error was
             encountered.
         """
-        columns = self._get_editable_columns()
         try:
-            for column in columns:
-                new_val = kwargs.get(column, None)
-
-                if column in ["compiled_url", "source_url"]:
-                    new_val = self._check_http(new_val)
-
-                if new_val is not None:
-                    setattr(self, column, new_val)
+            self._set_columns(**kwargs)
+            self.change_seq = TableGeneration.bump("document")
             db.session.add(self)
+            db.session.flush()
+            search.index_documents(db.session, [self])
             db.session.commit()
             logger.info("Documents: Updating Document object.")
         except Exception as e:
@@ -137,88 +378,48 @@ class Document(db.Model, Serializer):
             return False
         return True
 
+    @classmethod
+    def _generate_doc_identifiers(cls, count):
+        """
+        Class method to generate a block of new, unique doc_identifiers for new
+        documents. The doc_identifiers follow the pattern: 'stpyyyymm_nnnn',
+        where y=year, m=month, n=number.
+
+        The numbers are reserved from the per-month DocIdentifierCounter in a
+        single statement, within the caller's transaction. Concurrent callers
+        are serialized on the counter row, and the reservation is released if
+        the transaction is rolled back.
+
+        Parameters
+        ----------
+        count : int
+            Number of doc_identifiers to generate.
+
+        Returns
+        -------
+        list
+            Generated doc_identifiers, in increasing order.
+        """
+        # UTC, like the db server time used for the creation & update times
+        now = datetime.datetime.now(datetime.timezone.utc)
+        prefix = f'stp{now.strftime("%Y%m")}'
+
+        first = DocIdentifierCounter.reserve(prefix, count)
+        return [f"{prefix}_{number:04d}" for number in range(first, first + count)]
+
     @classmethod
     def _generate_doc_identifier(cls):
         """
         Class method to generate a new, unique doc_identifier for a new document.
-        The doc_identifier follows the pattern: 'stpyyymm_nnnn', where y=year,
+        The doc_identifier follows the pattern: 'stpyyyymm_nnnn', where y=year,
         m=month, n=number.
 
         Returns
         -------
         str
             Generated doc_identifier.
-
-        Raises
-        ------
-        e
-            Exception raised if no document already exists with a doc identifier
-            containing the current year & month.
-        ValueError
-            Exception raised if document already exists in the db with the newly
-            generated, unique doc_identifier.
-        ValueError
-            Exception raised if document exists with a doc identifier containing
-            the current year & month, but it doesn't follow the expected pattern
-            ('stpyyymm_nnnn').
         """
-        # Get db server time now (to be consistent with creation & update times).
-        # Don't have access to the creation time (gets generated at db level), so
-        # this is the next best thing.
-        now = db.session.execute(func.now()).all()[0][0]
-
-        # Build the datetime stub of the doc identifier
-        doc_identifier_dt = f'stp{now.strftime("%Y%m")}_'
-
-        # Find the latest Document entry with this doc_identifier stub
-        try:
-            document = db.session.scalars(
-                db.select(cls)
-                .where(cls.doc_identifier.startswith(doc_identifier_dt))
-                .order_by(cls.time_created.desc())
-            ).first()
-        except Exception as e:
-            logging.error(
-                f"Documents: Generating doc_identifier for new doc. " f"Error: {e}"
-            )
-            raise e
-
-        if document:
-            # If document with given stub exists, get its numerical part
-            pattern_match = re.match(
-                r"stp\d{6}_(?P<number>\d{4})", document.doc_identifier
-            )
-            highest_number = pattern_match.groupdict().get("number")
-
-            if highest_number:
-                # Documents have already been added this month.
-                # Build the next doc_identifier.
-                incremented = int(highest_number) + 1
-                doc_identifier = f"{doc_identifier_dt}{incremented:04d}"
-
-                # Sanity check that it doesn't exist
-                exists = db.session.scalars(
-                    db.select(cls).filter_by(doc_identifier=doc_identifier)
-                ).first()
-                if exists:
-                    raise ValueError(
-                        "Documents: Generating doc_identifier for new "
-                        "doc. Document already exists with generated "
-                        f"doc_identifier {doc_identifier}. HELP"
-                    )
-            else:
-                # We're in uncharted waters, pattern should have found a match
-                raise ValueError(
-                    "Documents: Generating doc_identifier for new doc. "
-                    "Document matching stub found, but no highest_number "
-                    f"found. Match: {pattern_match.groupdict()}. HELP"
-                )
-        else:
-            # No document found with given stub.
-            # New month, no documents added yet.
-            doc_identifier = f"{doc_identifier_dt}0001"
-
-        return doc_identifier
+        return cls._generate_doc_identifiers(1)[0]
 
     @classmethod
     def prepare_fields(cls, **kwargs):
@@ -261,6 +462,7 @@ class Document(db.Model, Serializer):
         return False
 
     @classmethod
+    @serialized_write
     def create(cls, **kwargs):
         """
         Class method to create a new object and add a new entry in the
@@ -273,19 +475,168 @@ class Document(db.Model, Serializer):
             object is returned, otherwise returns False.
         """
         try:
-            kwargs = cls.prepare_fields(**kwargs)
+            # Check before prepare_fields reserves a doc_identifier
             if cls.duplicate_exists(**kwargs):
                 raise ValueError("Documents: An entry with this title already exists")
+            kwargs = cls.prepare_fields(**kwargs)
 
             obj = cls(**kwargs)
+            obj.change_seq = TableGeneration.bump("document")
             db.session.add(obj)
+            db.session.flush()
+            search.index_documents(db.session, [obj])
             db.session.commit()
             logger.info("Documents: Creating Document object.")
             return obj
         except Exception as e:
+            db.session.rollback()
             logger.error(f"Documents: Creating Document object. Error: {e}")
             return False
 
+    @classmethod
+    def _insert_chunk(cls, rows, seen_titles):
+        """
+        Private class method that inserts a chunk of new documents with one
+        duplicate check query, one doc_identifier reservation and one bulk
+        insert. All the documents of the chunk get the same change_seq.
+        Does not commit.
+
+        Parameters
+        ----------
+        rows : list
+            List of (line number, fields dict) tuples.
+        seen_titles : set
+            Titles of the documents already inserted from the same file. Not
+            updated, see create_chunk.
+
+        Returns
+        -------
+        list
+            One outcome dict per row, with 'line', 'status' ('inserted',
+            'duplicate' or 'failed') and either 'doc_identifier' or 'message'.
+        """
+        titles = [fields.get("title") for _, fields in rows]
+        chunk_titles = set()
+        existing = set(
+            db.session.scalars(db.select(cls.title).where(cls.title.in_(titles)))
+        )
+
+        outcomes = {}
+        new_rows = []
+        for line_number, fields in rows:
+            title = fields.get("title")
+            if not title:
+                outcomes[line_number] = {"status": "failed", "message": "No title"}
+            elif title in seen_titles or title in chunk_titles:
+                outcomes[line_number] = {
+                    "status": "duplicate",
+                    "message": "Duplicate title in file",
+                }
+            elif title in existing:
+                outcomes[line_number] = {
+                    "status": "duplicate",
+                    "message": "An entry with this title already exists",
+                }
+            else:
+                chunk_titles.add(title)
+                new_rows.append((line_number, fields))
+
+        if new_rows:
+            doc_identifiers = cls._generate_doc_identifiers(len(new_rows))
+            change_seq = TableGeneration.bump("document")
+            values = []
+            for (_, fields), doc_identifier in zip(new_rows, doc_identifiers):
+                fields = dict(
+                    fields, doc_identifier=doc_identifier, change_seq=change_seq
+                )
+                for column in ["compiled_url", "source_url"]:
+                    if fields.get(column):
+                        fields[column] = cls._check_http(fields[column])
+                values.append(fields)
+
+            inserted = db.session.execute(
+                db.insert(cls).returning(cls.pk, sort_by_parameter_order=True),
+                values,
+            ).scalars()
+            for fields, pk in zip(values, inserted):
+                fields["pk"] = pk
+            search.index_rows(db.session, values)
+
+            for (line_number, _), fields in zip(new_rows, values):
+                outcomes[line_number] = {
+                    "status": "inserted",
+                    "doc_identifier": fields["doc_identifier"],
+                }
+
+        return [dict(outcomes[line_number], line=line_number) for line_number, _ in rows]
+
+    @classmethod
+    def bulk_create(cls, rows, chunk_size=500):
+        """
+        Class method to add many new entries in the documents table, skipping
+        duplicates, chunk by chunk. Each chunk is inserted within a savepoint,
+        so a failing chunk does not prevent the others from being added.
+        Does not commit.
+
+        Parameters
+        ----------
+        rows : list
+            List of (line number, fields dict) tuples. The fields dicts contain
+            the columns of the new documents, except doc_identifier.
+        chunk_size : int
+            Number of rows inserted per statement.
+
+        Returns
+        -------
+        list
+            One outcome dict per row, see Document._insert_chunk.
+        """
+        seen_titles = set()
+        outcomes = []
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start : start + chunk_size]
+            outcomes.extend(cls.create_chunk(chunk, seen_titles))
+        logger.info(f"Documents: Bulk creating {len(rows)} Document objects.")
+        return outcomes
+
+    @classmethod
+    def create_chunk(cls, rows, seen_titles):
+        """
+        Class method to add a chunk of new entries in the documents table within
+        a savepoint. If the chunk fails, the savepoint is rolled back and all
+        its rows are reported as failed. Does not commit.
+
+        Parameters
+        ----------
+        rows : list
+            List of (line number, fields dict) tuples.
+        seen_titles : set
+            Titles of the documents already inserted from the same file,
+            updated in place with the titles of the chunk once its savepoint
+            is released.
+
+        Returns
+        -------
+        list
+            One outcome dict per row, see Document._insert_chunk.
+        """
+        try:
+            with db.session.begin_nested():
+                outcomes = cls._insert_chunk(rows, seen_titles)
+        except Exception as e:
+            logger.error(f"Documents: Inserting chunk of Document objects. Error: {e}")
+            return [
+                {"line": line_number, "status": "failed", "message": str(e)}
+                for line_number, _ in rows
+            ]
+
+        # Titles of a rolled back chunk must not count as seen
+        inserted = {o["line"] for o in outcomes if o["status"] == "inserted"}
+        seen_titles.update(
+            fields.get("title") for line, fields in rows if line in inserted
+        )
+        return outcomes
+
     @classmethod
     def get_by_doc_identifier(cls, doc_identifier):
         """
@@ -322,84 +673,550 @@ class Document(db.Model, Serializer):
             )
             return None
 
-    def delete_doc(self):
+    @classmethod
+    def get_dict_by_doc_identifier(cls, doc_identifier, fields=None):
         """
-        Class method that deletes table entry.
+        Class method that retrieves the given columns of the entry for a
+        given doc_identifier, without loading the other columns.
+
+        Parameters
+        ----------
+        doc_identifier : str
+            doc_identifier of entry to be found
+        fields : list or None
+            Names of the serialized columns, as returned by resolve_fields.
+            None serializes all the columns.
 
         Returns
         -------
-        bool
-            If delete was successful, returns True, otherwise returns False
+        dict or None
+            Serialized entry, or None if no entry was found.
         """
-        try:
-            db.session.delete(self)
-            db.session.commit()
-            logger.info("Documents: Deleting Document object.")
-            return True
-        except Exception as e:
-            logger.error(f"Documents: Deleting Document object. Error: {e}")
-            return False
+        documents = cls.select_dicts(
+            cls.select_columns(fields).where(cls.doc_identifier == doc_identifier),
+            fields=fields,
+        )
+        if not documents:
+            logger.error(
+                f"Document: Document with doc_identifier {doc_identifier} not found."
+            )
+            return None
+        return documents[0]
 
+    @classmethod
+    def search(cls, query, limit=20, offset=0):
+        """
+        Class method that runs a ranked full-text search over the documents'
+        title, author, doc_code, doc_identifier and abstract.
 
-class User(db.Model, Serializer):
-    """
-    User model class to act as interface between the Flask logic and the
-    sql table.
-    """
+        Parameters
+        ----------
+        query : str
+            Search terms.
+        limit : int
+            Maximum number of documents returned.
+        offset : int
+            Number of matching documents to skip.
 
-    pk = db.Column("pk", db.Integer, primary_key=True)
-    email = db.Column("email", db.String(100), nullable=False, unique=True)
-    superuser = db.Column("superuser", db.Boolean, default=False, nullable=False)
-    access = db.Column("access", db.Integer, nullable=True)  # future-proofing
+        Returns
+        -------
+        tuple
+            (list of (Document object, rank) tuples in rank order, total
+            number of matching documents)
+        """
+        matches, total = search.match(db.session, query, limit=limit, offset=offset)
+        pks = [pk for pk, _ in matches]
+        documents = {
+            d.pk: d for d in db.session.scalars(db.select(cls).where(cls.pk.in_(pks)))
+        }
+        return [(documents[pk], rank) for pk, rank in matches if pk in documents], total
 
-    @validates("email")
-    def validate_email(self, key, email):
-        if not email:
-            raise AssertionError("No email provided")
-        if not re.match("[^@]+@[^@]+\.[^@]+", email):
-            raise AssertionError("Provided email is not an email address")
-        return email
+    # Keys the document listing can be sorted (and paginated) by
+    SORT_KEYS = ["time_created", "time_updated", "title", "author", "doc_identifier"]
 
-    def update(self, **kwargs):
+    @classmethod
+    def _sort_key(cls, sort):
         """
-        Method to update an existing object's column values with those in the
-        kwargs.
+        Private class method to return the SQL expression for a sort key.
+
+        Parameters
+        ----------
+        sort : str
+            Name of the sort key, one of Document.SORT_KEYS.
 
         Returns
         -------
-        bool
-            Returns True is update was successful and False if an error was
-            encountered.
+        SQL expression
+            Expression to order and paginate by.
         """
-        try:
-            for column in ["email", "superuser"]:
-                new_val = kwargs.get(column, None)
-
-                if column == "superuser":
-                    if new_val == "":
-                        new_val = False
-
-                if new_val is not None:
-                    setattr(self, column, new_val)
-            db.session.add(self)
-            db.session.commit()
-            logger.info("Users: Updating User object.")
-        except Exception as e:
-            logger.error(f"Users: Updating User object. Error: {e}")
-            return False
-        return True
+        if sort == "time_updated":
+            # Documents that were never edited sort by their creation time
+            column = func.coalesce(cls.time_updated, cls.time_created)
+        else:
+            column = getattr(cls, sort)
+
+        if db.session.get_bind().dialect.name == "sqlite":
+            # SQLite stores datetimes as text. Compare the stored text so that
+            # ties on server-generated timestamps (no microseconds) are broken
+            # correctly by the primary key.
+            column = type_coerce(column, db.String)
+        return column
+
+    # Columns the document listing and export can be filtered by
+    FILTER_COLUMNS = [
+        "title",
+        "author",
+        "doc_identifier",
+        "doc_code",
+        "compiled_url",
+        "source_url",
+        "abstract",
+        "creator_email",
+    ]
 
     @classmethod
-    def create(cls, **kwargs):
+    def apply_filters(cls, query, filters=None):
         """
-        Class method to create a new object and add a new entry in the
-        user table.
+        Class method that restricts a select to the documents matching
+        column filters, like the column filters of the documents table in
+        the client: case-insensitive substring matches, all of which must
+        match.
+
+        Parameters
+        ----------
+        query : Select
+            Select of documents or document columns.
+        filters : dict or None
+            Substring to match by column name, columns being among
+            Document.FILTER_COLUMNS. Empty substrings are ignored.
 
         Returns
         -------
-        bool or User object
-            If table successfully updated and object succesfully created,
-            object is returned, otherwise returns False.
+        Select
+            The filtered select.
+
+        Raises
+        ------
+        ValueError
+            Raised if a column cannot be filtered by.
+        """
+        for name, term in (filters or {}).items():
+            if name not in cls.FILTER_COLUMNS:
+                raise ValueError(
+                    f"Cannot filter by {name}, filter columns are {cls.FILTER_COLUMNS}"
+                )
+            if term:
+                query = query.where(
+                    getattr(cls, name).icontains(term, autoescape=True)
+                )
+        return query
+
+    @classmethod
+    def approximate_count(cls):
+        """
+        Class method that returns the (approximate) number of documents.
+        On Postgres the planner's estimate is used to avoid a full count.
+
+        Returns
+        -------
+        int
+            Number of documents in the table.
+        """
+        if db.session.get_bind().dialect.name == "postgresql":
+            estimate = db.session.execute(
+                text("SELECT reltuples FROM pg_class WHERE relname = :name"),
+                {"name": cls.__tablename__},
+            ).scalar()
+            if estimate is not None and estimate >= 0:
+                return int(estimate)
+        return db.session.execute(db.select(func.count()).select_from(cls)).scalar()
+
+    @classmethod
+    def get_page(
+        cls,
+        sort="time_created",
+        descending=False,
+        limit=50,
+        cursor=None,
+        fields=None,
+        filters=None,
+    ):
+        """
+        Class method that retrieves one page of documents using keyset
+        pagination on (sort key, pk).
+
+        Parameters
+        ----------
+        sort : str
+            Name of the sort key, one of Document.SORT_KEYS.
+        descending : bool
+            Whether to sort in descending order.
+        limit : int
+            Maximum number of documents in the page.
+        cursor : str or None
+            Cursor returned with the previous page, None for the first page.
+        fields : list or None
+            Names of the serialized columns, as returned by resolve_fields.
+            None serializes all the columns.
+        filters : dict or None
+            Column filters, as accepted by apply_filters.
+
+        Returns
+        -------
+        tuple
+            (list of serialized documents, cursor of the next page or None)
+
+        Raises
+        ------
+        InvalidCursor
+            Raised if the cursor is malformed or was generated for another
+            sort order.
+        """
+        if sort not in cls.SORT_KEYS:
+            raise ValueError(f"Invalid sort key {sort}")
+
+        key = cls._sort_key(sort)
+        # The cursor columns come last, after the requested ones
+        query = cls.select_columns(fields).add_columns(
+            cls.pk.label("cursor_pk"), key.label("sort_key")
+        )
+        query = cls.apply_filters(query, filters)
+
+        if cursor:
+            cursor_sort, cursor_descending, last_key, last_pk = decode_cursor(cursor)
+            if (cursor_sort, cursor_descending) != (sort, descending):
+                raise InvalidCursor("Cursor does not match the requested sort order")
+            if descending:
+                query = query.where(tuple_(key, cls.pk) < tuple_(last_key, last_pk))
+            else:
+                query = query.where(tuple_(key, cls.pk) > tuple_(last_key, last_pk))
+
+        if descending:
+            query = query.order_by(key.desc(), cls.pk.desc())
+        else:
+            query = query.order_by(key.asc(), cls.pk.asc())
+
+        # Fetch one extra row to know whether there is a next page
+        rows = db.session.execute(query.limit(limit + 1)).all()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last_row = rows[-1]
+            next_cursor = encode_cursor(sort, descending, last_row[-1], last_row[-2])
+        names = fields or cls._get_column_names()
+        return [dict(zip(names, row)) for row in rows], next_cursor
+
+    @classmethod
+    def get_changes(cls, since=None, fields=None):
+        """
+        Class method that retrieves the documents created or updated, and the
+        doc_identifiers of the documents deleted, after a change sequence.
+
+        If since is None, older than the tombstones still kept, or newer than
+        the current change sequence (e.g. a token from another database),
+        all the documents are returned instead and the client must replace
+        its copy of the catalog.
+
+        Parameters
+        ----------
+        since : int or None
+            Change sequence the client is up to date with.
+        fields : list or None
+            Names of the serialized columns, as returned by resolve_fields.
+            None serializes all the columns.
+
+        Returns
+        -------
+        tuple
+            (list of serialized documents, list of deleted doc_identifiers,
+            new change sequence, whether this is a full resync)
+        """
+        # Writers are serialized on the generation row, so every change up
+        # to the generation read here is committed. Changes committed after
+        # it may be returned too, and will be returned again next time.
+        current = TableGeneration.get_generations(["document"])["document"][0]
+        floor = CompactionFloor.get_floor("document")
+
+        query = cls.select_columns(fields).order_by(cls.change_seq.asc(), cls.pk.asc())
+        if since is None or since < floor or since > current:
+            return cls.select_dicts(query, fields=fields), [], current, True
+
+        documents = cls.select_dicts(query.where(cls.change_seq > since), fields=fields)
+        deleted = DocumentTombstone.get_deleted_since(since)
+        return documents, deleted, current, False
+
+    @classmethod
+    def _record_deletions(cls, deleted, change_seq):
+        """
+        Private class method that removes deleted documents from the
+        full-text index and records their tombstones. Must be called within
+        the transaction that deletes them. Does not commit.
+
+        Parameters
+        ----------
+        deleted : list
+            List of (pk, doc_identifier) tuples of the deleted documents.
+        change_seq : int
+            Generation of the document table bumped by the deletion.
+        """
+        if not deleted:
+            return
+        search.remove_documents(db.session, [pk for pk, _ in deleted])
+        DocumentTombstone.record([d for _, d in deleted], change_seq)
+        DocumentTombstone.compact()
+
+    @classmethod
+    def get_by_doc_identifiers(cls, doc_identifiers):
+        """
+        Class method that retrieves the entries for many doc_identifiers with
+        one query.
+
+        Parameters
+        ----------
+        doc_identifiers : list
+            doc_identifiers of the entries to be found.
+
+        Returns
+        -------
+        dict
+            Document objects by doc_identifier. doc_identifiers without an
+            entry are missing.
+        """
+        doc_identifiers = list(set(doc_identifiers))
+        if not doc_identifiers:
+            return {}
+        documents = db.session.scalars(
+            db.select(cls).where(cls.doc_identifier.in_(doc_identifiers))
+        )
+        return {document.doc_identifier: document for document in documents}
+
+    # Operations accepted by apply_batch
+    BATCH_OPERATIONS = ["update", "delete"]
+
+    @classmethod
+    def _check_batch(cls, operations, documents, email, superuser):
+        """
+        Private class method that checks the operations of a batch against the
+        loaded documents, before anything is written.
+
+        Returns
+        -------
+        tuple
+            (one outcome dict per operation, list of (outcome, document,
+            operation) tuples of the operations that passed the checks)
+        """
+        outcomes = []
+        accepted = []
+        deleted = set()
+        for index, operation in enumerate(operations):
+            if not isinstance(operation, dict):
+                operation = {}
+            op = operation.get("op")
+            doc_identifier = operation.get("doc_identifier")
+            outcome = {"index": index, "op": op, "doc_identifier": doc_identifier}
+            outcomes.append(outcome)
+
+            document = documents.get(doc_identifier)
+            if op not in cls.BATCH_OPERATIONS:
+                outcome["status"] = "invalid"
+                outcome["message"] = f"op must be one of {cls.BATCH_OPERATIONS}"
+            elif op == "update" and not isinstance(operation.get("data"), dict):
+                outcome["status"] = "invalid"
+                outcome["message"] = "data must be an object"
+            elif document is None or doc_identifier in deleted:
+                outcome["status"] = "not_found"
+                outcome["message"] = "Document not found"
+            elif document.creator_email != email and not superuser:
+                outcome["status"] = "forbidden"
+                outcome["message"] = f"User not authorized to {op} this document"
+            else:
+                if op == "delete":
+                    deleted.add(doc_identifier)
+                accepted.append((outcome, document, operation))
+        return outcomes, accepted
+
+    @classmethod
+    def apply_batch(cls, operations, email, superuser=False, atomic=True):
+        """
+        Class method to update and delete many entries, loaded with one query.
+        Ownership is checked for every operation before anything is written,
+        and all the written documents get the same change_seq. Does not
+        commit.
+
+        In atomic mode, no operation is applied unless all of them succeed.
+        Otherwise each operation is applied within its own savepoint, so a
+        failing operation does not prevent the others from being applied.
+
+        Parameters
+        ----------
+        operations : list
+            List of dicts with 'op' (one of Document.BATCH_OPERATIONS),
+            'doc_identifier' and, for updates, 'data', the new column values.
+        email : str
+            Email of the user applying the batch.
+        superuser : bool
+            Whether the user is a superuser, who can write any document and
+            set creator_email.
+        atomic : bool
+            Whether to apply all the operations or none.
+
+        Returns
+        -------
+        list
+            One outcome dict per operation, with 'index', 'op',
+            'doc_identifier', 'status' ('updated', 'deleted', 'invalid',
+            'not_found', 'forbidden', 'failed' or 'skipped') and, unless
+            applied, 'message'.
+        """
+        documents = cls.get_by_doc_identifiers(
+            [o.get("doc_identifier") for o in operations if isinstance(o, dict)]
+        )
+        outcomes, accepted = cls._check_batch(operations, documents, email, superuser)
+        if not accepted or (atomic and len(accepted) < len(operations)):
+            for outcome, _, _ in accepted:
+                outcome["status"] = "skipped"
+                outcome["message"] = "Not applied, another operation failed"
+            return outcomes
+
+        try:
+            with db.session.begin_nested():
+                change_seq = TableGeneration.bump("document")
+                updated = {}
+                deleted = {}
+                for outcome, document, operation in accepted:
+                    pk = document.pk
+                    try:
+                        with db.session.begin_nested():
+                            if outcome["op"] == "delete":
+                                db.session.delete(document)
+                            else:
+                                data = dict(operation["data"])
+                                if not superuser:
+                                    data.pop("creator_email", None)
+                                document._set_columns(**data)
+                                document.change_seq = change_seq
+                            db.session.flush()
+                    except Exception as e:
+                        logger.error(
+                            f"Documents: Batch {outcome['op']} of Document object. "
+                            f"Error: {e}"
+                        )
+                        outcome["status"] = "failed"
+                        outcome["message"] = str(e)
+                        if atomic:
+                            raise
+                        continue
+
+                    if outcome["op"] == "delete":
+                        deleted[pk] = outcome["doc_identifier"]
+                        outcome["status"] = "deleted"
+                    else:
+                        updated[pk] = document
+                        outcome["status"] = "updated"
+
+                search.index_documents(
+                    db.session, [d for pk, d in updated.items() if pk not in deleted]
+                )
+                cls._record_deletions(list(deleted.items()), change_seq)
+        except Exception as e:
+            logger.error(f"Documents: Applying batch of operations. Error: {e}")
+            for outcome, _, _ in accepted:
+                if outcome.get("status") != "failed":
+                    outcome["status"] = "skipped"
+                    outcome["message"] = "Not applied, the batch was rolled back"
+            return outcomes
+
+        logger.info(f"Documents: Applied batch of {len(accepted)} operations.")
+        return outcomes
+
+    @serialized_write
+    def delete_doc(self):
+        """
+        Class method that deletes table entry.
+
+        Returns
+        -------
+        bool
+            If delete was successful, returns True, otherwise returns False
+        """
+        try:
+            db.session.delete(self)
+            change_seq = TableGeneration.bump("document")
+            self._record_deletions([(self.pk, self.doc_identifier)], change_seq)
+            db.session.commit()
+            logger.info("Documents: Deleting Document object.")
+            return True
+        except Exception as e:
+            logger.error(f"Documents: Deleting Document object. Error: {e}")
+            return False
+
+
+class User(db.Model, Serializer):
+    """
+    User model class to act as interface between the Flask logic and the
+    sql table.
+    """
+
+    pk = db.Column("pk", db.Integer, primary_key=True)
+    email = db.Column("email", db.String(100), nullable=False, unique=True)
+    superuser = db.Column("superuser", db.Boolean, default=False, nullable=False)
+    access = db.Column("access", db.Integer, nullable=True)  # future-proofing
+
+    @validates("email")
+    def validate_email(self, key, email):
+        if not email:
+            raise AssertionError("No email provided")
+        if not re.match("[^@]+@[^@]+\.[^@]+", email):
+            raise AssertionError("Provided email is not an email address")
+        return email
+
+    @serialized_write
+    def update(self, **kwargs):
+        """
+        Method to update an existing object's column values with those in the
+        kwargs.
+
+        Returns
+        -------
+        bool
+            Returns True is update was successful and False if an error was
+            encountered.
+        """
+        old_email = self.email
+        try:
+            for column in ["email", "superuser"]:
+                new_val = kwargs.get(column, None)
+
+                if column == "superuser":
+                    if new_val == "":
+                        new_val = False
+
+                if new_val is not None:
+                    setattr(self, column, new_val)
+            db.session.add(self)
+            TableGeneration.bump("user")
+            db.session.commit()
+            logger.info("Users: Updating User object.")
+        except Exception as e:
+            logger.error(f"Users: Updating User object. Error: {e}")
+            return False
+        finally:
+            entity_cache.pop(old_email)
+            entity_cache.pop(self.email)
+        return True
+
+    @classmethod
+    @serialized_write
+    def create(cls, **kwargs):
+        """
+        Class method to create a new object and add a new entry in the
+        user table.
+
+        Returns
+        -------
+        bool or User object
+            If table successfully updated and object succesfully created,
+            object is returned, otherwise returns False.
         """
         try:
             data = {"email": kwargs["email"]}
@@ -407,8 +1224,10 @@ class User(db.Model, Serializer):
                 data["superuser"] = kwargs["superuser"]
             obj = cls(**data)
             db.session.add(obj)
+            TableGeneration.bump("user")
             db.session.commit()
             logger.info("Users: Creating User object.")
+            entity_cache.pop(obj.email)
             return obj
         except Exception as e:
             logger.error(f"Users: Creating User object. Error: {e}")
@@ -462,6 +1281,7 @@ class User(db.Model, Serializer):
             logger.error(f"User: Error: {e}:\n User with pk " f"{pk} not found.")
             return None
 
+    @serialized_write
     def delete_user(self):
         """
         Class method that deletes table entry.
@@ -473,8 +1293,10 @@ class User(db.Model, Serializer):
         """
         try:
             db.session.delete(self)
+            TableGeneration.bump("user")
             db.session.commit()
             logger.info("User: Deleting User object.")
+            entity_cache.pop(self.email)
             return True
         except Exception as e:
             logger.error(f"User: Deleting User object. Error: {e}")
@@ -501,6 +1323,7 @@ class Domain(db.Model, Serializer):
             raise AssertionError("Provided email_domain is not valid")
         return email_domain
 
+    @serialized_write
     def update(self, **kwargs):
         """
         Method to update an existing object's column values with those in the
@@ -518,14 +1341,18 @@ class Domain(db.Model, Serializer):
             if new_val is not None:
                 setattr(self, "email_domain", new_val)
             db.session.add(self)
+            TableGeneration.bump("domain")
             db.session.commit()
             logger.info("Domains: Updating Domain object.")
         except Exception as e:
             logger.error(f"Domains: Updating Domain object. Error: {e}")
             return False
+        finally:
+            entity_cache.clear()
         return True
 
     @classmethod
+    @serialized_write
     def create(cls, **kwargs):
         """
         Class method to create a new object and add a new entry in the
@@ -541,8 +1368,10 @@ class Domain(db.Model, Serializer):
             data = {"email_domain": kwargs["email_domain"]}
             obj = cls(**data)
             db.session.add(obj)
+            TableGeneration.bump("domain")
             db.session.commit()
             logger.info("Domains: Creating Domain object.")
+            entity_cache.clear()
             return obj
         except Exception as e:
             logger.error(f"Domains: Creating Domain object. Error: {e}")
@@ -620,6 +1449,7 @@ class Domain(db.Model, Serializer):
             logger.error(f"Domain: Error: {e}:\n Domain with pk " f"{pk} not found.")
             return None
 
+    @serialized_write
     def delete_domain(self):
         """
         Class method that deletes table entry.
@@ -631,32 +1461,754 @@ class Domain(db.Model, Serializer):
         """
         try:
             db.session.delete(self)
+            TableGeneration.bump("domain")
             db.session.commit()
             logger.info("Domain: Deleting Domain object.")
+            entity_cache.clear()
             return True
         except Exception as e:
             logger.error(f"Domain: Deleting Domain object. Error: {e}")
             return False
 
 
-def get_entity(email):
-    user = User.get_by_email(email)
-    if not user:
-        logger.error(f"get_entity: {email} not in the Users table\n")
-        domain = Domain.get_by_email(email)
-        if not domain:
-            logger.error(f"get_entity: {email} not in the Domains table\n")
+class DocIdentifierCounter(db.Model):
+    """
+    Last number allocated for each doc_identifier prefix ('stpyyyymm').
+    """
+
+    prefix = db.Column("prefix", db.String(20), primary_key=True)
+    last_number = db.Column("last_number", db.Integer, nullable=False, default=0)
+
+    # Pattern of the doc_identifiers generated from the counters
+    PATTERN = re.compile(r"^(?P<prefix>stp\d{6})_(?P<number>\d{4,})$")
+
+    def __repr__(self):
+        return f"<DocIdentifierCounter {self.prefix} {self.last_number}>"
+
+    @classmethod
+    def reserve(cls, prefix, count=1):
+        """
+        Class method that atomically reserves a contiguous block of numbers for
+        a prefix, with a single INSERT ... ON CONFLICT DO UPDATE ... RETURNING.
+        Must be called within the transaction that uses the numbers.
+
+        Parameters
+        ----------
+        prefix : str
+            doc_identifier prefix, e.g. 'stp202401'.
+        count : int
+            Number of numbers to reserve.
+
+        Returns
+        -------
+        int
+            First number of the reserved block.
+        """
+        dialect = db.session.get_bind().dialect.name
+        insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        table = cls.__table__
+        last_number = db.session.execute(
+            insert(table)
+            .values(prefix=prefix, last_number=count)
+            .on_conflict_do_update(
+                index_elements=[table.c.prefix],
+                set_={"last_number": table.c.last_number + count},
+            )
+            .returning(table.c.last_number)
+        ).scalar()
+        return last_number - count + 1
+
+    @classmethod
+    def seed(cls, connection):
+        """
+        Class method that sets the counters from the doc_identifiers already
+        in the documents table, so that new numbers follow the existing ones.
+
+        Parameters
+        ----------
+        connection : sqlalchemy.engine.Connection
+            Open connection to the database.
+        """
+        highest = {}
+        doc_identifiers = connection.execute(
+            db.select(Document.doc_identifier).where(
+                Document.doc_identifier.startswith("stp")
+            )
+        ).scalars()
+        for doc_identifier in doc_identifiers:
+            pattern_match = cls.PATTERN.match(doc_identifier)
+            if pattern_match:
+                prefix = pattern_match.group("prefix")
+                number = int(pattern_match.group("number"))
+                highest[prefix] = max(number, highest.get(prefix, 0))
+
+        table = cls.__table__
+        for prefix, number in highest.items():
+            current = connection.execute(
+                db.select(table.c.last_number).where(table.c.prefix == prefix)
+            ).scalar()
+            if current is None:
+                connection.execute(
+                    table.insert().values(prefix=prefix, last_number=number)
+                )
+            elif current < number:
+                connection.execute(
+                    table.update()
+                    .where(table.c.prefix == prefix)
+                    .values(last_number=number)
+                )
+        logger.info(f"DocIdentifierCounter: Seeded {len(highest)} counters.")
+
+
+class UploadJob(db.Model):
+    """
+    UploadJob model class to persist uploaded metadata files processed in the
+    background, and their progress.
+    """
+
+    job_id = db.Column("job_id", db.String(32), primary_key=True)
+    creator_email = db.Column("creator_email", db.String(100), nullable=False)
+    filename = db.Column("filename", db.String(500), default="")
+    content = db.Column("content", db.Text, nullable=False)
+    status = db.Column("status", db.String(20), nullable=False, default="queued")
+    rows_parsed = db.Column("rows_parsed", db.Integer, nullable=False, default=0)
+    next_row = db.Column("next_row", db.Integer, nullable=False, default=0)
+    inserted = db.Column("inserted", db.Integer, nullable=False, default=0)
+    duplicates = db.Column("duplicates", db.Integer, nullable=False, default=0)
+    failed = db.Column("failed", db.Integer, nullable=False, default=0)
+    errors = db.Column("errors", db.Text, default="[]")
+    worker = db.Column("worker", db.String(100), default="")
+    time_created = db.Column(db.DateTime(timezone=True), server_default=func.now())
+    time_started = db.Column(db.DateTime(timezone=True), nullable=True)
+    time_finished = db.Column(db.DateTime(timezone=True), nullable=True)
+    heartbeat = db.Column(db.DateTime(timezone=True), nullable=True)
+
+    # Number of failed row outcomes kept in errors
+    MAX_ERRORS = 100
+
+    def __repr__(self):
+        return f"<UploadJob {self.job_id} {self.status}>"
+
+    def serialize(self):
+        """
+        Serializes the job's progress, without the file content.
+
+        Returns
+        -------
+        dict
+            A dictionary with the job's status and counters, and the elapsed
+            time in seconds.
+        """
+        start = self.time_started or self.time_created
+        end = self.time_finished or datetime.datetime.now(datetime.timezone.utc)
+        if start is not None and start.tzinfo is None:
+            start = start.replace(tzinfo=datetime.timezone.utc)
+        if end.tzinfo is None:
+            end = end.replace(tzinfo=datetime.timezone.utc)
+        elapsed = (end - start).total_seconds() if start is not None else 0.0
+
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "filename": self.filename,
+            "creator_email": self.creator_email,
+            "rows_parsed": self.rows_parsed,
+            "rows_processed": self.next_row,
+            "inserted": self.inserted,
+            "duplicates": self.duplicates,
+            "failed": self.failed,
+            "errors": json.loads(self.errors or "[]"),
+            "time_created": self.time_created,
+            "time_started": self.time_started,
+            "time_finished": self.time_finished,
+            "elapsed_seconds": round(max(elapsed, 0.0), 3),
+        }
+
+    @classmethod
+    @serialized_write
+    def create(cls, **kwargs):
+        """
+        Class method to create a new, queued job.
+
+        Returns
+        -------
+        bool or UploadJob object
+            If table successfully updated and object succesfully created,
+            object is returned, otherwise returns False.
+        """
+        try:
+            obj = cls(job_id=uuid.uuid4().hex, status="queued", **kwargs)
+            db.session.add(obj)
+            db.session.commit()
+            logger.info("UploadJobs: Creating UploadJob object.")
+            return obj
+        except Exception as e:
+            logger.error(f"UploadJobs: Creating UploadJob object. Error: {e}")
             return False
+
+    @classmethod
+    def get_by_job_id(cls, job_id):
+        """
+        Class method that retrieves the job with a given job_id.
+
+        Parameters
+        ----------
+        job_id : str
+            job_id of the job to be found
+
+        Returns
+        -------
+        UploadJob object or None
+            UploadJob object with given job_id, or None if not found.
+        """
+        return db.session.get(cls, job_id)
+
+    @classmethod
+    @serialized_write
+    def claim(cls, job_id, worker, stale_before):
+        """
+        Class method that atomically marks a job as running on a worker, if it
+        is queued or if the worker running it stopped sending heartbeats.
+
+        Parameters
+        ----------
+        job_id : str
+            job_id of the job to claim.
+        worker : str
+            Identifier of the claiming worker.
+        stale_before : datetime
+            Running jobs with an older heartbeat are considered abandoned.
+
+        Returns
+        -------
+        bool
+            True if the job was claimed, False otherwise.
+        """
+        result = db.session.execute(
+            db.update(cls)
+            .where(
+                cls.job_id == job_id,
+                db.or_(
+                    cls.status == "queued",
+                    db.and_(cls.status == "running", cls.heartbeat < stale_before),
+                ),
+            )
+            .values(
+                status="running",
+                worker=worker,
+                heartbeat=func.now(),
+                time_started=func.coalesce(cls.time_started, func.now()),
+            )
+        )
+        db.session.commit()
+        return result.rowcount == 1
+
+    def record_chunk(self, outcomes, next_row):
+        """
+        Method to add the outcomes of a processed chunk to the job's counters.
+        Does not commit, so that the progress is committed together with the
+        chunk's documents.
+
+        Parameters
+        ----------
+        outcomes : list
+            Outcome dicts returned by Document.create_chunk.
+        next_row : int
+            Index of the first row of the next chunk.
+        """
+        errors = json.loads(self.errors or "[]")
+        for outcome in outcomes:
+            if outcome["status"] == "inserted":
+                self.inserted += 1
+            elif outcome["status"] == "duplicate":
+                self.duplicates += 1
+            else:
+                self.failed += 1
+                if len(errors) < self.MAX_ERRORS:
+                    errors.append(outcome)
+        self.errors = json.dumps(errors)
+        self.next_row = next_row
+        self.heartbeat = func.now()
+        db.session.add(self)
+
+
+class DocumentTombstone(db.Model):
+    """
+    Record of a deleted document, so that clients syncing the catalog with
+    the changes endpoint learn about the deletion.
+    """
+
+    pk = db.Column("pk", db.Integer, primary_key=True)
+    doc_identifier = db.Column("doc_identifier", db.String(20), nullable=False)
+    change_seq = db.Column("change_seq", db.Integer, nullable=False, index=True)
+    time_deleted = db.Column(
+        db.DateTime(timezone=True), server_default=func.now(), index=True
+    )
+
+    def __repr__(self):
+        return f"<DocumentTombstone {self.doc_identifier} {self.change_seq}>"
+
+    @classmethod
+    def record(cls, doc_identifiers, change_seq):
+        """
+        Class method that records the deletion of documents. Must be called
+        within the transaction that deletes them. Does not commit.
+
+        Parameters
+        ----------
+        doc_identifiers : list
+            doc_identifiers of the deleted documents.
+        change_seq : int
+            Generation of the document table bumped by the deletion.
+        """
+        db.session.execute(
+            db.insert(cls),
+            [{"doc_identifier": d, "change_seq": change_seq} for d in doc_identifiers],
+        )
+
+    @classmethod
+    def get_deleted_since(cls, since):
+        """
+        Class method that retrieves the doc_identifiers of the documents
+        deleted after a change sequence.
+
+        Parameters
+        ----------
+        since : int
+            Change sequence.
+
+        Returns
+        -------
+        list
+            doc_identifiers, in deletion order.
+        """
+        return db.session.scalars(
+            db.select(cls.doc_identifier)
+            .where(cls.change_seq > since)
+            .order_by(cls.change_seq.asc(), cls.pk.asc())
+        ).all()
+
+    @classmethod
+    def compact(cls, retention=None):
+        """
+        Class method that deletes the tombstones older than the retention
+        period, and raises the compaction floor to the newest deleted one.
+        Sync tokens older than the floor then require a full resync.
+        Does not commit.
+
+        Parameters
+        ----------
+        retention : datetime.timedelta or None
+            Retention period, defaults to TOMBSTONE_RETENTION_DAYS.
+
+        Returns
+        -------
+        int
+            Number of deleted tombstones.
+        """
+        cutoff = datetime.datetime.now(datetime.timezone.utc) - (
+            retention or tombstone_retention
+        )
+        floor = db.session.scalar(
+            db.select(func.max(cls.change_seq)).where(cls.time_deleted < cutoff)
+        )
+        if floor is None:
+            return 0
+        deleted = db.session.execute(
+            db.delete(cls).where(cls.change_seq <= floor)
+        ).rowcount
+        CompactionFloor.raise_floor("document", floor)
+        logger.info(f"DocumentTombstone: Compacted {deleted} tombstones.")
+        return deleted
+
+
+class CompactionFloor(db.Model):
+    """
+    Highest change sequence of a table whose tombstones were compacted away.
+    """
+
+    table_name = db.Column("table_name", db.String(50), primary_key=True)
+    change_seq = db.Column("change_seq", db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<CompactionFloor {self.table_name} {self.change_seq}>"
+
+    @classmethod
+    def get_floor(cls, table_name):
+        """
+        Class method that retrieves the compaction floor of a table.
+
+        Parameters
+        ----------
+        table_name : str
+            Name of the table.
+
+        Returns
+        -------
+        int
+            Compaction floor, 0 if the table's tombstones were never compacted.
+        """
+        floor = db.session.scalar(
+            db.select(cls.change_seq).where(cls.table_name == table_name)
+        )
+        return floor or 0
+
+    @classmethod
+    def raise_floor(cls, table_name, change_seq):
+        """
+        Class method that raises the compaction floor of a table. Does not
+        commit.
+
+        Parameters
+        ----------
+        table_name : str
+            Name of the table.
+        change_seq : int
+            New floor, ignored if lower than the current one.
+        """
+        floor = db.session.get(cls, table_name)
+        if floor is None:
+            db.session.add(cls(table_name=table_name, change_seq=change_seq))
         else:
-            logger.info(f"get_entity: Domain exists for {email}\n")
-            return domain
-    else:
+            floor.change_seq = max(floor.change_seq, change_seq)
+
+
+class LinkStatus(db.Model):
+    """
+    Result of the last health check of a document's compiled_url or
+    source_url, see linkcheck.
+    """
+
+    pk = db.Column("pk", db.Integer, primary_key=True)
+    doc_identifier = db.Column("doc_identifier", db.String(20), nullable=False)
+    field = db.Column("field", db.String(20), nullable=False)
+    url = db.Column("url", db.String(500), nullable=False)
+    ok = db.Column("ok", db.Boolean, nullable=False, default=False)
+    status_code = db.Column("status_code", db.Integer)
+    final_url = db.Column("final_url", db.String(500))
+    latency_ms = db.Column("latency_ms", db.Float)
+    error = db.Column("error", db.String(500))
+    time_checked = db.Column(
+        db.DateTime(timezone=True), server_default=func.now(), index=True
+    )
+
+    __table_args__ = (
+        db.Index(
+            "ix_link_status_doc_identifier_field", "doc_identifier", "field", unique=True
+        ),
+    )
+
+    # Document columns whose links are checked
+    FIELDS = ["compiled_url", "source_url"]
+
+    def __repr__(self):
+        return f"<LinkStatus {self.doc_identifier} {self.field} {self.status_code}>"
+
+    def serialize(self):
+        """
+        Method to serialize the check result.
+
+        Returns
+        -------
+        dict
+            Dictionary with the checked url, 'ok', 'status_code',
+            'final_url' (the redirect target, if redirected), 'latency_ms',
+            'error' and 'time_checked'.
+        """
+        return {
+            "url": self.url,
+            "ok": self.ok,
+            "status_code": self.status_code,
+            "final_url": self.final_url,
+            "latency_ms": self.latency_ms,
+            "error": self.error,
+            "time_checked": self.time_checked,
+        }
+
+    @classmethod
+    def record(cls, results):
+        """
+        Class method that stores check results, replacing the previous ones
+        of the same documents and fields, and deletes the results of
+        documents that no longer exist. Bumps the link_status generation.
+        Does not commit.
+
+        Parameters
+        ----------
+        results : list
+            List of dicts with 'doc_identifier', 'field', 'url', 'ok',
+            'status_code', 'final_url', 'latency_ms' and 'error'.
+        """
+        if results:
+            keys = {(r["doc_identifier"], r["field"]) for r in results}
+            db.session.execute(
+                db.delete(cls).where(tuple_(cls.doc_identifier, cls.field).in_(keys))
+            )
+            db.session.execute(db.insert(cls), results)
+        db.session.execute(
+            db.delete(cls).where(
+                cls.doc_identifier.not_in(db.select(Document.doc_identifier))
+            )
+        )
+        TableGeneration.bump("link_status")
+
+    @classmethod
+    def get_for_documents(cls, doc_identifiers=None):
+        """
+        Class method that retrieves the check results of documents.
+
+        Parameters
+        ----------
+        doc_identifiers : list or None
+            doc_identifiers of the documents, None for all the documents.
+
+        Returns
+        -------
+        dict
+            Dictionary with doc_identifiers as keys and dictionaries of
+            serialized results by field as values.
+        """
+        query = db.select(cls)
+        if doc_identifiers is not None:
+            query = query.where(cls.doc_identifier.in_(doc_identifiers))
+        links = {}
+        for status in db.session.scalars(query):
+            links.setdefault(status.doc_identifier, {})[status.field] = (
+                status.serialize()
+            )
+        return links
+
+
+class TableGeneration(db.Model):
+    """
+    Change generation of a table. Every create, update and delete of a row of
+    the table bumps its generation in the same transaction, so cached or
+    conditional responses can be validated without reading the table itself.
+    """
+
+    table_name = db.Column("table_name", db.String(50), primary_key=True)
+    generation = db.Column("generation", db.Integer, nullable=False, default=0)
+    time_updated = db.Column(
+        db.DateTime(timezone=True), server_default=func.now(), onupdate=func.now()
+    )
+
+    # Tables whose generation is tracked
+    TABLES = ["document", "user", "domain", "link_status"]
+
+    def __repr__(self):
+        return f"<TableGeneration {self.table_name} {self.generation}>"
+
+    @classmethod
+    def bump(cls, table_name):
+        """
+        Class method that atomically increments the generation of a table.
+        Must be called within the transaction that writes to the table.
+
+        Parameters
+        ----------
+        table_name : str
+            Name of the table written to.
+
+        Returns
+        -------
+        int
+            New generation of the table.
+        """
+        generation = db.session.execute(
+            db.update(cls)
+            .where(cls.table_name == table_name)
+            .values(generation=cls.generation + 1, time_updated=func.now())
+            .returning(cls.generation)
+        ).scalar()
+        if generation is None:
+            db.session.add(cls(table_name=table_name, generation=1))
+            db.session.flush()
+            generation = 1
+        return generation
+
+    @classmethod
+    def get_generations(cls, table_names):
+        """
+        Class method that retrieves the generations of the given tables.
+
+        Parameters
+        ----------
+        table_names : list
+            Names of the tables.
+
+        Returns
+        -------
+        dict
+            Dictionary with the table names as keys and (generation,
+            time_updated) tuples as values. Tables that were never written to
+            have generation 0 and time_updated None.
+        """
+        rows = db.session.execute(
+            db.select(cls.table_name, cls.generation, cls.time_updated).where(
+                cls.table_name.in_(table_names)
+            )
+        ).all()
+        generations = {name: (0, None) for name in table_names}
+        generations.update({row[0]: (row[1], row[2]) for row in rows})
+        return generations
+
+
+class TaskLease(db.Model):
+    """
+    Lease of a periodic task, claimed by one worker process at a time so that
+    the task runs once per period whatever the number of processes.
+    """
+
+    task_name = db.Column("task_name", db.String(50), primary_key=True)
+    worker = db.Column("worker", db.String(100), default="")
+    lease_until = db.Column(db.DateTime(timezone=True), nullable=True)
+
+    # Periodic tasks, seeded by the migrations
+    TASKS = ["link_check"]
+
+    def __repr__(self):
+        return f"<TaskLease {self.task_name} {self.worker}>"
+
+    @classmethod
+    @serialized_write
+    def claim(cls, task_name, worker, seconds):
+        """
+        Class method that atomically leases a task to a worker, if its
+        previous lease expired.
+
+        Parameters
+        ----------
+        task_name : str
+            Name of the task, one of TASKS.
+        worker : str
+            Identifier of the claiming worker.
+        seconds : float
+            Duration of the lease.
+
+        Returns
+        -------
+        bool
+            True if the task was leased, False otherwise.
+        """
+        now = datetime.datetime.now(datetime.timezone.utc)
+        result = db.session.execute(
+            db.update(cls)
+            .where(
+                cls.task_name == task_name,
+                db.or_(cls.lease_until.is_(None), cls.lease_until < now),
+            )
+            .values(
+                worker=worker,
+                lease_until=now + datetime.timedelta(seconds=seconds),
+            )
+        )
+        db.session.commit()
+        return result.rowcount == 1
+
+
+class Entity(object):
+    """
+    Detached snapshot of the User or Domain an email resolves to. It holds no
+    reference to the session, so it can be cached across requests.
+    """
+
+    __slots__ = ("kind", "pk", "email", "superuser", "access")
+
+    def __init__(self, kind, pk, email, superuser=False, access=None):
+        self.kind = kind
+        self.pk = pk
+        self.email = email
+        self.superuser = superuser
+        self.access = access
+
+    def __repr__(self):
+        return f"<Entity {self.kind} {self.pk}>"
+
+    @classmethod
+    def from_user(cls, user):
+        return cls("user", user.pk, user.email, bool(user.superuser), user.access)
+
+    @classmethod
+    def from_domain(cls, domain, email):
+        return cls("domain", domain.pk, email, False, domain.access)
+
+
+def _resolve_entity(email):
+    """
+    Query the User, then the Domain table for the entity an email belongs to.
+
+    Parameters
+    ----------
+    email : str
+        Email to resolve.
+
+    Returns
+    -------
+    Entity or bool
+        Entity snapshot if the email is authorized, otherwise False.
+    """
+    if not email or "@" not in email:
+        return False
+
+    user = db.session.scalars(db.select(User).filter_by(email=email)).first()
+    if user:
         logger.info(f"get_entity: User exists for {email}\n")
-        return user
+        return Entity.from_user(user)
+
+    email_domain = email.split("@")[1]
+    domain = db.session.scalars(
+        db.select(Domain).filter_by(email_domain=email_domain)
+    ).first()
+    if domain:
+        logger.info(f"get_entity: Domain exists for {email}\n")
+        return Entity.from_domain(domain, email)
+
+    logger.info(f"get_entity: {email} not in the Users or Domains tables\n")
+    return False
+
+
+def _check_entity_generations():
+    """
+    Clear the entity cache if the user or domain table was written to since
+    the last check, e.g. by another worker process. Checked at most every
+    ENTITY_CACHE_CHECK_INTERVAL seconds, so that resolving a cached entity
+    costs no query most of the time.
+    """
+    now = time.monotonic()
+    if now - _entity_generations["checked_at"] < _entity_generations["interval"]:
+        return
+    _entity_generations["checked_at"] = now
+    generations = TableGeneration.get_generations(["user", "domain"])
+    value = (generations["user"][0], generations["domain"][0])
+    if value != _entity_generations["value"]:
+        entity_cache.clear()
+        _entity_generations["value"] = value
+
+
+def get_entity(email):
+    """
+    Return the (cached) entity an email resolves to.
+
+    Parameters
+    ----------
+    email : str
+        Email to resolve.
+
+    Returns
+    -------
+    Entity or bool
+        Entity snapshot if the email is authorized, otherwise False.
+    """
+    _check_entity_generations()
+    entity = entity_cache.get(email)
+    if entity is None:
+        entity = _resolve_entity(email)
+        entity_cache.set(email, entity)
+    return entity
 
 
 def is_superuser(entity):
-    if isinstance(entity, User):
+    if isinstance(entity, (User, Entity)):
         return entity.superuser
     if isinstance(entity, Domain):
         return False
@@ -0,0 +1,131 @@
+import base64
+import datetime
+import json
+
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("logger")
+
+
+class InvalidCursor(ValueError):
+    """Raised when a pagination cursor cannot be decoded."""
+
+
+def _encode_value(value):
+    if isinstance(value, datetime.datetime):
+        return {"dt": value.isoformat()}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        return datetime.datetime.fromisoformat(value["dt"])
+    return value
+
+
+def encode_cursor(sort, descending, key, pk):
+    """
+    Build an opaque keyset cursor pointing after the row with the given sort
+    key and primary key.
+
+    Parameters
+    ----------
+    sort : str
+        Name of the sort key the cursor was generated for.
+    descending : bool
+        Whether the listing is sorted in descending order.
+    key : str / int / datetime
+        Value of the sort key for the last row of the page.
+    pk : int
+        Primary key of the last row of the page.
+
+    Returns
+    -------
+    str
+        URL-safe cursor.
+    """
+    payload = {"s": sort, "d": descending, "k": _encode_value(key), "p": pk}
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor generated by encode_cursor.
+
+    Parameters
+    ----------
+    cursor : str
+        URL-safe cursor.
+
+    Returns
+    -------
+    tuple
+        (sort, descending, key, pk)
+
+    Raises
+    ------
+    InvalidCursor
+        Raised if the cursor is malformed.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        payload = json.loads(raw)
+        return (
+            payload["s"],
+            bool(payload["d"]),
+            _decode_value(payload["k"]),
+            int(payload["p"]),
+        )
+    except Exception as e:
+        logger.error(f"Pagination: Decoding cursor {cursor}. Error: {e}")
+        raise InvalidCursor("Invalid cursor")
+
+
+def encode_sync_token(change_seq):
+    """
+    Build an opaque sync token for the changes endpoint.
+
+    Parameters
+    ----------
+    change_seq : int
+        Change sequence the client is up to date with.
+
+    Returns
+    -------
+    str
+        URL-safe sync token.
+    """
+    raw = json.dumps({"q": change_seq}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_sync_token(token):
+    """
+    Decode a sync token generated by encode_sync_token.
+
+    Parameters
+    ----------
+    token : str
+        URL-safe sync token.
+
+    Returns
+    -------
+    int
+        Change sequence the client is up to date with.
+
+    Raises
+    ------
+    InvalidCursor
+        Raised if the token is malformed.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        change_seq = int(json.loads(raw)["q"])
+    except Exception as e:
+        logger.error(f"Pagination: Decoding sync token {token}. Error: {e}")
+        raise InvalidCursor("Invalid sync token")
+    if change_seq < 0:
+        raise InvalidCursor("Invalid sync token")
+    return change_seq
@@ -0,0 +1,178 @@
+import functools
+import re
+import threading
+import time
+
+from flask import has_request_context, request
+from sqlalchemy import event
+
+import metrics
+
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("logger")
+
+# Fingerprint under which statements are counted once MAX_FINGERPRINTS is reached
+OTHER = "<other>"
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b")
+_PLACEHOLDER = re.compile(r"%s|%\(\w+\)s|\$\d+|(?<!:):\w+|\?")
+_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_VALUES = re.compile(r"(VALUES\s*\(\.\.\.\))(?:\s*,\s*\(\.\.\.\))+", re.IGNORECASE)
+_SPACE = re.compile(r"\s+")
+
+
+@functools.lru_cache(maxsize=1024)
+def fingerprint(statement):
+    """
+    Normalize a SQL statement, so that statements only differing by their
+    literal values, placeholder style, number of IN list items or number of
+    VALUES rows share the same fingerprint.
+
+    Parameters
+    ----------
+    statement : str
+        SQL statement, as sent to the database driver.
+
+    Returns
+    -------
+    str
+        Normalized statement.
+    """
+    normalized = _STRING.sub("?", statement)
+    normalized = _PLACEHOLDER.sub("?", normalized)
+    normalized = _NUMBER.sub("?", normalized)
+    normalized = _LIST.sub("(...)", normalized)
+    normalized = _VALUES.sub(r"\1", normalized)
+    return _SPACE.sub(" ", normalized).strip()
+
+
+class QueryStats(object):
+    """Thread-safe call counts and timings of statements, by fingerprint."""
+
+    def __init__(self, max_fingerprints=1000):
+        """
+        Parameters
+        ----------
+        max_fingerprints : int
+            Maximum number of fingerprints tracked. Statements with new
+            fingerprints past that limit are counted under OTHER.
+        """
+        self.max_fingerprints = max_fingerprints
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, key, elapsed):
+        """
+        Record one execution of a statement.
+
+        Parameters
+        ----------
+        key : str
+            Fingerprint of the statement.
+        elapsed : float
+            Execution time in seconds.
+        """
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                if len(self._stats) >= self.max_fingerprints:
+                    key = OTHER
+                stats = self._stats.setdefault(key, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += elapsed
+            stats[2] = max(stats[2], elapsed)
+
+    def top(self, limit=20, sort="total"):
+        """
+        Return the fingerprints with the largest total, maximum or mean time,
+        or the most calls.
+
+        Parameters
+        ----------
+        limit : int
+            Number of fingerprints returned.
+        sort : str
+            One of 'total', 'max', 'mean' or 'calls'.
+
+        Returns
+        -------
+        list
+            List of dicts with the fingerprint, its number of calls, and its
+            total, mean and maximum times in milliseconds.
+        """
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._stats.items()]
+        rows = [
+            {
+                "fingerprint": key,
+                "calls": calls,
+                "total_ms": round(1000 * total, 3),
+                "mean_ms": round(1000 * total / calls, 3),
+                "max_ms": round(1000 * longest, 3),
+            }
+            for key, (calls, total, longest) in items
+        ]
+        sort_key = "calls" if sort == "calls" else f"{sort}_ms"
+        rows.sort(key=lambda row: row[sort_key], reverse=True)
+        return rows[:limit]
+
+    def clear(self):
+        """Forget all the recorded statements."""
+        with self._lock:
+            self._stats.clear()
+
+
+query_stats = QueryStats()
+
+# Slow query threshold in seconds, set by init_app
+_threshold = 0.2
+
+
+def _origin():
+    if has_request_context():
+        return f"view {metrics.view_name()}.{request.method}"
+    return f"thread {threading.current_thread().name}"
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info["query_log_start"] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info.pop("query_log_start", None)
+    if start is None:
+        return
+    elapsed = time.perf_counter() - start
+    key = fingerprint(statement)
+    query_stats.record(key, elapsed)
+    if elapsed >= _threshold:
+        logger.warning(
+            f"QueryLog: Slow query ({1000 * elapsed:.1f} ms) from {_origin()}: {key}"
+        )
+
+
+def init_app(app, engine):
+    """
+    Record the timings of the engine's statements by fingerprint, and log
+    the statements slower than SLOW_QUERY_THRESHOLD_MS.
+
+    Parameters
+    ----------
+    app : Flask
+        Flask app whose config holds the SLOW_QUERY_* settings.
+    engine : sqlalchemy.engine.Engine
+        Engine of the app.
+    """
+    global _threshold
+
+    _threshold = app.config.setdefault("SLOW_QUERY_THRESHOLD_MS", 200) / 1000
+    query_stats.max_fingerprints = app.config.setdefault(
+        "SLOW_QUERY_MAX_FINGERPRINTS", 1000
+    )
+
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
@@ -0,0 +1,358 @@
+import hashlib
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+
+from flask import current_app, request
+
+import serialization
+from models import TableGeneration
+
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("logger")
+
+# last_used is only rewritten when older than this, so that hits rarely write
+TOUCH_INTERVAL = 1.0
+
+
+class ResponseCache(object):
+    """
+    Response bodies stored in a SQLite file, so that they are shared by the
+    worker processes of the app, bounded by their total size in bytes and
+    evicted least recently used first.
+
+    Keys contain the generations of the tables the responses are built
+    from, so entries are never invalidated: entries of outdated tables are
+    never hit again and are evicted as the cache fills up.
+    """
+
+    def __init__(self, path=None, max_bytes=64 * 1024 * 1024, clock=time.time):
+        """
+        Parameters
+        ----------
+        path : str or None
+            Path of the SQLite file, created if needed. None disables the
+            cache.
+        max_bytes : int
+            Maximum total size of the stored bodies. 0 disables the cache.
+        clock : callable
+            Function returning the current time in seconds since the epoch.
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self._clock = clock
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.errors = 0
+
+    @property
+    def enabled(self):
+        return bool(self.path) and self.max_bytes > 0
+
+    def _connection(self):
+        # sqlite3 connections cannot be shared by threads, one per thread
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.path != self.path:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS response_cache ("
+                "key TEXT PRIMARY KEY, body BLOB NOT NULL, mimetype TEXT NOT NULL, "
+                "flag_offset INTEGER, flag_length INTEGER, "
+                "size INTEGER NOT NULL, last_used REAL NOT NULL)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS ix_response_cache_last_used "
+                "ON response_cache (last_used)"
+            )
+            self._local.connection = connection
+            self._local.path = self.path
+        return connection
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def get(self, key):
+        """
+        Return the entry stored for key and mark it as recently used.
+
+        Parameters
+        ----------
+        key : str
+            Key of the entry.
+
+        Returns
+        -------
+        tuple or None
+            (body, mimetype, flag_offset, flag_length), see set, or None if
+            the key is missing or the cache cannot be read.
+        """
+        if not self.enabled:
+            return None
+        try:
+            connection = self._connection()
+            row = connection.execute(
+                "SELECT body, mimetype, flag_offset, flag_length, last_used "
+                "FROM response_cache WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is None:
+                self._count("misses")
+                return None
+            now = self._clock()
+            if now - row[4] > TOUCH_INTERVAL:
+                connection.execute(
+                    "UPDATE response_cache SET last_used = ? WHERE key = ?",
+                    (now, key),
+                )
+        except sqlite3.Error as e:
+            self._count("errors")
+            logger.error(f"ResponseCache: Reading entry. Error: {e}")
+            return None
+        self._count("hits")
+        return row[0], row[1], row[2], row[3]
+
+    def set(self, key, body, mimetype, flag_offset=None, flag_length=None):
+        """
+        Store an entry, evicting the least recently used entries if the
+        cache grows past max_bytes. Bodies larger than max_bytes are not
+        stored.
+
+        Parameters
+        ----------
+        key : str
+            Key of the entry.
+        body : bytes
+            Encoded response body.
+        mimetype : str
+            Mimetype of the body.
+        flag_offset : int or None
+            Offset in body of the encoded placeholder of the superuser flag,
+            None if the body has none.
+        flag_length : int or None
+            Length of the encoded placeholder.
+        """
+        if not self.enabled or len(body) > self.max_bytes:
+            return
+        try:
+            connection = self._connection()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                connection.execute(
+                    "INSERT OR REPLACE INTO response_cache "
+                    "(key, body, mimetype, flag_offset, flag_length, size, last_used) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        key,
+                        body,
+                        mimetype,
+                        flag_offset,
+                        flag_length,
+                        len(body),
+                        self._clock(),
+                    ),
+                )
+                evicted = self._evict(connection)
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            self._count("errors")
+            logger.error(f"ResponseCache: Storing entry. Error: {e}")
+            return
+        if evicted:
+            with self._lock:
+                self.evictions += evicted
+
+    def _evict(self, connection):
+        total = connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM response_cache"
+        ).fetchone()[0]
+        excess = total - self.max_bytes
+        if excess <= 0:
+            return 0
+        keys = []
+        for key, size in connection.execute(
+            "SELECT key, size FROM response_cache ORDER BY last_used ASC"
+        ):
+            keys.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        connection.executemany("DELETE FROM response_cache WHERE key = ?", keys)
+        return len(keys)
+
+    def clear(self):
+        """Remove all entries from the cache."""
+        if not self.enabled:
+            return
+        try:
+            self._connection().execute("DELETE FROM response_cache")
+        except sqlite3.Error as e:
+            logger.error(f"ResponseCache: Clearing entries. Error: {e}")
+
+    def stats(self):
+        """
+        Return the cache counters, those of this process.
+
+        Returns
+        -------
+        dict
+            Dictionary with the hit, miss, eviction and error counters, as
+            well as the number of entries, their total size in bytes and the
+            maximum size of the cache.
+        """
+        size, size_bytes = 0, 0
+        if self.enabled:
+            try:
+                size, size_bytes = self._connection().execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM response_cache"
+                ).fetchone()
+            except sqlite3.Error as e:
+                logger.error(f"ResponseCache: Reading stats. Error: {e}")
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "errors": self.errors,
+                "size": size,
+                "size_bytes": size_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+# Configured by init_app
+response_cache = ResponseCache()
+
+
+def request_key(table_names, view_args):
+    """
+    Return the cache key of the current request's response: its view, view
+    arguments and query parameters, the negotiated representation, the
+    database and the generations of the tables the response is built from.
+    The requesting user is not part of it.
+
+    Parameters
+    ----------
+    table_names : iterable
+        Names of the tables the response is built from.
+    view_args : dict
+        Arguments of the view.
+
+    Returns
+    -------
+    str
+        The key.
+    """
+    generations = TableGeneration.get_generations(list(table_names))
+    variant = "|".join(
+        [
+            request.endpoint,
+            repr(sorted(view_args.items())),
+            repr(sorted(request.args.items(multi=True))),
+            serialization.negotiated_format(),
+            current_app.config["SQLALCHEMY_DATABASE_URI"],
+            repr(
+                [
+                    (name, generation, str(time_updated))
+                    for name, (generation, time_updated) in generations.items()
+                ]
+            ),
+        ]
+    )
+    return hashlib.sha1(variant.encode()).hexdigest()
+
+
+def _encode_value(value, format):
+    if format == "msgpack":
+        return serialization.msgpack.packb(value)
+    return json.dumps(value).encode()
+
+
+def encode_entry(obj, flag="superuser"):
+    """
+    Encode a response object whose flag key depends on the requesting user,
+    with a placeholder as the value of the flag so that the body can be
+    shared by all users, see apply_flag.
+
+    Parameters
+    ----------
+    obj : dict
+        Response object.
+    flag : str
+        Key of the boolean flag, ignored if obj does not have it.
+
+    Returns
+    -------
+    tuple
+        (body, mimetype, flag_offset, flag_length), flag_offset and
+        flag_length being None if obj does not have the flag.
+    """
+    if flag not in obj:
+        return current_app.json.encode_response(obj) + (None, None)
+
+    placeholder = secrets.token_hex(16)
+    body, mimetype = current_app.json.encode_response(dict(obj, **{flag: placeholder}))
+    encoded = _encode_value(placeholder, serialization.negotiated_format())
+    return body, mimetype, body.index(encoded), len(encoded)
+
+
+def apply_flag(body, flag_offset, flag_length, value):
+    """
+    Replace the placeholder of an entry encoded by encode_entry with the
+    encoded value of the flag.
+
+    Parameters
+    ----------
+    body : bytes
+        Body with the placeholder.
+    flag_offset : int or None
+        Offset of the placeholder, None if the body has none.
+    flag_length : int or None
+        Length of the placeholder.
+    value : bool
+        Value of the flag.
+
+    Returns
+    -------
+    bytes
+        The body.
+    """
+    if flag_offset is None:
+        return body
+    encoded = _encode_value(bool(value), serialization.negotiated_format())
+    return body[:flag_offset] + encoded + body[flag_offset + flag_length :]
+
+
+def init_app(app):
+    """
+    Configure the response cache with the RESPONSE_CACHE_PATH (default
+    response_cache.db in the instance folder, empty to disable) and
+    RESPONSE_CACHE_MAX_BYTES settings of the app config. The file is only
+    opened by the first request that uses the cache.
+
+    Parameters
+    ----------
+    app : Flask
+        Flask app whose config holds the RESPONSE_CACHE_* settings.
+    """
+    path = app.config.setdefault(
+        "RESPONSE_CACHE_PATH", os.path.join(app.instance_path, "response_cache.db")
+    )
+    response_cache.max_bytes = app.config.setdefault(
+        "RESPONSE_CACHE_MAX_BYTES", 64 * 1024 * 1024
+    )
+    response_cache.path = path
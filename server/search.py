@@ -0,0 +1,252 @@
+import re
+
+from sqlalchemy import text
+
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("logger")
+
+# Document columns covered by the full-text index, in index order
+SEARCH_COLUMNS = ["title", "author", "doc_code", "doc_identifier", "abstract"]
+
+# SQLite: FTS5 table keyed by the document pk (rowid), kept in sync by the
+# Document model. bm25 weights follow SEARCH_COLUMNS (title matches rank highest).
+FTS_TABLE = "document_fts"
+FTS_WEIGHTS = "10.0, 5.0, 5.0, 5.0, 1.0"
+
+# Postgres: weighted tsvector over the document row, backed by a GIN expression
+# index. Postgres maintains the index itself, so no sync is needed.
+TSVECTOR_SQL = (
+    "setweight(to_tsvector('simple', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(author, '')), 'B') || "
+    "setweight(to_tsvector('simple', coalesce(doc_code, '')), 'B') || "
+    "setweight(to_tsvector('simple', coalesce(doc_identifier, '')), 'B') || "
+    "setweight(to_tsvector('simple', coalesce(abstract, '')), 'D')"
+)
+
+# Whether the FTS5 table exists, per database URL
+_fts_enabled = {}
+
+
+def _dialect(bind):
+    return bind.dialect.name
+
+
+def _has_fts_table(connection):
+    url = str(connection.engine.url)
+    if url not in _fts_enabled:
+        exists = connection.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+            {"name": FTS_TABLE},
+        ).first()
+        _fts_enabled[url] = exists is not None
+    return _fts_enabled[url]
+
+
+def create_index(connection):
+    """
+    Create and fill the full-text index over the document metadata.
+
+    Parameters
+    ----------
+    connection : sqlalchemy.engine.Connection
+        Open connection to the database.
+    """
+    dialect = _dialect(connection)
+    if dialect == "sqlite":
+        try:
+            connection.execute(
+                text(
+                    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+                    f"{', '.join(SEARCH_COLUMNS)}, "
+                    "tokenize = 'unicode61 remove_diacritics 2')"
+                )
+            )
+        except Exception as e:
+            logger.error(
+                f"Search: FTS5 not available, falling back to LIKE queries. Error: {e}"
+            )
+            return
+        columns = ", ".join(SEARCH_COLUMNS)
+        sources = ", ".join(f"coalesce({c}, '')" for c in SEARCH_COLUMNS)
+        connection.execute(text(f"DELETE FROM {FTS_TABLE}"))
+        connection.execute(
+            text(
+                f"INSERT INTO {FTS_TABLE} (rowid, {columns}) "
+                f"SELECT pk, {sources} FROM document"
+            )
+        )
+        _fts_enabled.pop(str(connection.engine.url), None)
+    elif dialect == "postgresql":
+        connection.execute(
+            text(
+                "CREATE INDEX IF NOT EXISTS ix_document_search "
+                f"ON document USING GIN (({TSVECTOR_SQL}))"
+            )
+        )
+    else:
+        logger.info(f"Search: No full-text index for dialect {dialect}.")
+
+
+def index_documents(session, documents):
+    """
+    Add or refresh documents in the full-text index. Must be called within
+    the transaction that writes the documents, after they have been flushed.
+
+    Parameters
+    ----------
+    session : sqlalchemy.orm.Session
+        Session writing the documents.
+    documents : list
+        List of Document objects.
+    """
+    index_rows(
+        session,
+        [
+            dict({c: getattr(d, c) for c in SEARCH_COLUMNS}, pk=d.pk)
+            for d in documents
+        ],
+    )
+
+
+def index_rows(session, rows):
+    """
+    Add or refresh documents in the full-text index from plain rows, e.g.
+    those of a bulk insert.
+
+    Parameters
+    ----------
+    session : sqlalchemy.orm.Session
+        Session writing the documents.
+    rows : list
+        List of dicts with the document's 'pk' and SEARCH_COLUMNS values.
+    """
+    connection = session.connection()
+    if _dialect(connection) != "sqlite" or not _has_fts_table(connection):
+        return
+    if not rows:
+        return
+
+    remove_documents(session, [row["pk"] for row in rows])
+    columns = ", ".join(SEARCH_COLUMNS)
+    values = ", ".join(f":{c}" for c in SEARCH_COLUMNS)
+    connection.execute(
+        text(f"INSERT INTO {FTS_TABLE} (rowid, {columns}) VALUES (:pk, {values})"),
+        [
+            dict({c: row.get(c) or "" for c in SEARCH_COLUMNS}, pk=row["pk"])
+            for row in rows
+        ],
+    )
+
+
+def remove_documents(session, pks):
+    """
+    Remove documents from the full-text index.
+
+    Parameters
+    ----------
+    session : sqlalchemy.orm.Session
+        Session deleting the documents.
+    pks : list
+        Primary keys of the documents to remove.
+    """
+    connection = session.connection()
+    if _dialect(connection) != "sqlite" or not _has_fts_table(connection):
+        return
+    if not pks:
+        return
+
+    connection.execute(
+        text(f"DELETE FROM {FTS_TABLE} WHERE rowid = :pk"), [{"pk": pk} for pk in pks]
+    )
+
+
+def _tokens(query):
+    return re.findall(r"\w+", query or "")
+
+
+def match(session, query, limit=20, offset=0):
+    """
+    Run a ranked full-text query against the index. Every word of the query
+    must match (as a prefix) one of the indexed columns.
+
+    Parameters
+    ----------
+    session : sqlalchemy.orm.Session
+        Session to query with.
+    query : str
+        Search terms as typed by the user.
+    limit : int
+        Maximum number of results.
+    offset : int
+        Number of results to skip.
+
+    Returns
+    -------
+    tuple
+        (list of (document pk, rank) tuples in rank order, total number of
+        matches)
+    """
+    tokens = _tokens(query)
+    if not tokens:
+        return [], 0
+
+    connection = session.connection()
+    dialect = _dialect(connection)
+    page = {"limit": limit, "offset": offset}
+
+    if dialect == "sqlite" and _has_fts_table(connection):
+        fts_query = " ".join(f'"{t}"*' for t in tokens)
+        rows = connection.execute(
+            text(
+                f"SELECT rowid, -bm25({FTS_TABLE}, {FTS_WEIGHTS}) AS rank "
+                f"FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :query "
+                "ORDER BY rank DESC, rowid LIMIT :limit OFFSET :offset"
+            ),
+            dict(page, query=fts_query),
+        ).all()
+        total = connection.execute(
+            text(f"SELECT count(*) FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :query"),
+            {"query": fts_query},
+        ).scalar()
+    elif dialect == "postgresql":
+        ts_query = " & ".join(f"{t}:*" for t in tokens)
+        rows = connection.execute(
+            text(
+                f"SELECT pk, ts_rank({TSVECTOR_SQL}, q) AS rank "
+                "FROM document, to_tsquery('simple', :query) q "
+                f"WHERE ({TSVECTOR_SQL}) @@ q "
+                "ORDER BY rank DESC, pk LIMIT :limit OFFSET :offset"
+            ),
+            dict(page, query=ts_query),
+        ).all()
+        total = connection.execute(
+            text(
+                "SELECT count(*) FROM document, to_tsquery('simple', :query) q "
+                f"WHERE ({TSVECTOR_SQL}) @@ q"
+            ),
+            {"query": ts_query},
+        ).scalar()
+    else:
+        # No full-text index: every token must appear in one of the columns
+        params = {}
+        clauses = []
+        for i, token in enumerate(tokens):
+            params[f"t{i}"] = f"%{token}%"
+            clauses.append(
+                "(" + " OR ".join(f"{c} LIKE :t{i}" for c in SEARCH_COLUMNS) + ")"
+            )
+        where = " AND ".join(clauses)
+        rows = connection.execute(
+            text(
+                f"SELECT pk, 0 AS rank FROM document WHERE {where} "
+                "ORDER BY pk LIMIT :limit OFFSET :offset"
+            ),
+            dict(params, **page),
+        ).all()
+        total = connection.execute(
+            text(f"SELECT count(*) FROM document WHERE {where}"), params
+        ).scalar()
+
+    return [(row[0], float(row[1])) for row in rows], total
@@ -0,0 +1,237 @@
+import datetime
+
+from flask import current_app, has_request_context, request
+from flask.json.provider import DefaultJSONProvider
+
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("logger")
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, the stdlib json encoder is the fallback
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # msgpack is optional, responses are then always json
+    msgpack = None
+
+JSON_MIMETYPE = "application/json"
+
+# Accepted MessagePack mimetypes, the first one is used for responses
+MSGPACK_MIMETYPES = ["application/msgpack", "application/x-msgpack"]
+
+# Datetime formats of json responses: 'http' is Flask's default (RFC 822),
+# 'iso' is ISO 8601 in UTC
+DATETIME_FORMATS = ["http", "iso"]
+
+
+def negotiated_format():
+    """
+    Return the representation of the current request's response: 'msgpack'
+    if the client prefers one of MSGPACK_MIMETYPES over json and MessagePack
+    is available, 'json' otherwise.
+
+    Returns
+    -------
+    str
+        'json' or 'msgpack'.
+    """
+    if (
+        msgpack is None
+        or not has_request_context()
+        or not current_app.config.get("MSGPACK_ENABLED", True)
+    ):
+        return "json"
+    best = request.accept_mimetypes.best_match([JSON_MIMETYPE] + MSGPACK_MIMETYPES)
+    return "msgpack" if best in MSGPACK_MIMETYPES else "json"
+
+
+_WEEKDAYS = "Mon Tue Wed Thu Fri Sat Sun".split()
+_MONTHS = "Jan Feb Mar Apr May Jun Jul Aug Sep Oct Nov Dec".split()
+
+
+def _http_default(o):
+    # Same output as werkzeug.http.http_date, which Flask uses, several
+    # times faster
+    if isinstance(o, datetime.datetime):
+        if o.tzinfo is not None:
+            o = o.astimezone(datetime.timezone.utc)
+        return (
+            f"{_WEEKDAYS[o.weekday()]}, {o.day:02d} {_MONTHS[o.month - 1]} "
+            f"{o.year:04d} {o.hour:02d}:{o.minute:02d}:{o.second:02d} GMT"
+        )
+    return DefaultJSONProvider.default(o)
+
+
+def _iso_default(o):
+    if isinstance(o, datetime.datetime):
+        # Naive datetimes from SQLite are UTC
+        if o.tzinfo is None:
+            o = o.replace(tzinfo=datetime.timezone.utc)
+        return o.isoformat()
+    if isinstance(o, datetime.date):
+        return o.isoformat()
+    return DefaultJSONProvider.default(o)
+
+
+def _msgpack_default(o):
+    if isinstance(o, datetime.datetime):
+        if o.tzinfo is None:
+            o = o.replace(tzinfo=datetime.timezone.utc)
+        return msgpack.Timestamp.from_datetime(o)
+    return DefaultJSONProvider.default(o)
+
+
+class JSONProvider(DefaultJSONProvider):
+    """
+    JSON provider encoding with orjson when it is installed, and answering
+    clients that accept MessagePack with MessagePack.
+
+    Datetimes are encoded in JSON_DATETIME_FORMAT: 'http' (default, as
+    Flask does) or 'iso'. In MessagePack they are native timestamps.
+    Encoding options the orjson path does not support fall back to the
+    stdlib encoder.
+    """
+
+    def __init__(self, app):
+        super().__init__(app)
+        datetime_format = app.config.get("JSON_DATETIME_FORMAT", "http")
+        if datetime_format not in DATETIME_FORMATS:
+            raise ValueError(
+                f"JSON_DATETIME_FORMAT must be one of {DATETIME_FORMATS}, "
+                f"not {datetime_format}"
+            )
+        self.default = _iso_default if datetime_format == "iso" else _http_default
+
+        if orjson is not None:
+            option = orjson.OPT_NON_STR_KEYS
+            if datetime_format == "iso":
+                option |= orjson.OPT_NAIVE_UTC | orjson.OPT_UTC_Z
+            else:
+                # Encode datetimes with self.default, as Flask does
+                option |= orjson.OPT_PASSTHROUGH_DATETIME
+            if self.sort_keys:
+                option |= orjson.OPT_SORT_KEYS
+            self._option = option
+
+    def encode(self, obj, **kwargs):
+        """
+        Encode obj as json bytes.
+
+        Parameters
+        ----------
+        obj : object
+            Object to encode.
+        **kwargs
+            Options of json.dumps. Passing any uses the stdlib encoder.
+
+        Returns
+        -------
+        bytes
+            Encoded json.
+        """
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs).encode()
+        return orjson.dumps(obj, default=self.default, option=self._option)
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=self._option).decode()
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def encode_msgpack(self, obj):
+        """
+        Encode obj as MessagePack.
+
+        Parameters
+        ----------
+        obj : object
+            Object to encode.
+
+        Returns
+        -------
+        bytes
+            Encoded MessagePack.
+        """
+        return msgpack.packb(obj, default=_msgpack_default)
+
+    def encode_response(self, obj):
+        """
+        Encode obj as the body of a response, as json or as MessagePack if
+        the client prefers it, see negotiated_format.
+
+        Parameters
+        ----------
+        obj : object
+            Object to encode.
+
+        Returns
+        -------
+        tuple
+            (body bytes, mimetype)
+        """
+        if negotiated_format() == "msgpack":
+            return self.encode_msgpack(obj), MSGPACK_MIMETYPES[0]
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            # Pretty-printed in debug mode, as Flask does
+            return f"{self.dumps(obj, indent=2)}\n".encode(), self.mimetype
+        if orjson is None:
+            body = self.dumps(obj, separators=(",", ":"))
+            return f"{body}\n".encode(), self.mimetype
+        return self.encode(obj) + b"\n", self.mimetype
+
+    def body_response(self, body, mimetype):
+        """
+        Return a response object with a body encoded by encode_response.
+
+        Parameters
+        ----------
+        body : bytes
+            Encoded body.
+        mimetype : str
+            Mimetype of the body.
+
+        Returns
+        -------
+        flask.Response
+            The response.
+        """
+        response = self._app.response_class(body, mimetype=mimetype)
+        if msgpack is not None:
+            response.vary.add("Accept")
+        return response
+
+    def response(self, *args, **kwargs):
+        """
+        Serialize the given arguments as json, or as MessagePack if the
+        client prefers it, see negotiated_format, and return a response
+        object.
+        """
+        obj = self._prepare_response_obj(args, kwargs)
+        return self.body_response(*self.encode_response(obj))
+
+def init_app(app):
+    """
+    Use the orjson/MessagePack JSON provider, with the JSON_DATETIME_FORMAT
+    and MSGPACK_ENABLED settings of the app config.
+
+    Parameters
+    ----------
+    app : Flask
+        Flask app whose config holds the JSON_* and MSGPACK_* settings.
+    """
+    app.config.setdefault("JSON_DATETIME_FORMAT", "http")
+    app.config.setdefault("MSGPACK_ENABLED", True)
+    app.json = JSONProvider(app)
+    encoders = ["orjson" if orjson is not None else "json"]
+    if msgpack is not None and app.config["MSGPACK_ENABLED"]:
+        encoders.append("msgpack")
+    logger.info(f"Serialization: Enabled encoders {encoders}.")
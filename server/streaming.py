@@ -0,0 +1,80 @@
+from flask import current_app, Response, stream_with_context
+
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("logger")
+
+# Encoded bytes buffered before a chunk is sent to the client
+CHUNK_SIZE = 64 * 1024
+
+
+def iter_json_list(fields, list_key, items, chunk_size=CHUNK_SIZE):
+    """
+    Incrementally encode a json object whose list_key entry is a (possibly
+    very long) list, yielding chunks of roughly chunk_size bytes.
+
+    Parameters
+    ----------
+    fields : dict
+        Other (small) entries of the json object.
+    list_key : str
+        Key of the list entry.
+    items : iterable
+        Json-serializable items of the list. Consumed lazily.
+    chunk_size : int
+        Approximate size in bytes of the yielded chunks.
+
+    Yields
+    ------
+    bytes
+        Encoded chunk of the json object.
+    """
+    dumps = current_app.json.dumps
+
+    head = "".join(f"{dumps(k)}:{dumps(v)}," for k, v in fields.items())
+    buffer = [f"{{{head}{dumps(list_key)}:["]
+    size = len(buffer[0])
+    separator = ""
+    for item in items:
+        encoded = separator + dumps(item)
+        separator = ","
+        buffer.append(encoded)
+        size += len(encoded)
+        if size >= chunk_size:
+            yield "".join(buffer).encode()
+            buffer = []
+            size = 0
+    buffer.append("]}")
+    yield "".join(buffer).encode()
+
+
+def json_list_response(fields, list_key, items, chunk_size=CHUNK_SIZE):
+    """
+    Build a streamed json response for iter_json_list. The response has no
+    content length, so it is sent with chunked transfer encoding, and the
+    request context is kept alive until the last chunk is sent.
+
+    Parameters
+    ----------
+    fields : dict
+        Other (small) entries of the json object.
+    list_key : str
+        Key of the list entry.
+    items : iterable
+        Json-serializable items of the list. Consumed lazily.
+    chunk_size : int
+        Approximate size in bytes of the streamed chunks.
+
+    Returns
+    -------
+    flask.Response
+        Streamed response.
+    """
+    response = Response(
+        stream_with_context(iter_json_list(fields, list_key, items, chunk_size)),
+        mimetype="application/json",
+    )
+    # Ask nginx not to buffer the whole response before forwarding it
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
@@ -0,0 +1,292 @@
+"""
+Tests of the backend-specific code paths, run against each database backend,
+see conftest.py.
+"""
+
+import pytest
+from sqlalchemy import text
+
+from conftest import ADMIN_EMAIL, MEMBER_EMAIL, auth
+
+
+def _add_document(client, title, **fields):
+    response = client.post(
+        "/api/documents",
+        json=dict({"title": title, "author": "Author"}, **fields),
+        headers=auth(),
+    )
+    assert response.json["status"] == "success", response.json
+
+
+def _documents(client):
+    return {
+        d["title"]: d
+        for d in client.get("/api/documents", headers=auth()).json["documents"]
+    }
+
+
+def test_migrations_reach_latest_version(app):
+    import migrations
+    from app import db
+
+    with app.app_context():
+        with db.engine.begin() as connection:
+            version = migrations.get_version(connection)
+        assert version == migrations.MIGRATIONS[-1][0]
+        assert migrations.verify_indexes() == []
+        # Applying them again does nothing
+        assert migrations.upgrade() == version
+
+
+def test_document_lifecycle(client):
+    _add_document(client, "Coronagraph design", abstract="Vector vortex")
+    document = _documents(client)["Coronagraph design"]
+    doc_identifier = document["doc_identifier"]
+    assert document["creator_email"] == MEMBER_EMAIL
+
+    response = client.get(f"/api/documents/{doc_identifier}", headers=auth())
+    assert response.json["document"]["abstract"] == "Vector vortex"
+
+    response = client.put(
+        f"/api/documents/{doc_identifier}",
+        json={"title": "Coronagraph design v2", "author": "Author"},
+        headers=auth(),
+    )
+    assert response.json["status"] == "success", response.json
+    assert "Coronagraph design v2" in _documents(client)
+
+    # Other members cannot delete it
+    client.post(
+        "/api/users",
+        json={"email": "other@test.org", "superuser": False},
+        headers=auth(ADMIN_EMAIL),
+    )
+    response = client.delete(
+        f"/api/documents/{doc_identifier}", headers=auth("other@test.org")
+    )
+    assert response.json["status"] == "fail"
+    assert "Coronagraph design v2" in _documents(client)
+
+    response = client.delete(f"/api/documents/{doc_identifier}", headers=auth())
+    assert response.json["status"] == "success", response.json
+    assert _documents(client) == {}
+
+
+def test_doc_identifiers_are_sequential(app, client):
+    from app import db
+    from models import DocIdentifierCounter
+
+    for i in range(3):
+        _add_document(client, f"Document {i}")
+    numbers = sorted(
+        int(d["doc_identifier"].rsplit("_", 1)[1]) for d in _documents(client).values()
+    )
+    assert numbers == [numbers[0], numbers[0] + 1, numbers[0] + 2]
+
+    # INSERT ... ON CONFLICT DO UPDATE ... RETURNING
+    with app.app_context():
+        first = DocIdentifierCounter.reserve("test202401", count=5)
+        second = DocIdentifierCounter.reserve("test202401", count=2)
+        db.session.commit()
+    assert (first, second) == (1, 6)
+
+
+def test_duplicate_does_not_reserve_a_doc_identifier(app):
+    from models import Document
+
+    fields = {"author": "Author", "creator_email": MEMBER_EMAIL}
+    # In one app context, so the failed create is not rolled back at the end
+    # of a request
+    with app.app_context():
+        first = Document.create(title="Document 0", **fields)
+        assert Document.create(title="Document 0", **fields) is False
+        second = Document.create(title="Document 1", **fields)
+        numbers = [int(d.doc_identifier.rsplit("_", 1)[1]) for d in [first, second]]
+    assert numbers[1] == numbers[0] + 1
+
+
+def test_search(client):
+    _add_document(client, "Deformable mirror calibration", abstract="Actuators")
+    _add_document(client, "Telescope pointing")
+
+    response = client.get("/api/documents/search?q=mirror", headers=auth())
+    assert response.status_code == 200
+    assert [d["title"] for d in response.json["documents"]] == [
+        "Deformable mirror calibration"
+    ]
+    assert response.json["total"] == 1
+
+    # Updates are reindexed
+    doc_identifier = response.json["documents"][0]["doc_identifier"]
+    client.put(
+        f"/api/documents/{doc_identifier}",
+        json={"title": "Wavefront sensor", "author": "Author"},
+        headers=auth(),
+    )
+    response = client.get("/api/documents/search?q=mirror", headers=auth())
+    assert response.json["documents"] == []
+
+
+def test_changes_and_batch(client):
+    for i in range(3):
+        _add_document(client, f"Document {i}")
+    response = client.get("/api/documents/changes", headers=auth())
+    assert response.json["resync"] is True
+    sync_token = response.json["sync_token"]
+
+    documents = _documents(client)
+    response = client.post(
+        "/api/documents/batch",
+        json={
+            "operations": [
+                {
+                    "op": "update",
+                    "doc_identifier": documents["Document 0"]["doc_identifier"],
+                    "data": {"abstract": "Updated"},
+                },
+                {
+                    "op": "delete",
+                    "doc_identifier": documents["Document 1"]["doc_identifier"],
+                },
+            ]
+        },
+        headers=auth(),
+    )
+    assert response.json["counts"] == {"updated": 1, "deleted": 1}, response.json
+
+    response = client.get(f"/api/documents/changes?since={sync_token}", headers=auth())
+    assert response.json["resync"] is False
+    assert [d["title"] for d in response.json["documents"]] == ["Document 0"]
+    assert response.json["deleted"] == [documents["Document 1"]["doc_identifier"]]
+
+
+def test_users_and_domains(client):
+    response = client.post(
+        "/api/domains", json={"email_domain": "test.org"}, headers=auth(ADMIN_EMAIL)
+    )
+    assert response.json["status"] == "success", response.json
+    # Members of the domain are authorized without a user
+    response = client.get("/api/documents", headers=auth("someone@test.org"))
+    assert response.status_code == 200
+
+    response = client.get("/api/admins", headers=auth())
+    assert response.json["admins"] == [ADMIN_EMAIL]
+    # Only superusers see the users
+    response = client.get("/api/users", headers=auth())
+    assert response.status_code == 403
+    response = client.get("/api/users", headers=auth(ADMIN_EMAIL))
+    assert {u["email"] for u in response.json["collaborators"]} == {
+        ADMIN_EMAIL,
+        MEMBER_EMAIL,
+    }
+
+
+def test_statement_timeout(app, backend):
+    from app import db
+
+    if backend[0] != "postgres":
+        pytest.skip("Postgres only")
+    with app.app_context():
+        timeout = db.session.execute(text("SHOW statement_timeout")).scalar()
+    assert timeout == "30s"
+
+
+def test_conditional_not_modified(client):
+    _add_document(client, "Document 0")
+    response = client.get("/api/documents", headers=auth())
+    etag = response.headers["ETag"]
+
+    response = client.get(
+        "/api/documents", headers=dict(auth(), **{"If-None-Match": etag})
+    )
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert response.get_data() == b""
+
+    # A write changes the document table's generation
+    _add_document(client, "Document 1")
+    response = client.get(
+        "/api/documents", headers=dict(auth(), **{"If-None-Match": etag})
+    )
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert "Document 1" in {d["title"] for d in response.json["documents"]}
+
+
+def test_conditional_etag_variants(client):
+    pytest.importorskip("msgpack")
+    _add_document(client, "Document 0")
+
+    member = client.get("/api/documents", headers=auth())
+    admin = client.get("/api/documents", headers=auth(ADMIN_EMAIL))
+    msgpack = client.get(
+        "/api/documents", headers=dict(auth(), Accept="application/msgpack")
+    )
+    assert member.json["superuser"] is False
+    assert admin.json["superuser"] is True
+    assert msgpack.mimetype == "application/msgpack"
+    etags = {r.headers["ETag"] for r in [member, admin, msgpack]}
+    assert len(etags) == 3
+
+    # The member's ETag does not revalidate the other representations
+    for headers in [auth(ADMIN_EMAIL), dict(auth(), Accept="application/msgpack")]:
+        headers["If-None-Match"] = member.headers["ETag"]
+        assert client.get("/api/documents", headers=headers).status_code == 200
+
+
+def test_revoked_superuser(app, client, monkeypatch):
+    import models
+    from app import db
+    from models import TableGeneration, User
+
+    client.post(
+        "/api/users",
+        json={"email": "chief@test.org", "superuser": True},
+        headers=auth(ADMIN_EMAIL),
+    )
+    users = client.get("/api/users", headers=auth("chief@test.org")).json
+    pk = {u["email"]: u["pk"] for u in users["collaborators"]}["chief@test.org"]
+
+    response = client.put(
+        f"/api/users/{pk}", json={"superuser": False}, headers=auth(ADMIN_EMAIL)
+    )
+    assert response.json["status"] == "success", response.json
+    assert client.get("/api/users", headers=auth("chief@test.org")).status_code == 403
+
+    # Revoked by another worker process: this process's cache is only
+    # invalidated through the user table's generation
+    monkeypatch.setitem(models._entity_generations, "interval", 0)
+    assert client.get("/api/users", headers=auth(ADMIN_EMAIL)).status_code == 200
+    with app.app_context():
+        db.session.execute(
+            db.update(User).where(User.email == ADMIN_EMAIL).values(superuser=False)
+        )
+        TableGeneration.bump("user")
+        db.session.commit()
+    assert client.get("/api/users", headers=auth(ADMIN_EMAIL)).status_code == 403
+
+
+def test_etags_of_different_databases(app, client, tmp_path):
+    from app import create_app, db
+    from models import User
+
+    other = create_app(
+        dict(
+            app.config,
+            DATABASE_BACKEND="sqlite",
+            SQLALCHEMY_DATABASE_URI=f"sqlite:///{tmp_path / 'other.db'}",
+        )
+    )
+    # Same users, so the user table is at the same generation
+    with other.app_context():
+        User.create(email=ADMIN_EMAIL, superuser=True)
+        User.create(email=MEMBER_EMAIL, superuser=False)
+
+    response = client.get("/api/admins", headers=auth())
+    other_response = other.test_client().get("/api/admins", headers=auth())
+    assert other_response.json == response.json
+    assert other_response.headers["ETag"] != response.headers["ETag"]
+
+    with other.app_context():
+        db.session.remove()
+        db.engine.dispose()
@@ -0,0 +1,100 @@
+"""Tests of the content-encoding negotiation, see compression.compress_response."""
+
+import gzip
+import json
+
+import pytest
+
+from conftest import auth
+
+
+@pytest.fixture
+def documents(client):
+    # Enough documents for the list to be over COMPRESSION_MIN_SIZE
+    for i in range(20):
+        response = client.post(
+            "/api/documents",
+            json={"title": f"Document {i}", "author": "Author", "abstract": "Optics"},
+            headers=auth(),
+        )
+        assert response.json["status"] == "success", response.json
+
+
+def _decompress(response):
+    data = response.get_data()
+    encoding = response.headers.get("Content-Encoding")
+    if encoding == "br":
+        import brotli
+
+        return brotli.decompress(data)
+    if encoding == "gzip":
+        return gzip.decompress(data)
+    return data
+
+
+def _get(client, path="/api/documents", accept_encoding="gzip", **headers):
+    headers = dict(auth(), **{"Accept-Encoding": accept_encoding}, **headers)
+    return client.get(path, headers=headers)
+
+
+@pytest.mark.parametrize(
+    "accept_encoding, encoding",
+    [("gzip, br", "br"), ("br;q=0.5, gzip", "gzip"), ("gzip", "gzip"), ("", None)],
+)
+def test_negotiation(client, documents, accept_encoding, encoding):
+    if encoding == "br":
+        pytest.importorskip("brotli")
+    identity = _get(client, accept_encoding="identity")
+    response = _get(client, accept_encoding=accept_encoding)
+
+    assert response.headers.get("Content-Encoding") == encoding
+    assert "Accept-Encoding" in response.headers["Vary"]
+    assert json.loads(_decompress(response)) == identity.json
+    if encoding:
+        etag = identity.headers["ETag"].strip('"')
+        assert response.headers["ETag"] == f'"{etag}-{encoding}"'
+        assert response.content_length == len(response.get_data())
+
+
+def test_small_bodies_are_not_compressed(client):
+    response = _get(client, "/api/admins")
+    assert "Content-Encoding" not in response.headers
+    assert "Accept-Encoding" in response.headers["Vary"]
+
+
+def test_streamed_response(client, documents):
+    identity = _get(client, accept_encoding="identity")
+    response = _get(client, "/api/documents?stream=true")
+
+    assert response.is_streamed
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Content-Length" not in response.headers
+    assert {"Accept", "Accept-Encoding"} <= set(response.vary)
+    assert json.loads(_decompress(response))["documents"] == identity.json["documents"]
+
+
+def test_compressed_cache(client, documents):
+    from compression import compressed_cache
+
+    first = _get(client)
+    hits = compressed_cache.stats()["hits"]
+    second = _get(client)
+    assert compressed_cache.stats()["hits"] == hits + 1
+    assert second.get_data() == first.get_data()
+    assert second.headers["ETag"] == first.headers["ETag"]
+
+    # Revalidated with the ETag of the compressed representation
+    response = _get(client, **{"If-None-Match": first.headers["ETag"]})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == first.headers["ETag"]
+
+    # A write changes the ETag, so the cached body is not served again
+    client.post(
+        "/api/documents",
+        json={"title": "New document", "author": "Author"},
+        headers=auth(),
+    )
+    response = _get(client)
+    assert response.headers["ETag"] != first.headers["ETag"]
+    documents = json.loads(_decompress(response))["documents"]
+    assert "New document" in {d["title"] for d in documents}
@@ -0,0 +1,237 @@
+"""Tests of the link checker against local HTTP stand-in servers."""
+
+import collections
+import datetime
+import http.server
+import threading
+import time
+
+import pytest
+
+from conftest import auth
+from linkcheck import LinkChecker, check_documents
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Routes:
+    - /ok: 200
+    - /no-head: 405 to HEAD, 200 to GET
+    - /dir/redirect: 302 to the relative 'target', i.e. /dir/target
+    - /flaky/<status>: <status> to the first two requests, 200 afterwards
+    - /error/<status>: always <status>
+    - /slow/<seconds>: 200 after sleeping
+    - /huge-header: 200 with a 64 KiB header
+    - /many-headers: 200 with 1000 headers
+    """
+
+    def log_message(self, *args):
+        pass
+
+    def _respond(self, status, headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def _handle(self):
+        path = self.path.split("?")[0]
+        with self.server.lock:
+            self.server.hits[path] += 1
+            hits = self.server.hits[path]
+
+        if path == "/no-head" and self.command == "HEAD":
+            self._respond(405)
+        elif path == "/dir/redirect":
+            self._respond(302, {"Location": "target"})
+        elif path.startswith("/flaky/"):
+            self._respond(int(path.split("/")[2]) if hits <= 2 else 200)
+        elif path.startswith("/error/"):
+            self._respond(int(path.split("/")[2]))
+        elif path == "/huge-header":
+            self._respond(200, {"X-Huge": "x" * 65536})
+        elif path == "/many-headers":
+            self._respond(200, {f"X-Header-{i}": "x" for i in range(1000)})
+        elif path.startswith("/slow/"):
+            time.sleep(float(path.split("/")[2]))
+            self._respond(200)
+        else:
+            self._respond(200 if path in ["/ok", "/no-head", "/dir/target"] else 404)
+
+    do_HEAD = _handle
+    do_GET = _handle
+
+
+def _serve(host):
+    server = http.server.ThreadingHTTPServer((host, 0), StandInHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.hits = collections.Counter()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+@pytest.fixture
+def stand_in():
+    server = _serve("127.0.0.1")
+    server.base = f"http://127.0.0.1:{server.server_address[1]}"
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def other_stand_in():
+    # Another loopback address, so a different host for the checker
+    try:
+        server = _serve("127.0.0.2")
+    except OSError:
+        pytest.skip("127.0.0.2 is not available")
+    server.base = f"http://127.0.0.2:{server.server_address[1]}"
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _checker(**kwargs):
+    return LinkChecker(**dict({"timeout": 2, "backoff": 0.01}, **kwargs))
+
+
+def test_ok(stand_in):
+    result = _checker().run([f"{stand_in.base}/ok"])[f"{stand_in.base}/ok"]
+    assert result["ok"] is True
+    assert result["status_code"] == 200
+    assert result["final_url"] is None
+    assert result["error"] is None
+    assert stand_in.hits == {"/ok": 1}
+
+
+def test_head_then_get(stand_in):
+    url = f"{stand_in.base}/no-head"
+    result = _checker().run([url])[url]
+    assert result["ok"] is True
+    assert result["status_code"] == 200
+    assert stand_in.hits["/no-head"] == 2
+
+
+def test_relative_redirect(stand_in):
+    url = f"{stand_in.base}/dir/redirect"
+    result = _checker().run([url])[url]
+    assert result["ok"] is True
+    assert result["final_url"] == f"{stand_in.base}/dir/target"
+
+
+@pytest.mark.parametrize("status", [429, 500, 503])
+def test_retry(stand_in, status):
+    url = f"{stand_in.base}/flaky/{status}"
+    result = _checker(retries=1).run([url])[url]
+    assert result["ok"] is True
+    assert result["status_code"] == 200
+
+
+def test_retries_exhausted(stand_in):
+    url = f"{stand_in.base}/error/503"
+    result = _checker(retries=2).run([url])[url]
+    assert result["ok"] is False
+    assert result["status_code"] == 503
+    # HEAD and GET for each of the 3 attempts
+    assert stand_in.hits["/error/503"] == 6
+
+
+def test_not_found_is_not_retried(stand_in):
+    url = f"{stand_in.base}/error/404"
+    result = _checker(retries=2).run([url])[url]
+    assert result["ok"] is False
+    assert result["status_code"] == 404
+    assert stand_in.hits["/error/404"] == 2
+
+
+def test_timeout(stand_in):
+    url = f"{stand_in.base}/slow/1"
+    result = _checker(timeout=0.2, retries=0).run([url])[url]
+    assert result["ok"] is False
+    assert result["status_code"] is None
+    assert result["error"] == "Timeout"
+
+
+@pytest.mark.parametrize(
+    "path, error",
+    [
+        ("/huge-header", "Response header line too long"),
+        ("/many-headers", "Too many response headers"),
+    ],
+)
+def test_header_limits(stand_in, path, error):
+    url = f"{stand_in.base}{path}"
+    result = _checker(retries=0).run([url])[url]
+    assert result["ok"] is False
+    assert result["error"] == error
+
+
+def test_invalid_urls():
+    results = _checker(retries=0).run(["ftp://example.org/doc", "http://127.0.0.1:1/"])
+    assert not any(r["ok"] for r in results.values())
+    assert all(r["error"] for r in results.values())
+
+
+def test_busy_host_does_not_block_other_hosts(stand_in, other_stand_in):
+    slow = [f"{stand_in.base}/slow/0.5?{i}" for i in range(8)]
+    idle = f"{other_stand_in.base}/ok"
+
+    start = time.perf_counter()
+    results = _checker(concurrency=3, per_host=1, timeout=5).run(slow + [idle])
+    elapsed = time.perf_counter() - start
+
+    assert all(r["ok"] for r in results.values())
+    # The idle host is checked right away, not after the slow host's queue
+    assert results[idle]["latency_ms"] < 300
+    # One request at a time on the slow host
+    assert elapsed >= 8 * 0.5
+
+
+def test_check_documents(app, client, stand_in):
+    from app import db
+    from models import Document
+
+    client.post(
+        "/api/documents",
+        json={
+            "title": "Checked",
+            "author": "Author",
+            "compiled_url": f"{stand_in.base}/ok",
+            "source_url": f"{stand_in.base}/error/404",
+        },
+        headers=auth(),
+    )
+    with app.app_context():
+        doc_identifier = db.session.scalars(db.select(Document.doc_identifier)).one()
+
+    summary = check_documents(app, checker=_checker(retries=0))
+    assert summary == {"documents": 1, "urls": 2, "broken": 1}
+
+    links = client.get(f"/api/documents/{doc_identifier}", headers=auth()).json["links"]
+    assert links["compiled_url"]["ok"] is True
+    assert links["source_url"]["ok"] is False
+    assert links["source_url"]["status_code"] == 404
+
+    response = client.get("/api/documents?links=true", headers=auth())
+    assert doc_identifier in response.json["links"]
+
+
+def test_task_lease(app):
+    from app import db
+    from models import TaskLease
+
+    with app.app_context():
+        assert TaskLease.claim("link_check", "worker-1", 60) is True
+        # Held by worker-1, whichever process asks
+        assert TaskLease.claim("link_check", "worker-2", 60) is False
+        assert TaskLease.claim("link_check", "worker-1", 60) is False
+        assert db.session.get(TaskLease, "link_check").worker == "worker-1"
+
+        now = datetime.datetime.now(datetime.timezone.utc)
+        db.session.get(TaskLease, "link_check").lease_until = now
+        db.session.commit()
+        assert TaskLease.claim("link_check", "worker-2", 60) is True
+        assert TaskLease.claim("unknown", "worker-2", 60) is False
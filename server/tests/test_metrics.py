@@ -0,0 +1,79 @@
+"""Tests of /api/metrics, see views.superuser_or_local, and of metrics.collect."""
+
+import json
+import os
+import subprocess
+import sys
+import time
+
+from conftest import ADMIN_EMAIL, MEMBER_EMAIL, auth
+
+
+def test_metrics_require_a_superuser(client):
+    assert client.get("/api/metrics").status_code == 401
+    assert client.get("/api/metrics", headers=auth(MEMBER_EMAIL)).status_code == 403
+
+    response = client.get("/api/metrics", headers=auth(ADMIN_EMAIL))
+    assert response.status_code == 200
+    assert "http_requests_total" in response.get_data(as_text=True)
+
+
+def test_metrics_local_access(app, client):
+    app.config["METRICS_ALLOW_LOCAL"] = True
+    assert client.get("/api/metrics").status_code == 200
+
+    # Requests proxied by nginx come from the loopback address too
+    response = client.get("/api/metrics", headers={"X-Real-IP": "203.0.113.7"})
+    assert response.status_code == 401
+    response = client.get(
+        "/api/metrics", headers={"X-Forwarded-For": "203.0.113.7"}
+    )
+    assert response.status_code == 401
+    response = client.get("/api/metrics", environ_base={"REMOTE_ADDR": "10.0.0.1"})
+    assert response.status_code == 401
+
+
+def _dead_pid():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def _write(directory, pid, counters, age=0):
+    path = os.path.join(directory, f"metrics_{pid}.json")
+    with open(path, "w") as f:
+        json.dump({"counters": counters, "histograms": []}, f)
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def test_snapshots_of_exited_processes(tmp_path, monkeypatch):
+    import metrics
+
+    monkeypatch.setitem(metrics.METRICS, "test_gauge", ("gauge", "Test.", None))
+    monkeypatch.setitem(metrics._settings, "flush_interval", 1)
+    directory = str(tmp_path)
+    label = [["view", "test_snapshots"]]
+    counters = [["auth_outcomes_total", label, 2], ["test_gauge", label, 5]]
+    stale = 60
+    killed = _write(directory, _dead_pid(), counters, age=stale)
+    recent = _write(directory, _dead_pid(), counters)
+    alive = _write(directory, os.getppid(), counters, age=stale)
+
+    text = metrics.collect(directory)
+    # Killed processes' counters are kept, their gauges are dropped
+    assert not os.path.exists(killed)
+    assert os.path.exists(recent) and os.path.exists(alive)
+    assert 'auth_outcomes_total{view="test_snapshots"} 6' in text
+    assert 'test_gauge{view="test_snapshots"} 10' in text
+
+    # At exit, this process's snapshot is retired too
+    monkeypatch.setitem(metrics._settings, "retired", False)
+    metrics.registry.inc("auth_outcomes_total", (("view", "test_exit"),))
+    metrics._exit(directory)
+    metrics.flush(directory)
+    assert not os.path.exists(os.path.join(directory, f"metrics_{os.getpid()}.json"))
+    text = metrics.collect(directory)
+    assert 'auth_outcomes_total{view="test_snapshots"} 6' in text
+    assert 'auth_outcomes_total{view="test_exit"} 1' in text
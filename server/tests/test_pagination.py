@@ -0,0 +1,100 @@
+"""Tests of the keyset pagination of /api/documents, see Document.get_page."""
+
+import base64
+import json
+
+import pytest
+
+from conftest import auth
+
+
+@pytest.fixture
+def documents(client):
+    # Two authors only, so sorting by author has ties
+    titles = [f"Document {i:02d}" for i in range(7)]
+    for i, title in enumerate(titles):
+        response = client.post(
+            "/api/documents",
+            json={"title": title, "author": f"Author {i % 2}"},
+            headers=auth(),
+        )
+        assert response.json["status"] == "success", response.json
+    return titles
+
+
+def _walk(client, limit, **params):
+    titles = []
+    cursors = []
+    cursor = None
+    while True:
+        query = dict(params, limit=limit)
+        if cursor:
+            query["cursor"] = cursor
+        response = client.get("/api/documents", query_string=query, headers=auth())
+        assert response.status_code == 200, response.json
+        page = [d["title"] for d in response.json["documents"]]
+        assert len(page) <= limit
+        titles.extend(page)
+        cursor = response.json["next_cursor"]
+        if cursor is None:
+            return titles, cursors
+        cursors.append(cursor)
+
+
+@pytest.mark.parametrize("order", ["asc", "desc"])
+def test_walk_all_pages(client, documents, order):
+    titles, cursors = _walk(client, 3, sort="title", order=order)
+    assert titles == sorted(documents, reverse=(order == "desc"))
+    assert len(cursors) == 2
+
+
+@pytest.mark.parametrize("order", ["asc", "desc"])
+def test_ties_are_stable(client, documents, order):
+    titles, _ = _walk(client, 2, sort="author", order=order)
+    # Every document exactly once
+    assert sorted(titles) == documents
+    authors = [f"Author {int(t[-2:]) % 2}" for t in titles]
+    assert authors == sorted(authors, reverse=(order == "desc"))
+
+    # The same walk gives the same order
+    assert _walk(client, 3, sort="author", order=order)[0] == titles
+
+
+def _encode(payload):
+    raw = json.dumps(payload).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+@pytest.mark.parametrize(
+    "cursor",
+    [
+        "not-a-cursor",
+        _encode({"s": "title"}),
+        _encode({"s": "title", "d": False, "k": "Document 01", "p": "one"}),
+        _encode({"s": "title", "d": False, "k": {"date": "01"}, "p": 1}),
+        # Generated for another sort order
+        _encode({"s": "author", "d": False, "k": "Author 0", "p": 1}),
+        _encode({"s": "title", "d": True, "k": "Document 01", "p": 1}),
+    ],
+)
+def test_invalid_cursor(client, documents, cursor):
+    response = client.get(
+        "/api/documents",
+        query_string={"limit": 3, "sort": "title", "cursor": cursor},
+        headers=auth(),
+    )
+    assert response.status_code == 400
+    assert response.json["status"] == "fail"
+
+
+def test_tampered_cursor_sort(client, documents):
+    response = client.get(
+        "/api/documents", query_string={"limit": 3, "sort": "title"}, headers=auth()
+    )
+    cursor = response.json["next_cursor"]
+    response = client.get(
+        "/api/documents",
+        query_string={"limit": 3, "sort": "author", "cursor": cursor},
+        headers=auth(),
+    )
+    assert response.status_code == 400
@@ -0,0 +1,101 @@
+"""Tests of the shared response cache of the list endpoints, see views.cached."""
+
+import pytest
+
+from conftest import ADMIN_EMAIL, MEMBER_EMAIL, auth
+
+
+def _stats():
+    from response_cache import response_cache
+
+    return response_cache.stats()
+
+
+def _titles(response):
+    return [d["title"] for d in response.json["documents"]]
+
+
+def _add_document(client, title):
+    response = client.post(
+        "/api/documents", json={"title": title, "author": "Author"}, headers=auth()
+    )
+    assert response.json["status"] == "success", response.json
+
+
+def test_writes_invalidate_entries(client):
+    _add_document(client, "Document 0")
+    assert _titles(client.get("/api/documents", headers=auth())) == ["Document 0"]
+    hits = _stats()["hits"]
+    assert _titles(client.get("/api/documents", headers=auth())) == ["Document 0"]
+    assert _stats()["hits"] == hits + 1
+
+    # The write bumps the document table's generation, so a new key
+    _add_document(client, "Document 1")
+    response = client.get("/api/documents", headers=auth())
+    assert sorted(_titles(response)) == ["Document 0", "Document 1"]
+    assert _stats()["hits"] == hits + 1
+
+    # Same for the user table
+    response = client.get("/api/users", headers=auth(ADMIN_EMAIL))
+    emails = {u["email"] for u in response.json["collaborators"]}
+    assert emails == {ADMIN_EMAIL, MEMBER_EMAIL}
+    client.post(
+        "/api/users",
+        json={"email": "other@test.org", "superuser": False},
+        headers=auth(ADMIN_EMAIL),
+    )
+    response = client.get("/api/users", headers=auth(ADMIN_EMAIL))
+    assert "other@test.org" in {u["email"] for u in response.json["collaborators"]}
+
+
+@pytest.mark.parametrize("accept", ["application/json", "application/msgpack"])
+def test_superuser_flag_is_per_request(client, accept):
+    if accept == "application/msgpack":
+        pytest.importorskip("msgpack")
+    _add_document(client, "Document 0")
+
+    # Whoever fills the entry, each user gets their own superuser flag
+    responses = []
+    for email in [ADMIN_EMAIL, MEMBER_EMAIL, ADMIN_EMAIL, MEMBER_EMAIL]:
+        headers = dict(auth(email), Accept=accept)
+        response = client.get("/api/documents", headers=headers)
+        assert response.mimetype == accept
+        responses.append(_load(response))
+    assert [r["superuser"] for r in responses] == [True, False, True, False]
+    assert all(r["documents"] == responses[0]["documents"] for r in responses)
+
+
+def _load(response):
+    if response.mimetype == "application/json":
+        return response.json
+    import msgpack
+
+    return msgpack.unpackb(response.get_data(), timestamp=3)
+
+
+def test_apps_on_different_databases(app, client, tmp_path):
+    from app import create_app, db
+    from models import Document, User
+
+    other = create_app(
+        dict(
+            app.config,
+            SQLALCHEMY_DATABASE_URI=f"sqlite:///{tmp_path / 'other.db'}",
+            DATABASE_BACKEND="sqlite",
+        )
+    )
+    with other.app_context():
+        User.create(email=MEMBER_EMAIL, superuser=False)
+        Document.create(title="Other", author="Author", creator_email=MEMBER_EMAIL)
+    _add_document(client, "Document 0")
+
+    # Same response cache file and document table generation
+    assert other.config["RESPONSE_CACHE_PATH"] == app.config["RESPONSE_CACHE_PATH"]
+    assert _titles(client.get("/api/documents", headers=auth())) == ["Document 0"]
+    other_client = other.test_client()
+    assert _titles(other_client.get("/api/documents", headers=auth())) == ["Other"]
+    assert _titles(client.get("/api/documents", headers=auth())) == ["Document 0"]
+
+    with other.app_context():
+        db.session.remove()
+        db.engine.dispose()
@@ -0,0 +1,80 @@
+"""Tests of the json/MessagePack negotiation, see serialization.negotiated_format."""
+
+import datetime
+
+import pytest
+
+from conftest import auth
+
+msgpack = pytest.importorskip("msgpack")
+
+
+@pytest.fixture
+def document(client):
+    response = client.post(
+        "/api/documents",
+        json={"title": "Coronagraph design", "author": "Author"},
+        headers=auth(),
+    )
+    assert response.json["status"] == "success", response.json
+    documents = client.get("/api/documents", headers=auth()).json["documents"]
+    return documents[0]["doc_identifier"]
+
+
+def _get(client, path, accept):
+    return client.get(path, headers=dict(auth(), Accept=accept))
+
+
+@pytest.mark.parametrize(
+    "accept, mimetype",
+    [
+        ("application/msgpack", "application/msgpack"),
+        ("application/x-msgpack", "application/msgpack"),
+        ("application/msgpack, application/json;q=0.5", "application/msgpack"),
+        ("application/json, application/msgpack;q=0.5", "application/json"),
+        ("*/*", "application/json"),
+        ("text/html", "application/json"),
+    ],
+)
+def test_negotiation(client, document, accept, mimetype):
+    json_response = _get(client, "/api/documents", "application/json")
+    response = _get(client, "/api/documents", accept)
+
+    assert response.mimetype == mimetype
+    assert "Accept" in response.vary
+    if mimetype == "application/json":
+        assert response.json == json_response.json
+        return
+
+    body = msgpack.unpackb(response.get_data(), timestamp=3)
+    assert body["superuser"] is False
+    [decoded] = body["documents"]
+    [expected] = json_response.json["documents"]
+    assert decoded["doc_identifier"] == expected["doc_identifier"] == document
+    assert decoded["title"] == "Coronagraph design"
+    # Native timestamps rather than strings
+    assert isinstance(decoded["time_created"], datetime.datetime)
+    assert decoded["time_created"].tzinfo is not None
+
+
+def test_single_document(client, document):
+    response = _get(client, f"/api/documents/{document}", "application/msgpack")
+    assert response.mimetype == "application/msgpack"
+    assert "Accept" in response.vary
+    body = msgpack.unpackb(response.get_data(), timestamp=3)
+    assert body["document"]["title"] == "Coronagraph design"
+
+
+def test_msgpack_disabled(app, client, document):
+    app.config["MSGPACK_ENABLED"] = False
+    response = _get(client, "/api/documents", "application/msgpack")
+    assert response.mimetype == "application/json"
+    assert response.json["documents"][0]["doc_identifier"] == document
+
+
+def test_streamed_responses_are_json(client, document):
+    # Streamed lists are encoded incrementally, as json only
+    response = _get(client, "/api/documents?stream=true", "application/msgpack")
+    assert response.mimetype == "application/json"
+    assert "Accept" in response.vary
+    assert response.json["documents"][0]["doc_identifier"] == document
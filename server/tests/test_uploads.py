@@ -0,0 +1,163 @@
+"""Tests of the metadata file uploads, see Document.bulk_create and jobs.py."""
+
+import datetime
+import io
+import json
+import time
+
+from conftest import ADMIN_EMAIL, MEMBER_EMAIL, auth
+
+
+def _row(line_number, title, author="Author"):
+    return line_number, {
+        "title": title,
+        "author": author,
+        "creator_email": MEMBER_EMAIL,
+    }
+
+
+def test_failed_chunk_titles_are_not_seen(app):
+    from app import db
+    from models import Document
+
+    rows = [
+        _row(1, "Pupil mask"),
+        # NOT NULL author: the whole first chunk is rolled back
+        _row(2, "Lyot stop", author=None),
+        _row(3, "Pupil mask"),
+        _row(4, "Lyot stop"),
+    ]
+    with app.app_context():
+        outcomes = Document.bulk_create(rows, chunk_size=2)
+        db.session.commit()
+        titles = db.session.scalars(db.select(Document.title)).all()
+
+    assert [o["status"] for o in outcomes] == [
+        "failed",
+        "failed",
+        "inserted",
+        "inserted",
+    ]
+    assert sorted(titles) == ["Lyot stop", "Pupil mask"]
+
+
+def _ndjson(*titles):
+    return "\n".join(json.dumps({"title": t, "author": "Author"}) for t in titles)
+
+
+def _job(app, content, **fields):
+    from models import UploadJob
+
+    with app.app_context():
+        job = UploadJob.create(
+            creator_email=MEMBER_EMAIL,
+            filename="docs.ndjson",
+            content=content,
+            rows_parsed=len(content.splitlines()),
+            **fields,
+        )
+        return job.job_id
+
+
+def _job_progress(client, job_id):
+    response = client.get(f"/api/jobs/{job_id}", headers=auth())
+    assert response.json["status"] == "success", response.json
+    return response.json["job"]
+
+
+def test_claim(app):
+    from models import UploadJob
+
+    job_id = _job(app, _ndjson("Pupil mask"))
+    now = datetime.datetime.now(datetime.timezone.utc)
+    stale_before = now - datetime.timedelta(minutes=5)
+    with app.app_context():
+        assert UploadJob.claim(job_id, "worker-1", stale_before) is True
+        # Running with a fresh heartbeat
+        assert UploadJob.claim(job_id, "worker-2", stale_before) is False
+        assert UploadJob.get_by_job_id(job_id).worker == "worker-1"
+        assert UploadJob.claim("unknown", "worker-2", stale_before) is False
+
+
+def test_async_upload_progress(client):
+    response = client.post(
+        "/api/documents/upload_file?async=true",
+        data={
+            "file": (
+                io.BytesIO(_ndjson("Pupil mask", "Lyot stop", "Pupil mask").encode()),
+                "docs.ndjson",
+                "application/json",
+            )
+        },
+        headers=auth(),
+    )
+    assert response.status_code == 202, response.json
+    job_id = response.json["job_id"]
+
+    deadline = time.monotonic() + 10
+    job = _job_progress(client, job_id)
+    while job["status"] in ["queued", "running"] and time.monotonic() < deadline:
+        time.sleep(0.05)
+        job = _job_progress(client, job_id)
+
+    assert job["status"] == "done"
+    assert job["rows_parsed"] == job["rows_processed"] == 3
+    assert (job["inserted"], job["duplicates"], job["failed"]) == (2, 1, 0)
+    # Only the creator and superusers see the job
+    response = client.get(f"/api/jobs/{job_id}", headers=auth(ADMIN_EMAIL))
+    assert response.status_code == 200
+    client.post(
+        "/api/users",
+        json={"email": "other@test.org", "superuser": False},
+        headers=auth(ADMIN_EMAIL),
+    )
+    response = client.get(f"/api/jobs/{job_id}", headers=auth("other@test.org"))
+    assert response.status_code == 404
+
+
+def test_resume_from_next_row(app, client):
+    import jobs
+    from app import db
+    from models import Document
+
+    # The first two rows were processed before the job was interrupted
+    content = _ndjson("Pupil mask", "Lyot stop", "Field stop", "Pupil mask")
+    job_id = _job(app, content, next_row=2, inserted=2)
+    with app.app_context():
+        for title in ["Pupil mask", "Lyot stop"]:
+            Document.create(title=title, author="Author", creator_email=MEMBER_EMAIL)
+
+    jobs.run_job(app, job_id)
+
+    job = _job_progress(client, job_id)
+    assert job["status"] == "done"
+    assert job["rows_processed"] == 4
+    assert (job["inserted"], job["duplicates"], job["failed"]) == (3, 1, 0)
+    with app.app_context():
+        titles = db.session.scalars(db.select(Document.title)).all()
+    assert sorted(titles) == ["Field stop", "Lyot stop", "Pupil mask"]
+
+
+def test_reclaim_stale_job(app, client):
+    import jobs
+    from app import db
+    from models import UploadJob
+
+    job_id = _job(app, _ndjson("Pupil mask"))
+    now = datetime.datetime.now(datetime.timezone.utc)
+    with app.app_context():
+        UploadJob.claim(job_id, "other-worker", now - datetime.timedelta(minutes=5))
+
+    # The other worker is alive
+    jobs.run_job(app, job_id)
+    assert _job_progress(client, job_id)["status"] == "running"
+
+    # Its heartbeat is older than UPLOAD_JOB_STALE_SECONDS
+    with app.app_context():
+        job = UploadJob.get_by_job_id(job_id)
+        job.heartbeat = now - datetime.timedelta(hours=1)
+        db.session.commit()
+    jobs.run_job(app, job_id)
+    job = _job_progress(client, job_id)
+    assert job["status"] == "done"
+    assert job["inserted"] == 1
@@ -0,0 +1,174 @@
+import hashlib
+import threading
+import time
+
+from cache import LRUCache
+
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("logger")
+
+# Verified tokens, keyed by the sha256 of the raw token. Entries expire at the
+# token's own 'exp' claim, so a cached token is never accepted past its lifetime.
+token_cache = LRUCache(maxsize=1024)
+
+_key_refresher = None
+_key_refresher_lock = threading.Lock()
+
+
+def init_app(app):
+    """
+    Configure the verified-token cache from the Flask app config.
+
+    Parameters
+    ----------
+    app : Flask
+        Flask app whose config holds the TOKEN_CACHE_* settings.
+    """
+    token_cache.maxsize = app.config.setdefault("TOKEN_CACHE_SIZE", 1024)
+    app.config.setdefault("TOKEN_KEY_REFRESH_INTERVAL", 3600)
+    app.config.setdefault("TOKEN_KEY_PREFETCH", True)
+
+
+def get_firebase_app():
+    """
+    Return the default Firebase app, initializing it if needed. firebase_admin
+    is only imported here and in the functions verifying tokens, so importing
+    this module stays cheap.
+
+    Returns
+    -------
+    firebase_admin.App
+        Default Firebase app.
+    """
+    import firebase_admin
+
+    try:
+        return firebase_admin.get_app()
+    except ValueError:
+        return firebase_admin.initialize_app()
+
+
+def init_firebase(app):
+    """
+    Initialize the Firebase app and, if TOKEN_KEY_PREFETCH is set, start the
+    public key refresher, so the first request does not pay for either.
+    Called by the app's startup hook.
+
+    Parameters
+    ----------
+    app : Flask
+        Flask app whose config holds the TOKEN_KEY_* settings.
+    """
+    get_firebase_app()
+    if app.config["TOKEN_KEY_PREFETCH"]:
+        start_key_refresher(app.config["TOKEN_KEY_REFRESH_INTERVAL"])
+
+
+def _hash_token(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def verify_token(token):
+    """
+    Verify a Firebase ID token, skipping the signature checks if the same
+    token was already verified and has not yet expired.
+
+    Parameters
+    ----------
+    token : str
+        Raw Firebase ID token.
+
+    Returns
+    -------
+    dict
+        Decoded token claims.
+
+    Raises
+    ------
+    Exception
+        Any exception raised by firebase_admin.auth.verify_id_token for
+        tokens that are not in the cache.
+    """
+    key = _hash_token(token)
+    claims = token_cache.get(key)
+    if claims is not None:
+        return dict(claims)
+
+    from firebase_admin import auth
+
+    get_firebase_app()
+    claims = auth.verify_id_token(token)
+
+    expires_at = claims.get("exp")
+    if expires_at and expires_at > time.time():
+        token_cache.set(key, dict(claims), expires_at=expires_at)
+    return claims
+
+
+def _fetch_public_keys(firebase_app):
+    """
+    Fetch Google's token signing certificates through the token verifier's own
+    HTTP session, so that its cache-control cache is warm when tokens are
+    verified.
+
+    Returns
+    -------
+    bool
+        False if this firebase_admin version does not have the internals used,
+        True otherwise.
+    """
+    from firebase_admin import _token_gen, auth
+
+    # Private firebase_admin internals, as of the pinned firebase-admin==6.5.0
+    # (see requirements.txt). Check them again when upgrading firebase-admin.
+    if not hasattr(auth, "_get_client") or not hasattr(
+        _token_gen, "ID_TOKEN_CERT_URI"
+    ):
+        return False
+    verifier = getattr(auth._get_client(firebase_app), "_token_verifier", None)
+    request = getattr(verifier, "request", None)
+    if request is None:
+        return False
+    request(_token_gen.ID_TOKEN_CERT_URI)
+    return True
+
+
+def _refresh_public_keys(firebase_app, interval):
+    while True:
+        try:
+            if not _fetch_public_keys(firebase_app):
+                logger.warning(
+                    "Tokens: Cannot prefetch public keys with this firebase_admin "
+                    "version, keys are fetched when tokens are verified."
+                )
+                return
+            logger.info("Tokens: Refreshed public keys.")
+        except Exception as e:
+            logger.error(f"Tokens: Refreshing public keys. Error: {e}")
+        time.sleep(interval)
+
+
+def start_key_refresher(interval=3600):
+    """
+    Start (once per process) a daemon thread that prefetches and periodically
+    refreshes the public keys used to verify ID tokens.
+
+    Parameters
+    ----------
+    interval : int / float
+        Number of seconds between two refreshes.
+    """
+    global _key_refresher
+
+    with _key_refresher_lock:
+        if _key_refresher is not None:
+            return
+        _key_refresher = threading.Thread(
+            target=_refresh_public_keys,
+            args=(get_firebase_app(), interval),
+            name="token-key-refresher",
+            daemon=True,
+        )
+        _key_refresher.start()
@@ -0,0 +1,170 @@
+import csv
+import io
+import json
+import os
+
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("logger")
+
+# Columns of a metadata file line, in order, separated by '|'
+UPLOAD_COLUMNS = ["title", "author", "doc_code", "compiled_url", "source_url", "abstract"]
+
+# Upload formats by file extension, other files are parsed as '|' separated
+UPLOAD_FORMATS = {".csv": "csv", ".ndjson": "ndjson", ".jsonl": "ndjson"}
+
+
+def parse_metadata_lines(lines):
+    """
+    Parse the lines of an uploaded metadata file. Blank lines and lines
+    starting with '#' are ignored.
+
+    Parameters
+    ----------
+    lines : iterable
+        Lines of the file, as bytes or str.
+
+    Returns
+    -------
+    list
+        List of (line number, fields dict) tuples, line numbers starting at 1.
+
+    Raises
+    ------
+    ValueError
+        Raised if a line does not have the expected number of columns.
+    """
+    rows = []
+    for line_number, line in enumerate(lines, start=1):
+        if isinstance(line, bytes):
+            line = line.decode()
+
+        if not line.strip() or line.strip()[0] == "#":
+            continue
+
+        columns = line.split("|")
+        if len(columns) != len(UPLOAD_COLUMNS):
+            raise ValueError(
+                f"Line {line_number} has {len(columns)} columns, "
+                f"expected {len(UPLOAD_COLUMNS)}"
+            )
+
+        fields = {name: value.strip() for name, value in zip(UPLOAD_COLUMNS, columns)}
+        rows.append((line_number, fields))
+    return rows
+
+
+def _field(value):
+    return "" if value is None else str(value).strip()
+
+
+def parse_csv(text):
+    """
+    Parse an uploaded CSV file, e.g. one exported from /documents/export.
+    The first row is a header of column names; it must have a 'title'
+    column, and columns other than UPLOAD_COLUMNS are ignored.
+
+    Parameters
+    ----------
+    text : str
+        Content of the file.
+
+    Returns
+    -------
+    list
+        List of (line number, fields dict) tuples, line numbers starting at 1.
+
+    Raises
+    ------
+    ValueError
+        Raised if the header has no title column or a row is malformed.
+    """
+    reader = csv.DictReader(io.StringIO(text))
+    if not reader.fieldnames or "title" not in reader.fieldnames:
+        raise ValueError("The CSV header must have a title column")
+
+    rows = []
+    try:
+        for record in reader:
+            if not any(record.values()):
+                continue
+            fields = {name: _field(record.get(name)) for name in UPLOAD_COLUMNS}
+            # reader.line_num is the last line of the record
+            rows.append((reader.line_num, fields))
+    except csv.Error as e:
+        raise ValueError(f"Line {reader.line_num} is not valid CSV: {e}")
+    return rows
+
+
+def parse_ndjson_lines(lines):
+    """
+    Parse the lines of an uploaded NDJSON file, e.g. one exported from
+    /documents/export: one json object per line. Blank lines are ignored,
+    and keys other than UPLOAD_COLUMNS are ignored.
+
+    Parameters
+    ----------
+    lines : iterable
+        Lines of the file, as str.
+
+    Returns
+    -------
+    list
+        List of (line number, fields dict) tuples, line numbers starting at 1.
+
+    Raises
+    ------
+    ValueError
+        Raised if a line is not a json object.
+    """
+    rows = []
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        if not isinstance(record, dict):
+            raise ValueError(f"Line {line_number} is not a json object")
+        fields = {name: _field(record.get(name)) for name in UPLOAD_COLUMNS}
+        rows.append((line_number, fields))
+    return rows
+
+
+def parse_upload(filename, content):
+    """
+    Parse an uploaded metadata file, in the format given by its extension:
+    CSV (.csv), NDJSON (.ndjson, .jsonl) or '|' separated (anything else).
+
+    Parameters
+    ----------
+    filename : str
+        Name of the uploaded file.
+    content : bytes or str
+        Content of the file.
+
+    Returns
+    -------
+    list
+        List of (line number, fields dict) tuples, line numbers starting at 1.
+
+    Raises
+    ------
+    ValueError
+        Raised if the file is malformed.
+    """
+    if isinstance(content, bytes):
+        try:
+            content = content.decode("utf-8-sig")
+        except UnicodeDecodeError:
+            raise ValueError("The file is not UTF-8 encoded text")
+
+    extension = os.path.splitext(filename or "")[1].lower()
+    upload_format = UPLOAD_FORMATS.get(extension)
+    if upload_format == "csv":
+        return parse_csv(content)
+    if upload_format == "ndjson":
+        return parse_ndjson_lines(content.splitlines())
+    return parse_metadata_lines(content.splitlines())
@@ -1,12 +1,35 @@
 from functools import wraps
+import datetime
+import hashlib
 import logging
 
-from flask import jsonify, request
+from flask import current_app, jsonify, request, Response
 from flask.views import MethodView
-import firebase_admin
-from firebase_admin import auth
 
-from models import db, Document, User, Domain, get_entity, is_superuser
+import compression
+import database
+import export
+import jobs
+import metrics
+import serialization
+from response_cache import apply_flag, encode_entry, request_key, response_cache
+from query_log import query_stats
+from models import (
+    db,
+    Document,
+    User,
+    Domain,
+    LinkStatus,
+    TableGeneration,
+    UploadJob,
+    entity_cache,
+    get_entity,
+    is_superuser,
+)
+from pagination import decode_sync_token, encode_sync_token, InvalidCursor
+from streaming import json_list_response
+from uploads import parse_upload
+import tokens
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("logger")
@@ -15,11 +38,6 @@ logger = logging.getLogger("logger")
 def token_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        try:
-            firebase_admin.get_app()
-        except Exception as e:
-            firebase_admin.initialize_app()
-
         token = request.headers.get("Authorization")
 
         if token:
@@ -27,11 +45,12 @@ def token_required(f):
 
             try:
                 # decoded_token = auth.verify_id_token(token, check_revoked=True)
-                decoded_token = auth.verify_id_token(token)
+                decoded_token = tokens.verify_token(token)
             except Exception as e:
                 logger.error(
                     f"TokenRequired: Error in decoding user token:\nmessage: {e}\n"
                 )
+                metrics.record_auth("invalid_token")
                 return {
                     "status": "fail",
                     "message": "Resource not available",
@@ -46,6 +65,7 @@ def token_required(f):
 
                 entity = get_entity(email)
                 if not entity:
+                    metrics.record_auth("unknown_user")
                     return {
                         "status": "fail",
                         "message": "Not authorized",
@@ -53,9 +73,11 @@ def token_required(f):
                     }, 401
                 setattr(request, "entity", entity)
 
+                metrics.record_auth("success")
                 return f(*args, **kwargs)
 
         logger.error("TokenRequired: No token found with request.")
+        metrics.record_auth("missing_token")
         return {
             "status": "fail",
             "message": "Resource not available",
@@ -81,6 +103,186 @@ def superuser(f):
     return decorated_function
 
 
+def _is_local_request():
+    # Requests proxied by nginx (see nginx/default.conf) come from the loopback
+    # address too, but carry the client's address in these headers
+    if request.headers.get("X-Forwarded-For") or request.headers.get("X-Real-IP"):
+        return False
+    return request.remote_addr in ["127.0.0.1", "::1"]
+
+
+def superuser_or_local(f):
+    """
+    Decorator requiring a superuser token. With METRICS_ALLOW_LOCAL set
+    (False by default), requests made directly from the local host, e.g. by a
+    Prometheus agent running next to the app, are let through without a
+    token. Requests forwarded by a reverse proxy never count as local.
+    """
+    protected = token_required(superuser(f))
+
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if current_app.config.get("METRICS_ALLOW_LOCAL") and _is_local_request():
+            return f(*args, **kwargs)
+        return protected(*args, **kwargs)
+
+    return decorated_function
+
+
+def _validators(table_names, view_args):
+    """
+    Compute the ETag and Last-Modified values of a response from the change
+    generations of the tables it is built from.
+
+    The ETag also covers everything else the response depends on: the
+    database, the view, its arguments, the query string, the requesting
+    user's superuser flag and the negotiated representation (json or
+    MessagePack).
+
+    Last-Modified is None if a table has never been written to or was written
+    to within the current second.
+
+    Returns
+    -------
+    tuple
+        (ETag value, Last-Modified datetime or None)
+    """
+    generations = TableGeneration.get_generations(table_names)
+    variant = "|".join(
+        [
+            current_app.config["SQLALCHEMY_DATABASE_URI"],
+            request.endpoint,
+            repr(sorted(view_args.items())),
+            request.query_string.decode(),
+            str(is_superuser(getattr(request, "entity", None))),
+            serialization.negotiated_format(),
+        ]
+    )
+    digest = hashlib.sha1(variant.encode()).hexdigest()[:12]
+    etag = "-".join([str(generations[t][0]) for t in table_names] + [digest])
+
+    times = [t for _, t in generations.values() if t is not None]
+    last_modified = None
+    if len(times) == len(table_names):
+        # Naive datetimes from SQLite are UTC
+        last_modified = max(
+            t if t.tzinfo else t.replace(tzinfo=datetime.timezone.utc) for t in times
+        ).replace(microsecond=0)
+        # Last-Modified has a one second resolution: until that second is
+        # over, another write could land in it without changing the header,
+        # and If-Modified-Since revalidations would get a 304 for stale data
+        now = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+        if last_modified >= now:
+            last_modified = None
+    return etag, last_modified
+
+
+def conditional(*table_names):
+    """
+    Decorator for view methods whose response only depends on the given tables.
+    Adds ETag and Last-Modified headers to the response, and answers requests
+    with a matching If-None-Match or If-Modified-Since header with a 304,
+    without calling the view method.
+    """
+
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            etag, last_modified = _validators(table_names, kwargs)
+
+            not_modified = False
+            if request.if_none_match:
+                # Compressed representations have their encoding as suffix
+                not_modified = any(
+                    request.if_none_match.contains(variant)
+                    for variant in compression.etag_variants(etag)
+                )
+            elif request.if_modified_since and last_modified:
+                not_modified = last_modified <= request.if_modified_since
+
+            if not_modified:
+                response = Response(status=304)
+            else:
+                response = current_app.make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag)
+            response.vary.add("Accept")
+            if last_modified:
+                response.last_modified = last_modified
+            return response
+
+        return decorated_function
+
+    return decorator
+
+
+def cached(*table_names):
+    """
+    Decorator for view methods whose response only depends on the given
+    tables and, through its 'superuser' flag, on whether the requesting user
+    is a superuser. Responses are stored in the shared response cache, see
+    response_cache.request_key, and the flag of the requesting user is
+    applied to the cached body. The view method must return its response
+    object as a dict to be cached; other return values, such as error
+    tuples or streamed responses, are passed through.
+    """
+
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if not response_cache.enabled:
+                return f(*args, **kwargs)
+
+            superuser = is_superuser(getattr(request, "entity", None))
+            key = request_key(table_names, kwargs)
+            entry = response_cache.get(key)
+            if entry is not None:
+                body, mimetype, flag_offset, flag_length = entry
+                logger.info(
+                    f"Cache: User {getattr(request, 'email', None)} is served "
+                    f"{request.endpoint} from the response cache."
+                )
+                body = apply_flag(body, flag_offset, flag_length, superuser)
+                return current_app.json.body_response(body, mimetype)
+
+            response_object = f(*args, **kwargs)
+            if not isinstance(response_object, dict):
+                return response_object
+            body, mimetype, flag_offset, flag_length = encode_entry(response_object)
+            response_cache.set(key, body, mimetype, flag_offset, flag_length)
+            body = apply_flag(body, flag_offset, flag_length, superuser)
+            return current_app.json.body_response(body, mimetype)
+
+        return decorated_function
+
+    return decorator
+
+
+def _filters():
+    """
+    Return the column filters of the request, given as 'filter[<column>]'
+    query parameters, as accepted by Document.apply_filters.
+
+    Raises
+    ------
+    ValueError
+        Raised if a column cannot be filtered by.
+    """
+    filters = {}
+    for key, value in request.args.items():
+        if key.startswith("filter[") and key.endswith("]"):
+            name = key[len("filter[") : -1]
+            if name not in Document.FILTER_COLUMNS:
+                raise ValueError(
+                    f"Cannot filter by {name}, "
+                    f"filter columns are {Document.FILTER_COLUMNS}"
+                )
+            filters[name] = value
+    return filters
+
+
 # sanity check route
 class Ping(MethodView):
     def get(self):
@@ -88,6 +290,113 @@ class Ping(MethodView):
         return jsonify("pong!")
 
 
+class Stats(MethodView):
+    """View class for the /stats route."""
+
+    decorators = [superuser, token_required]
+
+    def get(self):
+        """
+        Method with logic for get requests.
+        Get requests here return the counters of the caches and of the
+        database connection pool.
+
+        Returns
+        -------
+        json
+            Json response to get request. Contains 'status' and the
+            counters of each cache and of the connection pool.
+        """
+        response_object = {
+            "status": "success",
+            "token_cache": tokens.token_cache.stats(),
+            "entity_cache": entity_cache.stats(),
+            "db_pool": database.pool_stats(db.engine),
+            "writer_queue": database.writer_queue.stats(),
+            "compressed_cache": compression.compressed_cache.stats(),
+            "response_cache": response_cache.stats(),
+        }
+        return jsonify(response_object)
+
+
+class Metrics(MethodView):
+    """View class for the /metrics route."""
+
+    decorators = [superuser_or_local]
+
+    def get(self):
+        """
+        Method with logic for get requests.
+        Get requests here return the request, query and auth metrics of all
+        the worker processes, in the Prometheus text format.
+
+        Returns
+        -------
+        text
+            Metrics in the Prometheus text exposition format.
+        """
+        body = metrics.collect(current_app.config["METRICS_DIR"])
+        return Response(body, content_type=metrics.CONTENT_TYPE)
+
+
+class Queries(MethodView):
+    """View class for the /queries route."""
+
+    decorators = [superuser, token_required]
+
+    def get(self):
+        """
+        Method with logic for get requests.
+        Get requests here return the SQL statement fingerprints of this
+        worker process that took the most time.
+
+        Query parameters
+        ----------------
+        limit : int
+            Number of fingerprints (default 20).
+        sort : str
+            'total' (default), 'max', 'mean' or 'calls'.
+
+        Returns
+        -------
+        json
+            Json response to get request. Contains 'status' and a list of
+            the fingerprints with their number of calls and their total,
+            mean and maximum times in milliseconds.
+        """
+        sort = request.args.get("sort", "total")
+        try:
+            limit = int(request.args.get("limit", 20))
+            if limit <= 0:
+                raise ValueError("limit must be positive")
+            if sort not in ["total", "max", "mean", "calls"]:
+                raise ValueError("sort must be one of 'total', 'max', 'mean', 'calls'")
+        except ValueError as e:
+            return {"status": "fail", "message": str(e)}, 400
+
+        response_object = {
+            "status": "success",
+            "queries": query_stats.top(limit=limit, sort=sort),
+        }
+        return jsonify(response_object)
+
+    def delete(self):
+        """
+        Method with logic for delete requests.
+        Delete requests here reset the statement timings of this worker
+        process.
+
+        Returns
+        -------
+        json
+            Json response to delete request. Contains 'status' and 'message'.
+        """
+        query_stats.clear()
+        email = getattr(request, "email")
+        logger.info(f"Queries: User {email} reset the query statistics.")
+        return jsonify({"status": "success", "message": "Query statistics reset!"})
+
+
 class AllDocuments(MethodView):
     """View class for the /documents route."""
 
@@ -121,11 +430,28 @@ class AllDocuments(MethodView):
         response_object["message"] = "Document added!"
         return jsonify(response_object)
 
+    @conditional("document", "link_status")
+    @cached("document", "link_status")
     def get(self):
         """
         Method with logic for get requests.
         Get requests here return a list of all the documents in the db.
 
+        Query parameters
+        ----------------
+        fields : str
+            Comma-separated columns and presets ('summary', 'full') to
+            serialize, all columns by default. Applies to the paginated and
+            streamed variants too.
+        filter[<column>] : str
+            Only return the documents whose column contains the value,
+            ignoring case. Columns are Document.FILTER_COLUMNS. Applies to
+            the paginated and streamed variants too.
+        links : bool
+            If 'true', include the last link check results of the documents
+            as 'links', see LinkStatus.get_for_documents. Applies to the
+            paginated variant too.
+
         Returns
         -------
         json
@@ -134,14 +460,386 @@ class AllDocuments(MethodView):
         """
         entity = getattr(request, "entity")
         email = getattr(request, "email")
+        try:
+            fields = Document.resolve_fields(request.args.get("fields"))
+            filters = _filters()
+        except ValueError as e:
+            logger.info(f"AllDocuments: User {email} sent invalid request: {e}")
+            return {"status": "fail", "message": str(e)}, 400
+
+        if "limit" in request.args or "cursor" in request.args:
+            return self._get_page(entity, email, fields, filters)
+
+        if request.args.get("stream", "").lower() == "true":
+            return self._get_stream(entity, email, fields, filters)
+
         logger.info(f"AllDocuments: User {email} is viewing all documents.")
-        documents = db.session.scalars(db.select(Document).order_by(Document.time_created.asc()))
+        query = Document.apply_filters(Document.select_columns(fields), filters)
+        documents = Document.select_dicts(
+            query.order_by(Document.time_created.asc()), fields=fields
+        )
+
+        response_object = {
+            "status": "success",
+            "documents": documents,
+            "superuser": is_superuser(entity),
+        }
+        if request.args.get("links", "").lower() == "true":
+            response_object["links"] = LinkStatus.get_for_documents()
+        return response_object
+
+    def _get_stream(self, entity, email, fields=None, filters=None):
+        """
+        Streamed variant of get requests, used when the 'stream' query
+        parameter is 'true'. Documents are read from the db in batches of
+        STREAM_BATCH_SIZE and encoded incrementally, so memory use does not
+        grow with the size of the catalog.
+
+        Returns
+        -------
+        json
+            Streamed json response to get request, with the same content as
+            the unpaginated response.
+        """
+        logger.info(f"AllDocuments: User {email} is streaming all documents.")
+        batch_size = current_app.config.get("STREAM_BATCH_SIZE", 500)
+        query = Document.apply_filters(Document.select_columns(fields), filters)
+        documents = Document.iter_dicts(
+            query.order_by(Document.time_created.asc()),
+            yield_per=batch_size,
+            fields=fields,
+        )
+        fields = {"status": "success", "superuser": is_superuser(entity)}
+        return json_list_response(fields, "documents", documents)
+
+    def _get_page(self, entity, email, fields=None, filters=None):
+        """
+        Paginated variant of get requests, used when a 'limit' or 'cursor'
+        query parameter is given.
+
+        Query parameters
+        ----------------
+        limit : int
+            Number of documents per page (default 50, at most MAX_PAGE_SIZE).
+        cursor : str
+            Cursor returned as 'next_cursor' with the previous page.
+        sort : str
+            One of Document.SORT_KEYS (default 'time_created').
+        order : str
+            'asc' (default) or 'desc'.
+        total : bool
+            If 'true', include the (approximate) number of documents.
+
+        Returns
+        -------
+        json
+            Json response to get request. Contains 'status', a list of the
+            page's documents serialized and 'next_cursor', which is null on
+            the last page.
+        """
+        sort = request.args.get("sort", "time_created")
+        order = request.args.get("order", "asc")
+        max_limit = current_app.config.get("MAX_PAGE_SIZE", 1000)
+        try:
+            limit = int(request.args.get("limit", 50))
+            if not 0 < limit <= max_limit:
+                raise ValueError(f"limit must be between 1 and {max_limit}")
+            if order not in ["asc", "desc"]:
+                raise ValueError("order must be 'asc' or 'desc'")
+            if sort not in Document.SORT_KEYS:
+                raise ValueError(f"sort must be one of {Document.SORT_KEYS}")
+            documents, next_cursor = Document.get_page(
+                sort=sort,
+                descending=(order == "desc"),
+                limit=limit,
+                cursor=request.args.get("cursor"),
+                fields=fields,
+                filters=filters,
+            )
+        except ValueError as e:
+            logger.info(f"AllDocuments: User {email} sent invalid page request: {e}")
+            return {"status": "fail", "message": str(e)}, 400
 
+        logger.info(f"AllDocuments: User {email} is viewing a page of documents.")
         response_object = {
             "status": "success",
-            "documents": Document.serialize_list(documents),
+            "documents": documents,
+            "next_cursor": next_cursor,
             "superuser": is_superuser(entity),
         }
+        if request.args.get("total", "").lower() == "true":
+            response_object["total"] = Document.approximate_count()
+        if request.args.get("links", "").lower() == "true":
+            response_object["links"] = LinkStatus.get_for_documents(
+                [d["doc_identifier"] for d in documents if "doc_identifier" in d]
+            )
+        return response_object
+
+
+class SearchDocuments(MethodView):
+    """View class for the /documents/search route."""
+
+    decorators = [token_required]
+
+    def get(self):
+        """
+        Method with logic for get requests.
+        Get requests here return the documents matching the 'q' query
+        parameter, best matches first.
+
+        Query parameters
+        ----------------
+        q : str
+            Search terms, matched against title, author, doc_code,
+            doc_identifier and abstract.
+        limit : int
+            Number of documents per page (default 20, at most MAX_PAGE_SIZE).
+        offset : int
+            Number of matching documents to skip (default 0).
+
+        Returns
+        -------
+        json
+            Json response to get request. Contains 'status', a list of the
+            matching documents serialized with their 'rank', and 'total'.
+        """
+        entity = getattr(request, "entity")
+        email = getattr(request, "email")
+        query = request.args.get("q", "")
+        max_limit = current_app.config.get("MAX_PAGE_SIZE", 1000)
+        try:
+            limit = int(request.args.get("limit", 20))
+            offset = int(request.args.get("offset", 0))
+            if not 0 < limit <= max_limit:
+                raise ValueError(f"limit must be between 1 and {max_limit}")
+            if offset < 0:
+                raise ValueError("offset must be positive")
+        except ValueError as e:
+            logger.info(f"SearchDocuments: User {email} sent invalid search: {e}")
+            return {"status": "fail", "message": str(e)}, 400
+
+        logger.info(f"SearchDocuments: User {email} is searching documents.")
+        results, total = Document.search(query, limit=limit, offset=offset)
+        documents = []
+        for document, rank in results:
+            serialized = document.serialize()
+            serialized["rank"] = rank
+            documents.append(serialized)
+
+        response_object = {
+            "status": "success",
+            "documents": documents,
+            "total": total,
+            "superuser": is_superuser(entity),
+        }
+        return jsonify(response_object)
+
+
+class DocumentChanges(MethodView):
+    """View class for the /documents/changes route."""
+
+    decorators = [token_required]
+
+    @conditional("document")
+    def get(self):
+        """
+        Method with logic for get requests.
+        Get requests here return the documents created or updated and the
+        doc_identifiers of the documents deleted since the given sync token,
+        with a new sync token to send with the next request.
+
+        Query parameters
+        ----------------
+        since : str
+            Sync token returned by the previous request. Without it, or if
+            it is too old, all the documents are returned and 'resync' is
+            true: the client must then replace its copy of the catalog.
+        fields : str
+            Comma-separated columns and presets to serialize, see
+            AllDocuments.get.
+
+        Returns
+        -------
+        json
+            Json response to get request. Contains 'status', the list of
+            changed documents serialized, the list of 'deleted'
+            doc_identifiers, 'sync_token' and 'resync'.
+        """
+        entity = getattr(request, "entity")
+        email = getattr(request, "email")
+        try:
+            fields = Document.resolve_fields(request.args.get("fields"))
+            since = request.args.get("since")
+            since = decode_sync_token(since) if since else None
+        except (ValueError, InvalidCursor) as e:
+            logger.info(f"DocumentChanges: User {email} sent invalid request: {e}")
+            return {"status": "fail", "message": str(e)}, 400
+
+        documents, deleted, change_seq, resync = Document.get_changes(since, fields)
+        logger.info(
+            f"DocumentChanges: User {email} synced {len(documents)} changed and "
+            f"{len(deleted)} deleted documents (resync: {resync})."
+        )
+        response_object = {
+            "status": "success",
+            "documents": documents,
+            "deleted": deleted,
+            "sync_token": encode_sync_token(change_seq),
+            "resync": resync,
+            "superuser": is_superuser(entity),
+        }
+        return jsonify(response_object)
+
+
+class ExportDocuments(MethodView):
+    """View class for the /documents/export route."""
+
+    decorators = [token_required]
+
+    @conditional("document")
+    def get(self):
+        """
+        Method with logic for get requests.
+        Get requests here download the documents as a CSV, NDJSON or XLSX
+        file. The file is streamed from the db in batches of
+        STREAM_BATCH_SIZE, so memory use does not grow with the size of the
+        catalog. CSV and NDJSON exports can be uploaded back to
+        /documents/upload_file.
+
+        Query parameters
+        ----------------
+        format : str
+            One of 'csv' (default), 'ndjson' or 'xlsx'.
+        fields : str
+            Comma-separated columns and presets to export, see
+            AllDocuments.get.
+        filter[<column>] : str
+            Only export the documents whose column contains the value, see
+            AllDocuments.get.
+        sort : str
+            One of Document.SORT_KEYS (default 'time_created').
+        order : str
+            'asc' (default) or 'desc'.
+
+        Returns
+        -------
+        Response
+            Streamed file download.
+        """
+        email = getattr(request, "email")
+        export_format = request.args.get("format", "csv")
+        sort = request.args.get("sort", "time_created")
+        order = request.args.get("order", "asc")
+        try:
+            if export_format not in export.FORMATS:
+                raise ValueError(f"format must be one of {list(export.FORMATS)}")
+            if order not in ["asc", "desc"]:
+                raise ValueError("order must be 'asc' or 'desc'")
+            if sort not in Document.SORT_KEYS:
+                raise ValueError(f"sort must be one of {Document.SORT_KEYS}")
+            fields = Document.resolve_fields(request.args.get("fields"))
+            filters = _filters()
+        except ValueError as e:
+            logger.info(f"ExportDocuments: User {email} sent invalid export: {e}")
+            return {"status": "fail", "message": str(e)}, 400
+
+        logger.info(f"ExportDocuments: User {email} is exporting documents.")
+        key = Document._sort_key(sort)
+        if order == "desc":
+            order_by = [key.desc(), Document.pk.desc()]
+        else:
+            order_by = [key.asc(), Document.pk.asc()]
+        query = Document.apply_filters(Document.select_columns(fields), filters)
+        documents = Document.iter_dicts(
+            query.order_by(*order_by),
+            yield_per=current_app.config.get("STREAM_BATCH_SIZE", 500),
+            fields=fields,
+        )
+        return export.export_response(
+            export_format, fields or Document._get_column_names(), documents
+        )
+
+
+class BatchDocuments(MethodView):
+    """View class for the /documents/batch route."""
+
+    decorators = [token_required]
+
+    def post(self):
+        """
+        Method with logic for post requests.
+        Post requests are made here when the user updates or deletes many
+        documents at once. The documents are loaded with one query and all
+        the operations are applied in one transaction.
+
+        Request body
+        ------------
+        operations : list
+            List of objects with 'op' ('update' or 'delete'),
+            'doc_identifier' and, for updates, 'data', the new column values.
+            At most BATCH_MAX_OPERATIONS operations.
+        mode : str
+            'atomic' (default): no operation is applied unless all of them
+            succeed. 'best_effort': the operations that succeed are applied.
+
+        Returns
+        -------
+        json
+            Json response to post request. Contains 'status', 'message',
+            'counts' of operations by outcome and 'results', one per
+            operation, see Document.apply_batch.
+        """
+        email = getattr(request, "email")
+        entity = getattr(request, "entity")
+        post_data = request.get_json(silent=True) or {}
+        operations = post_data.get("operations")
+        mode = post_data.get("mode", "atomic")
+        max_operations = current_app.config.get("BATCH_MAX_OPERATIONS", 500)
+        try:
+            if not isinstance(operations, list) or not operations:
+                raise ValueError("operations must be a non-empty list")
+            if len(operations) > max_operations:
+                raise ValueError(f"At most {max_operations} operations per batch")
+            if mode not in ["atomic", "best_effort"]:
+                raise ValueError("mode must be 'atomic' or 'best_effort'")
+        except ValueError as e:
+            logger.info(f"BatchDocuments: User {email} sent invalid batch: {e}")
+            return {"status": "fail", "message": str(e)}, 400
+
+        logger.info(
+            f"BatchDocuments: User {email} is applying {len(operations)} operations."
+        )
+        response_object = {"status": "success", "message": "Batch applied!"}
+        try:
+            with database.writer_queue:
+                results = Document.apply_batch(
+                    operations,
+                    email,
+                    superuser=is_superuser(entity),
+                    atomic=(mode == "atomic"),
+                )
+                db.session.commit()
+        except Exception as e:
+            logger.error(
+                f"BatchDocuments: User {email} tried applying a batch. Error: {e}"
+            )
+            response_object["status"] = "fail"
+            response_object["message"] = "Batch could not be applied"
+            return jsonify(response_object)
+
+        counts = {}
+        for result in results:
+            counts[result["status"]] = counts.get(result["status"], 0) + 1
+        if any(r["status"] not in ["updated", "deleted"] for r in results):
+            response_object["status"] = "fail"
+            response_object["message"] = (
+                "Batch not applied"
+                if mode == "atomic"
+                else "Batch partially applied"
+            )
+
+        response_object["counts"] = counts
+        response_object["results"] = results
         return jsonify(response_object)
 
 
@@ -154,7 +852,8 @@ class UploadFile(MethodView):
         """
         Method with logic for post requests.
         Post requests are made here when the user uploads a file with
-        metadata for documents.
+        metadata for documents: '|' separated lines, or a CSV (.csv) or
+        NDJSON (.ndjson, .jsonl) file as exported from /documents/export.
 
         Returns
         -------
@@ -166,54 +865,113 @@ class UploadFile(MethodView):
         logger.info(f"UploadFile: User {email} is uploading a file.")
 
         file = request.files["file"]
-        if "text" not in file.content_type:
+        if not any(t in file.content_type for t in ["text", "csv", "json"]):
             response_object["status"] = "fail"
             return jsonify(response_object)
 
-        lines = []
-        nb_columns = 6
-        for bline in file.stream.readlines():
-            line = bline.decode()
-
-            if line.strip()[0] != "#":
-                columns = line.split("|")
+        content = file.stream.read()
+        try:
+            rows = parse_upload(file.filename, content)
+        except ValueError as e:
+            logger.info(f"UploadFile: User {email} uploaded an invalid file: {e}")
+            response_object["status"] = "fail"
+            response_object["message"] = str(e)
+            return jsonify(response_object)
 
-                if len(columns) != nb_columns:
-                    response_object["status"] = "fail"
-                    return jsonify(response_object)
+        if request.args.get("async", "").lower() == "true":
+            return self._post_job(email, file.filename, content, len(rows))
 
-                lines.append(columns)
+        for _, fields in rows:
+            fields["creator_email"] = email
 
         try:
-            for line in lines:
-                post_data = {
-                    "title": line[0].strip().strip("\n").strip(),
-                    "author": line[1].strip().strip("\n").strip(),
-                    "doc_code": line[2].strip().strip("\n").strip(),
-                    "compiled_url": line[3].strip().strip("\n").strip(),
-                    "source_url": line[4].strip().strip("\n").strip(),
-                    "abstract": line[5].strip().strip("\n").strip(),
-                    "creator_email": email,
-                }
-                kwargs = Document.prepare_fields(**post_data)
-
-                # Don't break upload, just skip the duplicated entry
-                if Document.duplicate_exists(**kwargs):
-                    continue
-
-                obj = Document(**kwargs)
-                db.session.add(obj)
-
             logger.info(f"UploadFile: User {email} adding new documents from file.")
-            db.session.commit()
+            chunk_size = current_app.config.get("UPLOAD_CHUNK_SIZE", 500)
+            with database.writer_queue:
+                results = Document.bulk_create(rows, chunk_size=chunk_size)
+                db.session.commit()
         except Exception as e:
             logger.error(
                 f"UploadFile: User {email} tried adding new"
                 f"documents from file. Errror: {e}"
             )
             response_object["status"] = "fail"
+            response_object["message"] = "Documents could not be added"
+            return jsonify(response_object)
+
+        counts = {"inserted": 0, "duplicate": 0, "failed": 0}
+        for result in results:
+            counts[result["status"]] += 1
+        if counts["failed"]:
+            response_object["status"] = "fail"
 
         response_object["message"] = "Document added!"
+        response_object["counts"] = counts
+        response_object["results"] = results
+        return jsonify(response_object)
+
+    def _post_job(self, email, filename, content, nb_rows):
+        """
+        Asynchronous variant of post requests, used when the 'async' query
+        parameter is 'true'. The file is stored and processed by the upload
+        job workers, and its progress can be polled at /jobs/<job_id>.
+
+        Returns
+        -------
+        json
+            Json response to post request. Contains 'status', 'message' and
+            the 'job_id' of the new job.
+        """
+        job = UploadJob.create(
+            creator_email=email,
+            filename=filename or "",
+            content=content.decode("utf-8-sig"),
+            rows_parsed=nb_rows,
+        )
+        if not job:
+            return {"status": "fail", "message": "Upload could not be queued"}, 500
+
+        logger.info(f"UploadFile: User {email} queued upload job {job.job_id}.")
+        jobs.submit(current_app._get_current_object(), job.job_id)
+        response_object = {
+            "status": "success",
+            "message": "Upload queued!",
+            "job_id": job.job_id,
+        }
+        return response_object, 202
+
+
+class SingleJob(MethodView):
+    """View class for the /jobs/<job_id> route."""
+
+    decorators = [token_required]
+
+    def get(self, job_id):
+        """
+        Method with logic for get requests.
+        Get requests here return the progress of the upload job with given
+        job_id. Only the user who queued the job and superusers can see it.
+
+        Parameters
+        ----------
+        job_id : str
+            job_id of the upload job.
+
+        Returns
+        -------
+        json
+            Json response to get request. Contains 'status' and the
+            serialized job.
+        """
+        entity = getattr(request, "entity")
+        email = getattr(request, "email")
+
+        job = UploadJob.get_by_job_id(job_id)
+        if not job or (job.creator_email != email and not is_superuser(entity)):
+            logger.info(f"SingleJob: User {email} tried to view inexistent job.")
+            return {"status": "fail", "message": "Job not found"}, 404
+
+        response_object = {"status": "success", "job": job.serialize()}
         return jsonify(response_object)
 
 
@@ -222,6 +980,7 @@ class SingleDocument(MethodView):
 
     decorators = [token_required]
 
+    @conditional("document", "link_status")
     def get(self, doc_identifier):
         """
         Method with logic for get requests.
@@ -232,19 +991,35 @@ class SingleDocument(MethodView):
         document_id : int / str
             Id of document entry to be updated.
 
+        Query parameters
+        ----------------
+        fields : str
+            Comma-separated columns and presets ('summary', 'full') to
+            serialize, all columns by default.
+
         Returns
         -------
         json
             Json response to get request. Contains serialized Document object
-            with given document id.
+            with given document id, and the last check results of its
+            compiled_url and source_url as 'links'.
         """
         entity = getattr(request, "entity")
         email = getattr(request, "email")
+        try:
+            fields = Document.resolve_fields(request.args.get("fields"))
+        except ValueError as e:
+            logger.info(f"SingleDocument: User {email} sent invalid fields: {e}")
+            return {"status": "fail", "message": str(e)}, 400
+
         logger.info(f"AllDocuments: User {email} is viewing all documents.")
         response_object = {"status": "success", "superuser": is_superuser(entity)}
-        document = Document.get_by_doc_identifier(doc_identifier)
+        document = Document.get_dict_by_doc_identifier(doc_identifier, fields)
         if document:
-            response_object["document"] = document.serialize()
+            response_object["document"] = document
+            response_object["links"] = LinkStatus.get_for_documents(
+                [doc_identifier]
+            ).get(doc_identifier, {})
         else:
             response_object["message"] = "No document found."
         return jsonify(response_object)
@@ -370,6 +1145,8 @@ class AllUsers(MethodView):
         response_object["message"] = "User added!"
         return jsonify(response_object)
 
+    @conditional("user")
+    @cached("user")
     def get(self):
         """
         Method with logic for get requests.
@@ -384,16 +1161,14 @@ class AllUsers(MethodView):
         entity = getattr(request, "entity")
         email = getattr(request, "email")
         logger.info(f"AllUsers: User {email} is viewing all users.")
-        users = db.session.scalars(db.select(User))
-
-        # from flask import request
+        users = User.select_dicts(User.select_columns())
 
         response_object = {
             "status": "success",
-            "collaborators": User.serialize_list(users),
+            "collaborators": users,
             "superuser": is_superuser(entity),
         }
-        return jsonify(response_object)
+        return response_object
 
 
 class AllAdmins(MethodView):
@@ -401,6 +1176,8 @@ class AllAdmins(MethodView):
 
     decorators = [token_required]
 
+    @conditional("user")
+    @cached("user")
     def get(self):
         """
         Method with logic for get requests.
@@ -421,7 +1198,7 @@ class AllAdmins(MethodView):
             "status": "success",
             "admins": admins,
         }
-        return jsonify(response_object)
+        return response_object
 
 
 class SingleUser(MethodView):
@@ -522,6 +1299,8 @@ class AllDomains(MethodView):
         response_object["message"] = "Domain added!"
         return jsonify(response_object)
 
+    @conditional("domain")
+    @cached("domain")
     def get(self):
         """
         Method with logic for get requests.
@@ -536,14 +1315,14 @@ class AllDomains(MethodView):
         entity = getattr(request, "entity")
         email = getattr(request, "email")
         logger.info(f"AllDomains: User {email} is viewing all domains.")
-        domains = db.session.scalars(db.select(Domain))
+        domains = Domain.select_dicts(Domain.select_columns())
 
         response_object = {
             "status": "success",
-            "domains": User.serialize_list(domains),
+            "domains": domains,
             "superuser": is_superuser(entity),
         }
-        return jsonify(response_object)
+        return response_object
 
 
 class SingleDomain(MethodView):